@@ -53,12 +53,12 @@ from r2.lib.db import queries
 from r2.lib.db.queries import changed
 from r2.lib import media
 from r2.lib.db import tdb_cassandra
-from r2.lib import promote
+from r2.lib import promote, ratelimit
 from r2.lib.comment_tree import delete_comment
 from r2.lib import tracking,  cssfilter, emailer
 from r2.lib.subreddit_search import search_reddits
 from r2.lib.log import log_text
-from r2.lib.filters import safemarkdown
+from r2.lib.filters import prerender_markdown, safemarkdown
 from r2.lib.scraper import str_to_image
 from r2.controllers.api_docs import api_doc, api_section
 from r2.lib.search import SearchQuery
@@ -756,10 +756,10 @@ class ApiController(RedditController, OAuth2ResourceController):
 
 	    if type in self._sr_friend_types and not c.user_is_admin:
 		quota_key = "sr%squota-%s" % (str(type), container._id36)
-		g.cache.add(quota_key, 0, time=g.sr_quota_time)
-		subreddit_quota = g.cache.incr(quota_key)
 		quota_limit = getattr(g, "sr_%s_quota" % type)
-		if subreddit_quota > quota_limit and cont.use_quotas:
+		quota = ratelimit.Limit(quota_key, quota_limit, g.sr_quota_time)
+		usage, = g.ratelimiter.record([quota])
+		if usage.exceeded and cont.use_quotas:
 		    form.set_html(".status", errors.SUBREDDIT_RATELIMIT)
 		    c.errors.add(errors.SUBREDDIT_RATELIMIT)
 		    form.set_error(errors.SUBREDDIT_RATELIMIT, None)
@@ -1181,6 +1181,7 @@ class ApiController(RedditController, OAuth2ResourceController):
             item.ignore_reports = False
 
             item._commit()
+            prerender_markdown(text)
 
             changed(item)
 
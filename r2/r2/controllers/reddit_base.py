@@ -26,7 +26,6 @@ import locale
 import re
 import simplejson
 import socket
-import time
 
 from Cookie import CookieError
 from copy import copy
@@ -45,7 +44,7 @@ from pylons.i18n import _
 from pylons.i18n.translation import LanguageError
 
 from r2.config.extensions import is_api
-from r2.lib import filters, pages, utils
+from r2.lib import filters, pages, pagecache, ratelimit, utils
 from r2.lib.authentication import authenticate_user
 from r2.lib.base import BaseController, abort
 from r2.lib.cache import make_key, MemcachedError
@@ -499,15 +498,32 @@ def set_colors():
         c.bordercolor = request.get.get('bordercolor')
 
 
-def ratelimit_agent(agent):
-    SLICE_SIZE = 10
-    slice, remainder = map(int, divmod(time.time(), SLICE_SIZE))
-    time_slice = time.gmtime(slice * SLICE_SIZE)
-    key = "rate_agent_" + agent + time.strftime("_%S", time_slice)
+AGENT_PERIOD = 10
 
-    g.cache.add(key, 0, time=SLICE_SIZE + 1)
-    if g.cache.incr(key) > SLICE_SIZE:
-        request.environ['retry_after'] = SLICE_SIZE - remainder
+# agents get AGENT_PERIOD requests per AGENT_PERIOD seconds, which the
+# shared counters can let through twice over in a burst straddling two
+# of their windows.  the local buckets never refuse a request the shared
+# counters would allow, but they refuse floods without a round trip to
+# memcache for each request.
+agent_buckets = ratelimit.LocalRateLimiter(rate=1, capacity=2 * AGENT_PERIOD)
+
+def ratelimit_agent(agents):
+    for agent in agents:
+        if not agent_buckets.allow(agent):
+            request.environ['retry_after'] = AGENT_PERIOD
+            abort(429)
+
+    limits = [ratelimit.Limit("agent-" + agent, AGENT_PERIOD, AGENT_PERIOD)
+              for agent in agents]
+    usages = g.ratelimiter.record(limits)
+
+    tightest = min(usages, key=lambda usage: usage.remaining)
+    response.headers.update(tightest.headers())
+
+    exceeded = [usage for usage in usages if usage.exceeded]
+    if exceeded:
+        request.environ['retry_after'] = max(usage.reset
+                                             for usage in exceeded)
         abort(429)
 
 appengine_re = re.compile(r'AppEngine-Google; \(\+http://code.google.com/appengine; appid: s~([a-z0-9-]{6,30})\)\Z')
@@ -521,13 +537,13 @@ def ratelimit_agents():
     appengine_match = appengine_re.match(user_agent)
     if appengine_match:
         appid = appengine_match.group(1)
-        ratelimit_agent(appid)
+        ratelimit_agent([appid])
         return
 
-    user_agent = user_agent.lower()
-    for s in g.agents:
-        if s and user_agent and s in user_agent:
-            ratelimit_agent(s)
+    matcher = ratelimit.get_agent_matcher(g.agents)
+    agents = matcher.match(user_agent.lower())
+    if agents:
+        ratelimit_agent(agents)
 
 def ratelimit_throttled():
     ip = request.ip.strip()
@@ -710,14 +726,25 @@ class MinimalController(BaseController):
     def try_pagecache(self):
         #check content cache
         if request.method.upper() == 'GET' and not c.user_is_loggedin:
-            r = g.pagecache.get(self.request_key())
-            if r:
-                r, c.cookies = r
-                response.headers = r.headers
-                response.body = r.body
-                response.status_int = r.status_int
-
-                request.environ['pylons.routes_dict']['action'] = 'cached_response'
+            routes_dict = request.environ['pylons.routes_dict']
+            page = pagecache.get(self.request_key())
+            if page:
+                if page.not_modified(request.environ.get('HTTP_IF_NONE_MATCH')):
+                    pagecache.count(routes_dict, 'not_modified')
+                    page.write_response(response, '', gzipped=False)
+                    response.status_int = 304
+                else:
+                    accept_gzip = pagecache.request_accepts_gzip(request.environ)
+                    body = page.read_body(accept_gzip)
+                    if body is None:
+                        pagecache.count(routes_dict, 'body_miss')
+                        return
+                    pagecache.count(routes_dict, 'hit')
+                    page.write_response(response, body,
+                                        gzipped=page.gzipped and accept_gzip)
+                c.cookies = page.cookies
+
+                routes_dict['action'] = 'cached_response'
                 c.request_timer.name = request_timer_name("cached_response")
 
                 c.used_cache = True
@@ -751,15 +778,28 @@ class MinimalController(BaseController):
             and response.status_int != 429
             and not response.status.startswith("5")
             and not c.is_exception_response):
+            routes_dict = request.environ['pylons.routes_dict']
+            page, body = pagecache.make_page(response, c.cookies,
+                                             g.pagecache_compress_level)
             try:
-                g.pagecache.set(self.request_key(),
-                                (response._current_obj(), c.cookies),
+                pagecache.store(self.request_key(), page, body,
                                 g.page_cache_time)
             except MemcachedError as e:
                 # this codepath will actually never be hit as long as
                 # the pagecache memcached client is in no_reply mode.
                 g.log.warning("Ignored exception (%r) on pagecache "
                               "write for %r", e, request.path)
+            pagecache.count(routes_dict, 'miss')
+            pagecache.count(routes_dict, 'raw_bytes', len(response.body))
+            pagecache.count(routes_dict, 'stored_bytes', len(body))
+
+            # send the compressed body we just made rather than having the
+            # gzip middleware (which skips responses with an ETag) redo it
+            accept_gzip = pagecache.request_accepts_gzip(request.environ)
+            if page.gzipped and accept_gzip:
+                page.write_response(response, body, gzipped=True)
+            else:
+                page.write_response(response, response.body, gzipped=False)
 
         # send cookies
         for k, v in c.cookies.iteritems():
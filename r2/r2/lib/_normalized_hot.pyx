@@ -117,3 +117,25 @@ cpdef list normalized_hot_cached(sr_ids, obey_age_limit=True):
        scores, and interleaves the results."""
     srs = Subreddit._byID(sr_ids, return_dict=False)
     return get_hot(srs, True, obey_age_limit)
+
+cpdef list normalize_hot(list tuples):
+    """Normalise the hotness of the links in a subreddit's cached hot
+       listing, as get_hot does, returning (ehot, hot, fullname,
+       epoch_seconds) tuples sorted hottest first. Unlike get_hot this
+       doesn't apply the age limit."""
+    cdef int i
+    cdef double hot
+    cdef double thot
+    cdef double ehot
+    cdef list links = []
+
+    for i, (fname, hot, es) in enumerate(tuples[:max_items]):
+        if i == 0:
+            thot = max(hot, 1.0)
+            ehot = 1.0
+        else:
+            ehot = hot/thot
+        links.append((ehot, hot, fname, es))
+
+    links.sort(reverse=True)
+    return links
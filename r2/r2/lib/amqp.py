@@ -35,6 +35,8 @@ from amqplib import client_0_8 as amqp
 
 from pylons import g
 
+from r2.lib.publisher import BatchPublisher
+
 amqp_host = g.amqp_host
 amqp_user = g.amqp_user
 amqp_pass = g.amqp_pass
@@ -46,9 +48,9 @@ stats = g.stats
 queues = g.queues
 
 #there are two ways of interacting with this module: add_item and
-#handle_items/consume_items. _add_item (the internal function for
-#adding items to amqp that are added using add_item) might block for
-#an arbitrary amount of time while trying to get a connection to amqp.
+#handle_items/consume_items. items added using add_item are published
+#in batches from the publisher's thread, which might block for an
+#arbitrary amount of time while trying to get a connection to amqp.
 
 reset_caches = g.reset_caches
 
@@ -82,7 +84,7 @@ worker = Worker()
 
 class ConnectionManager(local):
     # There should be only two threads that ever talk to AMQP: the
-    # worker thread and the foreground thread (whether consuming queue
+    # publisher thread and the foreground thread (whether consuming queue
     # items or a shell). This class is just a wrapper to make sure
     # that they get separate connections
     def __init__(self):
@@ -152,20 +154,33 @@ connection_manager = ConnectionManager()
 DELIVERY_TRANSIENT = 1
 DELIVERY_DURABLE = 2
 
+def _make_message(body, message_id, delivery_mode):
+    msg = amqp.Message(body,
+                       timestamp = datetime.now(),
+                       delivery_mode = delivery_mode)
+    if message_id:
+        msg.properties['message_id'] = message_id
+    return msg
+
+publisher = BatchPublisher(connection_manager.get_channel, _make_message,
+                           amqp_exchange,
+                           max_size = g.amqp_publisher_queue_size,
+                           batch_size = g.amqp_publisher_batch_size,
+                           block = g.amqp_publisher_block,
+                           block_timeout = g.amqp_publisher_block_timeout or None,
+                           stats = stats)
+publisher.start()
+
 def _add_item(routing_key, body, message_id = None,
               delivery_mode = DELIVERY_DURABLE):
-    """adds an item onto a queue. If the connection to amqp is lost it
-    will try to reconnect and then call itself again."""
+    """adds an item onto a queue right away. If the connection to amqp
+    is lost it will try to reconnect and then add it with add_item."""
     if not amqp_host:
         log.error("Ignoring amqp message %r to %r" % (body, routing_key))
         return
 
     chan = connection_manager.get_channel()
-    msg = amqp.Message(body,
-                       timestamp = datetime.now(),
-                       delivery_mode = delivery_mode)
-    if message_id:
-        msg.properties['message_id'] = message_id
+    msg = _make_message(body, message_id, delivery_mode)
 
     event_name = 'amqp.%s' % routing_key
     try:
@@ -183,15 +198,24 @@ def _add_item(routing_key, body, message_id = None,
         stats.event_count(event_name, 'enqueue')
 
 def add_item(routing_key, body, message_id = None, delivery_mode = DELIVERY_DURABLE):
-    if amqp_host and amqp_logging:
+    if not amqp_host:
+        log.error("Ignoring amqp message %r to %r" % (body, routing_key))
+        return
+
+    if amqp_logging:
         log.debug("amqp: adding item %r to %r" % (body, routing_key))
 
-    worker.do(_add_item, routing_key, body, message_id = message_id,
-              delivery_mode = delivery_mode)
+    publisher.add(routing_key, body, message_id, delivery_mode)
 
 def add_kw(routing_key, **kw):
     add_item(routing_key, pickle.dumps(kw))
 
+def join():
+    """wait for the worker, and for everything added with add_item to be
+    published"""
+    worker.join()
+    publisher.join()
+
 def consume_items(queue, callback, verbose=True):
     """A lighter-weight version of handle_items that uses AMQP's
        basic.consume instead of basic.get. Callback is only passed a
@@ -241,7 +265,7 @@ def consume_items(queue, callback, verbose=True):
             except KeyboardInterrupt:
                 break
     finally:
-        worker.join()
+        join()
         if chan.is_open:
             chan.close()
 
@@ -371,6 +395,6 @@ def dedup_queue(queue, rk = None, limit=None,
         for body in bodies:
             _add_item(rk, body, delivery_mode = delivery_mode)
 
-        worker.join()
+        join()
 
         chan.basic_ack(0, multiple=True)
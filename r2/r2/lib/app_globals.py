@@ -47,19 +47,23 @@ from r2.lib.cache import (
     HardCache,
     HardcacheChain,
     LocalCache,
+    LocalTierCache,
+    LRUCache,
     MemcacheChain,
     SelfEmptyingCache,
     StaleCacheChain,
 )
+from r2.lib.cache_invalidation import UDPMulticastInvalidationBus
 from r2.lib.configparse import ConfigValue, ConfigValueParser
 from r2.lib.contrib import ipaddress
 from r2.lib.countries import get_countries_and_codes
 from r2.lib.lock import make_lock_factory
 from r2.lib.manager import db_manager
 from r2.lib.plugin import PluginLoader
+from r2.lib.ratelimit import CacheBackend, RateLimiter
 from r2.lib.stats import Stats, CacheStats, StatsCollectingConnectionPool
 from r2.lib.translation import get_active_langs, I18N_PATH
-from r2.lib.utils import config_gold_price, thread_dump
+from r2.lib.utils import config_gold_price, NetworkIndex, thread_dump
 from r2.lib.zookeeper import LiveDict
 
 LIVE_CONFIG_NODE = "/config/live"
@@ -89,8 +93,17 @@ class Globals(object):
             'db_pool_size',
             'db_pool_overflow_size',
             'page_cache_time',
+            'pagecache_compress_level',
             'commentpane_cache_time',
             'num_mc_clients',
+            'local_cache_max_entries',
+            'local_cache_max_bytes',
+            'local_cache_ttl',
+            'markdown_cache_max_entries',
+            'markdown_cache_max_bytes',
+            'markdown_cache_ttl',
+            'vote_cache_max_entries',
+            'vote_cache_ttl',
             'MAX_CAMPAIGNS_PER_LINK',
             'MIN_DOWN_LINK',
             'MIN_UP_KARMA',
@@ -127,6 +140,8 @@ class Globals(object):
             'wiki_max_page_length_bytes',
             'wiki_max_page_name_length',
             'wiki_max_page_separators',
+            'amqp_publisher_queue_size',
+            'amqp_publisher_batch_size',
         ],
 
         ConfigValue.float: [
@@ -134,6 +149,7 @@ class Globals(object):
             'max_promote_bid',
             'statsd_sample_rate',
             'querycache_prune_chance',
+            'amqp_publisher_block_timeout',
         ],
 
         ConfigValue.bool: [
@@ -148,6 +164,8 @@ class Globals(object):
             'disallow_db_writes',
             'disable_ratelimit',
             'amqp_logging',
+            'amqp_publisher_block',
+            'markdown_prerender',
             'read_only_mode',
             'disable_wiki',
             'heavy_load_mode',
@@ -160,6 +178,8 @@ class Globals(object):
             'trust_local_proxies',
             'shard_link_vote_queues',
             'old_uwsgi_load_logging_config',
+            'chunked_listings',
+            'memoize_soft_expire',
         ],
 
         ConfigValue.tuple: [
@@ -170,6 +190,7 @@ class Globals(object):
             'permacache_memcaches',
             'rendercaches',
             'pagecaches',
+            'local_cache_prefixes',
             'cassandra_seeds',
             'admins',
             'sponsors',
@@ -408,7 +429,7 @@ class Globals(object):
             self.live_config = LiveConfig(self.zookeeper, LIVE_CONFIG_NODE)
             self.throttles = LiveList(self.zookeeper, "/throttles",
                                       map_fn=ipaddress.ip_network,
-                                      reduce_fn=ipaddress.collapse_addresses)
+                                      reduce_fn=NetworkIndex)
             self.banned_domains = LiveDict(self.zookeeper, 
                                            "/banned-domains",
                                            watch=True)
@@ -417,7 +438,7 @@ class Globals(object):
             parser = ConfigParser.RawConfigParser()
             parser.read([self.config["__file__"]])
             self.live_config = extract_live_config(parser, self.plugins)
-            self.throttles = tuple()  # immutable since it's not real
+            self.throttles = NetworkIndex()  # immutable since it's not real
             self.banned_domains = dict()
         self.startup_timer.intermediate("zookeeper")
 
@@ -510,16 +531,52 @@ class Globals(object):
         localcache_cls = (SelfEmptyingCache if self.running_as_script
                           else LocalCache)
 
+        # a process-wide LRU in front of memcache for rarely changing keys
+        # (subreddits and the like) that are read on nearly every request
+        if self.local_cache_max_entries and self.local_cache_prefixes:
+            self.local_lru = LRUCache(
+                max_entries=self.local_cache_max_entries,
+                max_bytes=self.local_cache_max_bytes or None,
+                max_ttl=self.local_cache_ttl,
+            )
+            self.local_lru.stats = self.stats
+
+            # tell the other app processes about our writes so they can
+            # drop their copies rather than waiting for them to expire
+            invalidation_addr = self.config.get('local_cache_invalidation_addr')
+            if invalidation_addr:
+                group, port = invalidation_addr.split(':')
+                self.cache_invalidation_bus = UDPMulticastInvalidationBus(
+                    group, int(port))
+                self.cache_invalidation_bus.stats = self.stats
+            else:
+                self.cache_invalidation_bus = None
+
+            data_memcache = LocalTierCache(
+                self.local_lru,
+                self.memcache,
+                self.local_cache_prefixes,
+                bus=self.cache_invalidation_bus,
+            )
+        else:
+            self.local_lru = None
+            self.cache_invalidation_bus = None
+            data_memcache = self.memcache
+
         if stalecaches:
             self.cache = StaleCacheChain(
                 localcache_cls(),
                 stalecaches,
-                self.memcache,
+                data_memcache,
             )
         else:
-            self.cache = MemcacheChain((localcache_cls(), self.memcache))
+            self.cache = MemcacheChain((localcache_cls(), data_memcache))
         self.cache_chains.update(cache=self.cache)
 
+        # rate limit counters go straight to memcache, they're read and
+        # written once per request
+        self.ratelimiter = RateLimiter(CacheBackend(self.memcache))
+
         self.rendercache = MemcacheChain((
             localcache_cls(),
             rendercaches,
@@ -532,6 +589,22 @@ class Globals(object):
         ))
         self.cache_chains.update(pagecache=self.pagecache)
 
+        # rendered markdown (see r2.lib.filters.render_markdown). it's keyed
+        # by a hash of the source, so the hottest entries can be kept in
+        # process for as long as they stay hot
+        if self.markdown_cache_max_entries:
+            self.markdowncache = LocalTierCache(
+                LRUCache(
+                    max_entries=self.markdown_cache_max_entries,
+                    max_bytes=self.markdown_cache_max_bytes or None,
+                    max_ttl=self.markdown_cache_ttl,
+                ),
+                rendercaches,
+                prefixes=[''],
+            )
+        else:
+            self.markdowncache = rendercaches
+
         # the thing_cache is used in tdb_cassandra.
         self.thing_cache = CacheChain((localcache_cls(),))
         self.cache_chains.update(thing_cache=self.thing_cache)
@@ -557,7 +630,11 @@ class Globals(object):
         # around 'cache_chains' without being able to call getattr on
         # 'g'
         cache_chains = self.cache_chains.copy()
+        cache_invalidation_bus = self.cache_invalidation_bus
         def reset_caches():
+            if cache_invalidation_bus:
+                # (re)join the invalidation group if we've forked
+                cache_invalidation_bus.start()
             for name, chain in cache_chains.iteritems():
                 chain.reset()
                 chain.stats = CacheStats(self.stats, name)
@@ -22,6 +22,9 @@
 
 from threading import local
 from hashlib import md5
+import collections
+import threading
+from time import time as _time
 import cPickle as pickle
 from copy import copy
 
@@ -367,7 +370,10 @@ class CacheChain(CacheUtils, local):
                 if not allow_local and isinstance(c,LocalCache):
                     continue
 
-                val = c.get(key)
+                if isinstance(c, LocalTierCache):
+                    val = c.get(key, allow_local=allow_local)
+                else:
+                    val = c.get(key)
 
                 if val is not None:
                     if not c.permanent:
@@ -417,7 +423,10 @@ class CacheChain(CacheUtils, local):
             if len(out) == len(keys):
                 # we've found them all
                 break
-            r = c.simple_get_multi(need)
+            if isinstance(c, LocalTierCache):
+                r = c.simple_get_multi(need, allow_local=allow_local)
+            else:
+                r = c.simple_get_multi(need)
             #update other caches
             if r:
                 if not c.permanent:
@@ -555,7 +564,11 @@ class StaleCacheChain(CacheChain):
                 keys.remove(k)
 
         if keys:
-            values = self.realcache.simple_get_multi(keys)
+            if isinstance(self.realcache, LocalTierCache):
+                values = self.realcache.simple_get_multi(
+                    keys, allow_local=kw.get('allow_local', True))
+            else:
+                values = self.realcache.simple_get_multi(keys)
             if values and stale:
                 self.stalecache.set_multi(values, time=self.staleness)
             self.localcache.update(values)
@@ -833,6 +846,297 @@ class SelfEmptyingCache(LocalCache):
         self.maybe_reset()
         return LocalCache.add(self, key, val)
 
+class LRUCache(CacheUtils):
+    """A process-wide cache bounded by entry count and size in bytes.
+
+    Unlike LocalCache, this isn't reset between requests, so it's shared
+    by every thread in the process and must be safe to use concurrently.
+    Values are stored pickled so that every get returns a private copy that
+    callers may freely modify.  Each entry expires after the time it was set
+    with, but never later than max_ttl seconds, and the least recently used
+    entries are evicted to make room for new ones.
+
+    If `stats` is set, hits, misses and evictions are counted as
+    local_lru.* cache stats.
+
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=None, max_ttl=60):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_ttl = max_ttl
+        self.lock = threading.Lock()
+        self.data = collections.OrderedDict()
+        self.size = 0
+        self.stats = None
+
+    def _count(self, name, delta=1):
+        if self.stats and delta:
+            self.stats.cache_count('local_lru.%s' % name, delta=delta)
+
+    def _remove(self, key):
+        # must be called with the lock held
+        expires, pickled = self.data.pop(key)
+        self.size -= len(pickled)
+
+    def _get(self, key, now):
+        # must be called with the lock held
+        try:
+            expires, pickled = self.data.pop(key)
+        except KeyError:
+            return None
+
+        if expires < now:
+            self.size -= len(pickled)
+            return None
+
+        # reinsert to mark it as the most recently used
+        self.data[key] = (expires, pickled)
+        return pickled
+
+    def get(self, key, default=None):
+        with self.lock:
+            pickled = self._get(key, _time())
+
+        if pickled is None:
+            self._count('miss')
+            return default
+
+        self._count('hit')
+        return pickle.loads(pickled)
+
+    def simple_get_multi(self, keys):
+        now = _time()
+        found = {}
+        with self.lock:
+            for key in keys:
+                pickled = self._get(key, now)
+                if pickled is not None:
+                    found[key] = pickled
+
+        self._count('hit', len(found))
+        self._count('miss', len(keys) - len(found))
+        return dict((key, pickle.loads(pickled))
+                    for key, pickled in found.iteritems())
+
+    def set(self, key, val, time=0):
+        ttl = min(time, self.max_ttl) if time else self.max_ttl
+        pickled = pickle.dumps(val, pickle.HIGHEST_PROTOCOL)
+        if self.max_bytes and len(pickled) > self.max_bytes:
+            self.delete(key)
+            return
+
+        evicted = 0
+        with self.lock:
+            if key in self.data:
+                self._remove(key)
+            self.data[key] = (_time() + ttl, pickled)
+            self.size += len(pickled)
+
+            while (len(self.data) > self.max_entries or
+                   (self.max_bytes and self.size > self.max_bytes)):
+                oldest = next(iter(self.data))
+                self._remove(oldest)
+                evicted += 1
+
+        self._count('eviction', evicted)
+
+    def set_multi(self, keys, prefix='', time=0):
+        for k, v in keys.iteritems():
+            self.set(prefix + str(k), v, time=time)
+
+    def add(self, key, val, time=0):
+        with self.lock:
+            if self._get(key, _time()) is not None:
+                return False
+        self.set(key, val, time=time)
+        return True
+
+    def delete(self, key, time=0):
+        with self.lock:
+            if key in self.data:
+                self._remove(key)
+
+    def delete_multi(self, keys, prefix=''):
+        with self.lock:
+            for key in keys:
+                key = prefix + str(key)
+                if key in self.data:
+                    self._remove(key)
+
+    def flush_all(self):
+        with self.lock:
+            self.data.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return "<LRUCache(%d entries, %d bytes)>" % (len(self.data),
+                                                     self.size)
+
+
+class LocalTierCache(CacheUtils):
+    """Puts a process-wide LRUCache in front of another cache.
+
+    Only keys starting with one of `prefixes` are stored in the local tier.
+    Writes made through this object update or drop the local copy, and if
+    an invalidation `bus` (see r2.lib.cache_invalidation) is given, are
+    announced to the other processes so they drop theirs.  Without a bus,
+    other processes' writes aren't seen until the local copy expires, so
+    the local tier's max_ttl bounds how stale it can get.
+
+    Reads with allow_local=False skip the local tier (though they still
+    refresh it), for callers like Thing._other_self that need the latest
+    copy.
+
+    """
+
+    def __init__(self, local, remote, prefixes, bus=None):
+        self.local = local
+        self.remote = remote
+        self.prefixes = tuple(prefixes)
+        self.bus = bus
+        if bus:
+            bus.subscribe(self.local.delete_multi)
+
+    def _is_local(self, key):
+        return key.startswith(self.prefixes)
+
+    def _local_keys(self, keys, prefix=''):
+        return [key for key in (prefix + str(k) for k in keys)
+                if self._is_local(key)]
+
+    def _set_local(self, key, val):
+        if self.bus:
+            # listen for peers' invalidations before holding a copy
+            self.bus.start()
+        self.local.set(key, val)
+
+    def _invalidate_peers(self, keys):
+        if self.bus and keys:
+            self.bus.publish(keys)
+
+    def _drop_local(self, keys, prefix=''):
+        keys = self._local_keys(keys, prefix)
+        if keys:
+            self.local.delete_multi(keys)
+            self._invalidate_peers(keys)
+
+    def get(self, key, default=None, allow_local=True):
+        if allow_local and self._is_local(key):
+            val = self.local.get(key)
+            if val is not None:
+                return val
+
+        val = self.remote.get(key)
+        if val is None:
+            return default
+
+        if self._is_local(key):
+            self._set_local(key, val)
+        return val
+
+    def simple_get_multi(self, keys, allow_local=True):
+        keys = set(keys)
+        local_keys = ([key for key in keys if self._is_local(key)]
+                      if allow_local else [])
+        ret = self.local.simple_get_multi(local_keys) if local_keys else {}
+
+        need = keys - set(ret)
+        if need:
+            fetched = self.remote.simple_get_multi(need)
+            for key, val in fetched.iteritems():
+                if self._is_local(key):
+                    self._set_local(key, val)
+            ret.update(fetched)
+        return ret
+
+    def get_multi(self, keys, prefix='', allow_local=True):
+        l = lambda ks: self.simple_get_multi(ks, allow_local=allow_local)
+        return prefix_keys(keys, prefix, l)
+
+    def set(self, key, val, time=0):
+        ret = self.remote.set(key, val, time=time)
+        if self._is_local(key):
+            self.local.set(key, val, time=time)
+            self._invalidate_peers([key])
+        return ret
+
+    def set_multi(self, keys, prefix='', time=0):
+        ret = self.remote.set_multi(keys, prefix=prefix, time=time)
+        written = []
+        for k, v in keys.iteritems():
+            key = prefix + str(k)
+            if self._is_local(key):
+                self.local.set(key, v, time=time)
+                written.append(key)
+        self._invalidate_peers(written)
+        return ret
+
+    def add(self, key, val, time=0):
+        ret = self.remote.add(key, val, time=time)
+        self._drop_local([key])
+        return ret
+
+    def add_multi(self, keys, prefix='', time=0):
+        ret = self.remote.add_multi(keys, prefix=prefix, time=time)
+        self._drop_local(keys, prefix)
+        return ret
+
+    def incr(self, key, delta=1, time=0):
+        ret = self.remote.incr(key, delta=delta, time=time)
+        self._drop_local([key])
+        return ret
+
+    def incr_multi(self, keys, prefix='', delta=1):
+        ret = self.remote.incr_multi(keys, prefix=prefix, delta=delta)
+        self._drop_local(keys, prefix)
+        return ret
+
+    def append(self, key, val, time=0):
+        ret = self.remote.append(key, val, time=time)
+        self._drop_local([key])
+        return ret
+
+    def prepend(self, key, val, time=0):
+        ret = self.remote.prepend(key, val, time=time)
+        self._drop_local([key])
+        return ret
+
+    def replace(self, key, val, time=0):
+        ret = self.remote.replace(key, val, time=time)
+        self._drop_local([key])
+        return ret
+
+    def decr(self, key, delta=1):
+        ret = self.remote.decr(key, delta)
+        self._drop_local([key])
+        return ret
+
+    def delete(self, key, time=0):
+        ret = self.remote.delete(key)
+        self._drop_local([key])
+        return ret
+
+    def delete_multi(self, keys, prefix=''):
+        ret = self.remote.delete_multi(keys, prefix=prefix)
+        self._drop_local(keys, prefix)
+        return ret
+
+    def flush_all(self):
+        # the bus only carries keys, so other processes' local tiers are
+        # left to expire
+        ret = self.remote.flush_all()
+        self.local.flush_all()
+        return ret
+
+    def __repr__(self):
+        return '<%s(%r, %r)>' % (self.__class__.__name__,
+                                 self.local, self.remote)
+
+
 def make_key(iden, *a, **kw):
     """
     A helper function for making memcached-usable cache keys out of
@@ -0,0 +1,256 @@
+# The contents of this file are subject to the Common Public Attribution
+# License Version 1.0. (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://code.reddit.com/LICENSE. The License is based on the Mozilla Public
+# License Version 1.1, but Sections 14 and 15 have been added to cover use of
+# software over a computer network and provide for limited attribution for the
+# Original Developer. In addition, Exhibit A has been modified to be consistent
+# with Exhibit B.
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License for
+# the specific language governing rights and limitations under the License.
+#
+# The Original Code is reddit.
+#
+# The Original Developer is the Initial Developer.  The Initial Developer of
+# the Original Code is reddit Inc.
+#
+# All portions of the code written by reddit are Copyright (c) 2006-2012 reddit
+# Inc. All Rights Reserved.
+###############################################################################
+"""Broadcast cache key invalidations between app processes.
+
+Process-local caches (see LRUCache and LocalTierCache in r2.lib.cache) can't
+see writes made by other processes.  An invalidation bus lets every process
+announce the keys it has written so that its peers drop their local copies
+rather than serving them until they expire.
+
+Delivery is best effort: a lost invalidation leaves a peer serving its local
+copy until that copy's TTL runs out, so the local cache's max_ttl is still
+the upper bound on staleness.  The bus only brings the usual case down to
+the time it takes a datagram to get across the network.
+
+"""
+
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+
+
+# keep datagrams under a typical ethernet MTU so they aren't fragmented
+MAX_PACKET_SIZE = 1400
+# after the listener's socket fails, wait this long before joining again
+RETRY_DELAY = 10
+
+LOG = logging.getLogger(__name__)
+
+
+class InvalidationBus(object):
+    """The interface the local cache tier uses to talk to its peers.
+
+    Subscribers are called with a list of keys every time a peer publishes
+    an invalidation.  A bus never delivers a process's own invalidations
+    back to it.
+
+    """
+
+    def __init__(self):
+        self.subscribers = []
+        self.stats = None
+
+    def _count(self, name, delta=1):
+        if self.stats and delta:
+            self.stats.cache_count('invalidation.%s' % name, delta=delta)
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def _deliver(self, keys):
+        self._count('received', len(keys))
+        for callback in self.subscribers:
+            callback(keys)
+
+    def publish(self, keys):
+        raise NotImplementedError
+
+    def start(self):
+        pass
+
+
+class MemoryInvalidationHub(object):
+    """The shared medium for a group of InMemoryInvalidationBus."""
+
+    def __init__(self):
+        self.buses = []
+
+
+class InMemoryInvalidationBus(InvalidationBus):
+    """A bus that delivers synchronously to the others on the same hub.
+
+    Each bus stands in for one process, which makes this useful for testing
+    several local cache tiers against each other without any networking.
+
+    """
+
+    def __init__(self, hub):
+        InvalidationBus.__init__(self)
+        self.hub = hub
+        hub.buses.append(self)
+
+    def publish(self, keys):
+        keys = list(keys)
+        if not keys:
+            return
+
+        self._count('sent', len(keys))
+        for bus in self.hub.buses:
+            if bus is not self:
+                bus._deliver(keys)
+
+
+class UDPMulticastInvalidationBus(InvalidationBus):
+    """A bus that sends invalidations to a UDP multicast group.
+
+    Every process joins the group and runs a daemon thread that listens for
+    invalidations from its peers.  Each datagram starts with the sender's
+    origin id (so a process can ignore its own) followed by
+    newline-separated keys; memcached keys can't contain whitespace, so no
+    escaping is needed.
+
+    """
+
+    def __init__(self, group, port, ttl=1, interface='0.0.0.0'):
+        InvalidationBus.__init__(self)
+        self.group = group
+        self.port = port
+        self.ttl = ttl
+        self.interface = interface
+        self.origin = None
+        self.pid = None
+        self.send_sock = None
+        self.listener = None
+        self.retry_at = 0
+        self.lock = threading.Lock()
+
+    def _make_origin(self):
+        return '%s:%d:%s' % (socket.gethostname(), os.getpid(),
+                             os.urandom(4).encode('hex'))
+
+    def start(self):
+        """Join the multicast group and start listening for peers.
+
+        Sockets and threads don't survive a fork, so this is done lazily
+        and redone if the process has forked since it was last called.  It's
+        also redone if the listener has given up on a broken socket, though
+        no sooner than RETRY_DELAY seconds later.
+
+        """
+
+        if self.pid == os.getpid() or time.time() < self.retry_at:
+            return
+
+        with self.lock:
+            if self.pid == os.getpid() or time.time() < self.retry_at:
+                return
+
+            try:
+                self._join()
+            except socket.error:
+                LOG.exception('failed to join %r', self)
+                self._count('join_error')
+                self.retry_at = time.time() + RETRY_DELAY
+                return
+
+            self.pid = os.getpid()
+
+    def _join(self):
+        self.origin = self._make_origin()
+
+        send_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM,
+                                  socket.IPPROTO_UDP)
+        send_sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL,
+                             self.ttl)
+        # peers on the same host need to see our datagrams too
+        send_sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP,
+                             1)
+        self.send_sock = send_sock
+
+        recv_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM,
+                                  socket.IPPROTO_UDP)
+        recv_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            recv_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        recv_sock.bind(('', self.port))
+        membership = struct.pack('4s4s', socket.inet_aton(self.group),
+                                 socket.inet_aton(self.interface))
+        recv_sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                             membership)
+
+        self.listener = threading.Thread(target=self._listen,
+                                         args=(recv_sock,))
+        self.listener.setDaemon(True)
+        self.listener.start()
+
+    def _listen(self, sock):
+        while True:
+            try:
+                packet = sock.recv(65535)
+            except socket.error:
+                # rather than spin on a broken socket, stop listening and
+                # leave it to a later start() to join again
+                LOG.exception('stopped listening on %r', self)
+                self._count('recv_error')
+                with self.lock:
+                    self.pid = None
+                    self.retry_at = time.time() + RETRY_DELAY
+                sock.close()
+                return
+
+            origin, sep, body = packet.partition('\n')
+            if origin == self.origin or not body:
+                continue
+            try:
+                self._deliver(body.split('\n'))
+            except Exception:
+                LOG.exception('failed to deliver invalidations from %r',
+                              self)
+
+    def _packets(self, keys):
+        header = self.origin
+        packet = []
+        size = len(header)
+        for key in keys:
+            if packet and size + 1 + len(key) > MAX_PACKET_SIZE:
+                yield '\n'.join([header] + packet)
+                packet = []
+                size = len(header)
+            packet.append(key)
+            size += 1 + len(key)
+
+        if packet:
+            yield '\n'.join([header] + packet)
+
+    def publish(self, keys):
+        keys = list(keys)
+        if not keys:
+            return
+
+        self.start()
+        if not self.send_sock:
+            self._count('send_error')
+            return
+
+        self._count('sent', len(keys))
+        for packet in self._packets(keys):
+            try:
+                self.send_sock.sendto(packet, (self.group, self.port))
+            except socket.error:
+                self._count('send_error')
+
+    def __repr__(self):
+        return '<%s(%s:%d)>' % (self.__class__.__name__,
+                                self.group, self.port)
@@ -0,0 +1,74 @@
+# The contents of this file are subject to the Common Public Attribution
+# License Version 1.0. (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://code.reddit.com/LICENSE. The License is based on the Mozilla Public
+# License Version 1.1, but Sections 14 and 15 have been added to cover use of
+# software over a computer network and provide for limited attribution for the
+# Original Developer. In addition, Exhibit A has been modified to be consistent
+# with Exhibit B.
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License for
+# the specific language governing rights and limitations under the License.
+#
+# The Original Code is reddit.
+#
+# The Original Developer is the Initial Developer.  The Initial Developer of
+# the Original Code is reddit Inc.
+#
+# All portions of the code written by reddit are Copyright (c) 2006-2012 reddit
+# Inc. All Rights Reserved.
+###############################################################################
+
+from heapq import heapify, heappop, heappush
+
+
+class CommentFrontier(object):
+    """The comments eligible to be shown next in a comment tree, best first.
+
+    The comment builder repeatedly takes the best candidate and then makes
+    its children eligible.  Keeping the candidates in a heap keyed on their
+    sort value makes each of those steps O(log n) in the number of
+    candidates instead of re-sorting the candidate list every time.
+
+    Candidates with equal sort values come out in the order they were added,
+    matching a stable sort of the candidate list.
+
+    """
+
+    def __init__(self, sorter, reverse=False, cids=()):
+        self.sorter = sorter
+        self.reverse = reverse
+        self.count = 0
+        self.heap = [self._entry(cid) for cid in cids]
+        heapify(self.heap)
+
+    def _entry(self, cid):
+        value = self.sorter[cid]
+        if self.reverse:
+            value = -value
+        self.count += 1
+        return (value, self.count, cid)
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __nonzero__(self):
+        return bool(self.heap)
+
+    def push(self, cid):
+        heappush(self.heap, self._entry(cid))
+
+    def extend(self, cids):
+        for cid in cids:
+            heappush(self.heap, self._entry(cid))
+
+    def pop(self):
+        return heappop(self.heap)[2]
+
+    def remaining(self):
+        """Return the remaining candidates as a list, best first."""
+        return [cid for value, count, cid in sorted(self.heap)]
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.remaining())
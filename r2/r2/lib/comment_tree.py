@@ -23,12 +23,14 @@
 from pylons import g, c
 from itertools import chain
 from r2.lib.utils import SimpleSillyStub, tup, to36
+from r2.lib.db import batch_sorts
 from r2.lib.db.sorts import epoch_seconds
 from r2.lib.cache import sgm
-from r2.models.comment_tree import CommentTree
+from r2.models.comment_tree import ArrayView, CommentTree
 from r2.models.link import Comment, Link
 
 MAX_ITERATIONS = 50000
+COMMENT_SORTS = ("_controversy", "_hot", "_confidence", "_score", "_date")
 
 def comments_key(link_id):
     return 'comments_' + str(link_id)
@@ -48,6 +50,26 @@ def _get_sort_value(comment, sort):
         return epoch_seconds(comment._date)
     return getattr(comment, sort)
 
+def _get_sort_values(comments, sorts):
+    """Compute the values of several sorts for a list of comments at once.
+
+    Returns a dict of sort to a list of values in the same order as
+    `comments`; the values are exactly what _get_sort_value would give.
+
+    """
+    ups = [comment._ups for comment in comments]
+    downs = [comment._downs for comment in comments]
+    dates = [epoch_seconds(comment._date) for comment in comments]
+
+    fns = {
+        "_controversy": lambda: batch_sorts.controversies(ups, downs),
+        "_hot": lambda: batch_sorts.hots(ups, downs, dates),
+        "_confidence": lambda: batch_sorts.confidences(ups, downs),
+        "_score": lambda: batch_sorts.scores(ups, downs),
+        "_date": lambda: dates,
+    }
+    return dict((sort, fns[sort]()) for sort in sorts)
+
 def add_comments(comments):
     links = Link._byID([com.link_id for com in tup(comments)], data=True)
     comments = tup(comments)
@@ -88,12 +110,12 @@ def update_comment_votes(comments, write_consistency_level = None):
         link_map.setdefault(com.link_id, []).append(com)
 
     for link_id, coms in link_map.iteritems():
-        for sort in ("_controversy", "_hot", "_confidence", "_score", "_date"):
+        sort_values = _get_sort_values(coms, COMMENT_SORTS)
+        for sort in COMMENT_SORTS:
             # Cassandra always uses the id36 instead of the integer
             # ID, so we'll map that first before sending it
             c_key = sort_comments_key(link_id, sort)
-            c_r = dict((cm._id36, _get_sort_value(cm, sort))
-                       for cm in coms)
+            c_r = dict(zip((cm._id36 for cm in coms), sort_values[sort]))
             CommentSortsCache._set_values(c_key, c_r,
                                           write_consistency_level = write_consistency_level)
 
@@ -115,6 +137,9 @@ def delete_comment(comment):
 
 def _comment_sorter_from_cids(cids, sort):
     comments = Comment._byID(cids, data = False, return_dict = False)
+    if sort in COMMENT_SORTS:
+        values = _get_sort_values(comments, (sort,))[sort]
+        return dict(zip((x._id for x in comments), values))
     return dict((x._id, _get_sort_value(x, sort)) for x in comments)
 
 def _get_comment_sorter(link_id, sort):
@@ -187,7 +212,10 @@ def link_comments_and_sort(link, sort):
         g.log.debug("comment_tree.py: parents cache miss for Link %s"
                     % link_id)
         parents = {}
-    elif cids and not all(x in parents for x in cids):
+    # array-backed trees store a parent for every comment by construction,
+    # and checking them one at a time is slow
+    elif (cids and not isinstance(parents, ArrayView)
+          and not all(x in parents for x in cids)):
         g.log.debug("Error in comment_tree: parents inconsistent for Link %s"
                     % link_id)
         parents = {}
@@ -44,6 +44,8 @@ More detailed documentation is available in the L{Client} class.
 """
 
 import sys
+import select
+from binascii import crc32
 import socket
 import time
 import os
@@ -91,75 +93,9 @@ except ImportError:
     class local(object):
         pass
 
-# stolen wholesale from cmemcache_hash
-# <http://pypi.python.org/pypi/cmemcache_hash> so that we're using the
-# same hashing algorithm as pylibmc's 'crc'
-crc32tab = (
-  0x00000000, 0x77073096, 0xee0e612c, 0x990951ba,
-  0x076dc419, 0x706af48f, 0xe963a535, 0x9e6495a3,
-  0x0edb8832, 0x79dcb8a4, 0xe0d5e91e, 0x97d2d988,
-  0x09b64c2b, 0x7eb17cbd, 0xe7b82d07, 0x90bf1d91,
-  0x1db71064, 0x6ab020f2, 0xf3b97148, 0x84be41de,
-  0x1adad47d, 0x6ddde4eb, 0xf4d4b551, 0x83d385c7,
-  0x136c9856, 0x646ba8c0, 0xfd62f97a, 0x8a65c9ec,
-  0x14015c4f, 0x63066cd9, 0xfa0f3d63, 0x8d080df5,
-  0x3b6e20c8, 0x4c69105e, 0xd56041e4, 0xa2677172,
-  0x3c03e4d1, 0x4b04d447, 0xd20d85fd, 0xa50ab56b,
-  0x35b5a8fa, 0x42b2986c, 0xdbbbc9d6, 0xacbcf940,
-  0x32d86ce3, 0x45df5c75, 0xdcd60dcf, 0xabd13d59,
-  0x26d930ac, 0x51de003a, 0xc8d75180, 0xbfd06116,
-  0x21b4f4b5, 0x56b3c423, 0xcfba9599, 0xb8bda50f,
-  0x2802b89e, 0x5f058808, 0xc60cd9b2, 0xb10be924,
-  0x2f6f7c87, 0x58684c11, 0xc1611dab, 0xb6662d3d,
-  0x76dc4190, 0x01db7106, 0x98d220bc, 0xefd5102a,
-  0x71b18589, 0x06b6b51f, 0x9fbfe4a5, 0xe8b8d433,
-  0x7807c9a2, 0x0f00f934, 0x9609a88e, 0xe10e9818,
-  0x7f6a0dbb, 0x086d3d2d, 0x91646c97, 0xe6635c01,
-  0x6b6b51f4, 0x1c6c6162, 0x856530d8, 0xf262004e,
-  0x6c0695ed, 0x1b01a57b, 0x8208f4c1, 0xf50fc457,
-  0x65b0d9c6, 0x12b7e950, 0x8bbeb8ea, 0xfcb9887c,
-  0x62dd1ddf, 0x15da2d49, 0x8cd37cf3, 0xfbd44c65,
-  0x4db26158, 0x3ab551ce, 0xa3bc0074, 0xd4bb30e2,
-  0x4adfa541, 0x3dd895d7, 0xa4d1c46d, 0xd3d6f4fb,
-  0x4369e96a, 0x346ed9fc, 0xad678846, 0xda60b8d0,
-  0x44042d73, 0x33031de5, 0xaa0a4c5f, 0xdd0d7cc9,
-  0x5005713c, 0x270241aa, 0xbe0b1010, 0xc90c2086,
-  0x5768b525, 0x206f85b3, 0xb966d409, 0xce61e49f,
-  0x5edef90e, 0x29d9c998, 0xb0d09822, 0xc7d7a8b4,
-  0x59b33d17, 0x2eb40d81, 0xb7bd5c3b, 0xc0ba6cad,
-  0xedb88320, 0x9abfb3b6, 0x03b6e20c, 0x74b1d29a,
-  0xead54739, 0x9dd277af, 0x04db2615, 0x73dc1683,
-  0xe3630b12, 0x94643b84, 0x0d6d6a3e, 0x7a6a5aa8,
-  0xe40ecf0b, 0x9309ff9d, 0x0a00ae27, 0x7d079eb1,
-  0xf00f9344, 0x8708a3d2, 0x1e01f268, 0x6906c2fe,
-  0xf762575d, 0x806567cb, 0x196c3671, 0x6e6b06e7,
-  0xfed41b76, 0x89d32be0, 0x10da7a5a, 0x67dd4acc,
-  0xf9b9df6f, 0x8ebeeff9, 0x17b7be43, 0x60b08ed5,
-  0xd6d6a3e8, 0xa1d1937e, 0x38d8c2c4, 0x4fdff252,
-  0xd1bb67f1, 0xa6bc5767, 0x3fb506dd, 0x48b2364b,
-  0xd80d2bda, 0xaf0a1b4c, 0x36034af6, 0x41047a60,
-  0xdf60efc3, 0xa867df55, 0x316e8eef, 0x4669be79,
-  0xcb61b38c, 0xbc66831a, 0x256fd2a0, 0x5268e236,
-  0xcc0c7795, 0xbb0b4703, 0x220216b9, 0x5505262f,
-  0xc5ba3bbe, 0xb2bd0b28, 0x2bb45a92, 0x5cb36a04,
-  0xc2d7ffa7, 0xb5d0cf31, 0x2cd99e8b, 0x5bdeae1d,
-  0x9b64c2b0, 0xec63f226, 0x756aa39c, 0x026d930a,
-  0x9c0906a9, 0xeb0e363f, 0x72076785, 0x05005713,
-  0x95bf4a82, 0xe2b87a14, 0x7bb12bae, 0x0cb61b38,
-  0x92d28e9b, 0xe5d5be0d, 0x7cdcefb7, 0x0bdbdf21,
-  0x86d3d2d4, 0xf1d4e242, 0x68ddb3f8, 0x1fda836e,
-  0x81be16cd, 0xf6b9265b, 0x6fb077e1, 0x18b74777,
-  0x88085ae6, 0xff0f6a70, 0x66063bca, 0x11010b5c,
-  0x8f659eff, 0xf862ae69, 0x616bffd3, 0x166ccf45,
-  0xa00ae278, 0xd70dd2ee, 0x4e048354, 0x3903b3c2,
-  0xa7672661, 0xd06016f7, 0x4969474d, 0x3e6e77db,
-  0xaed16a4a, 0xd9d65adc, 0x40df0b66, 0x37d83bf0,
-  0xa9bcae53, 0xdebb9ec5, 0x47b2cf7f, 0x30b5ffe9,
-  0xbdbdf21c, 0xcabac28a, 0x53b39330, 0x24b4a3a6,
-  0xbad03605, 0xcdd70693, 0x54de5729, 0x23d967bf,
-  0xb3667a2e, 0xc4614ab8, 0x5d681b02, 0x2a6f2b94,
-  0xb40bbe37, 0xc30c8ea1, 0x5a05df1b, 0x2d02ef8d
-)
+# the same hashing algorithm as cmemcache_hash
+# <http://pypi.python.org/pypi/cmemcache_hash> and pylibmc's 'crc'. it's the
+# top bits of a standard CRC-32, so let zlib's C implementation compute it
 def serverHashFunction(key):
     r"""Calculate a cmemcache-style CRC32 hash of *key*.
 
@@ -174,12 +110,7 @@ def serverHashFunction(key):
     >>> cmemcache_hash("")
     1
     """
-    crc = ~0
-
-    for c in key:
-        crc = ((crc & 0xffffffff) >> 8) ^ crc32tab[(crc ^ ord(c)) & 0xff]
-
-    crc = int((~crc >> 16) & 0x7fff)
+    crc = ((crc32(key) & 0xffffffff) >> 16) & 0x7fff
 
     return crc or 1
 
@@ -309,7 +240,83 @@ class Client(local):
         Reset every host in the pool to an "alive" state.
         """
         for s in self.servers:
-            s.dead_until = 0
+            s.mark_alive()
+
+    def get_server_health(self):
+        """
+        Report on the health of each server in the pool.
+
+        @return: A list of tuples ( server_identifier, consecutive_failures,
+            dead_until, last_error ).  dead_until is 0 for live servers.
+        """
+        return [(str(s), s.failures, s.deaduntil, s.last_error)
+                for s in self.servers]
+
+    def _poll_responses(self, responses):
+        """
+        Read the responses to commands already sent to several servers.
+
+        Rather than reading each server's response in turn, which makes the
+        total latency the sum of the servers', wait on all of their sockets
+        at once and parse whatever arrives from any of them.  Servers that
+        error or time out are marked dead and their responses abandoned.
+
+        @param responses: A dict of server (_Host) -> response parser, an
+        object with a feed() method that consumes the server's buffer and
+        returns True once the full response has been read.
+        """
+        pending = {}
+        for server, response in responses.iteritems():
+            # there may be a complete response left in the buffer already
+            try:
+                if response.feed():
+                    server.mark_alive()
+                    continue
+            except _Error, msg:
+                server.mark_dead(msg)
+                continue
+            pending[server.socket.fileno()] = (server, response)
+
+        if hasattr(select, 'poll'):
+            poller = select.poll()
+            for fd in pending:
+                poller.register(fd, select.POLLIN | select.POLLPRI)
+            def wait():
+                return [fd for fd, event in
+                        poller.poll(_Host._SOCKET_TIMEOUT * 1000)]
+            unregister = poller.unregister
+        else:
+            def wait():
+                return select.select(pending.keys(), [], [],
+                                     _Host._SOCKET_TIMEOUT)[0]
+            unregister = lambda fd: None
+
+        while pending:
+            ready = wait()
+            if not ready:
+                for server, response in pending.itervalues():
+                    server.mark_dead('timed out waiting for response')
+                break
+
+            for fd in ready:
+                server, response = pending[fd]
+                try:
+                    data = server.socket.recv(_Host._RECV_SIZE)
+                    if not data:
+                        raise _Error('Connection closed while reading from %s'
+                                     % server)
+                    server.buffer += data
+                    done = response.feed()
+                    if done:
+                        server.mark_alive()
+                except (_Error, socket.error), msg:
+                    if type(msg) is types.TupleType: msg = msg[1]
+                    server.mark_dead(msg)
+                    done = True
+
+                if done:
+                    unregister(fd)
+                    del pending[fd]
 
     def _init_buckets(self):
         self.buckets = []
@@ -646,43 +653,46 @@ class Client(local):
 
         server_keys, prefixed_to_orig_key = self._map_and_prefix_keys(mapping.iterkeys(), key_prefix)
 
+        #  short-circuit if there are no servers, just return all keys
+        if not server_keys: return(mapping.keys())
+
         # send out all requests on each server before reading anything
-        dead_servers = []
+        notstored = [] # original keys.
+        responses = {}
 
-        for server in server_keys.iterkeys():
+        for server, keys in server_keys.iteritems():
             bigcmd = []
             write = bigcmd.append
+            sent = []
+            for key in keys: # These are mangled keys
+                store_info = self._val_to_store_info(mapping[prefixed_to_orig_key[key]], min_compress_len)
+                if not store_info:
+                    # too big to store, so it won't get a response
+                    notstored.append(prefixed_to_orig_key[key])
+                    continue
+                write("set %s %d %d %d\r\n%s\r\n" % (key, store_info[0], time, store_info[1], store_info[2]))
+                sent.append(key)
+
+            if not sent:
+                continue
+
+            response = _StoreResponse(server, sent, prefixed_to_orig_key,
+                                      notstored)
             try:
-                for key in server_keys[server]: # These are mangled keys
-                    store_info = self._val_to_store_info(mapping[prefixed_to_orig_key[key]], min_compress_len)
-                    if not store_info:
-                        continue
-                    write("set %s %d %d %d\r\n%s\r\n" % (key, store_info[0], time, store_info[1], store_info[2]))
                 server.send_cmds(''.join(bigcmd))
             except socket.error, msg:
                 if type(msg) is types.TupleType: msg = msg[1]
                 server.mark_dead(msg)
-                dead_servers.append(server)
-
-        # if any servers died on the way, don't expect them to respond.
-        for server in dead_servers:
-            del server_keys[server]
+                # the server died on the way, so don't expect it to respond.
+                response.abandon()
+                continue
+            responses[server] = response
 
-        #  short-circuit if there are no servers, just return all keys
-        if not server_keys: return(mapping.keys())
+        self._poll_responses(responses)
 
-        notstored = [] # original keys.
-        for server, keys in server_keys.iteritems():
-            try:
-                for key in keys:
-                    line = server.readline()
-                    if line == 'STORED':
-                        continue
-                    else:
-                        notstored.append(prefixed_to_orig_key[key]) #un-mangle.
-            except (_Error, socket.error), msg:
-                if type(msg) is types.TupleType: msg = msg[1]
-                server.mark_dead(msg)
+        # anything we didn't get a response for wasn't stored either
+        for response in responses.itervalues():
+            response.abandon()
         return notstored
 
     def _val_to_store_info(self, val, min_compress_len):
@@ -816,34 +826,20 @@ class Client(local):
                                                                       key_prefix)
 
         # send out all requests on each server before reading anything
-        dead_servers = []
+        retvals = {}
+        responses = {}
         for server in server_keys.iterkeys():
             try:
                 server.send_cmd("get %s" % " ".join(server_keys[server]))
             except socket.error, msg:
                 if type(msg) is types.TupleType: msg = msg[1]
                 server.mark_dead(msg)
-                dead_servers.append(server)
-
-        # if any servers died on the way, don't expect them to respond.
-        for server in dead_servers:
-            del server_keys[server]
-
-        retvals = {}
-        for server in server_keys.iterkeys():
-            try:
-                line = server.readline()
-                while line and line != 'END':
-                    rkey, flags, rlen = self._expectvalue(server, line)
-                    #  Bo Yang reports that this can sometimes be None
-                    if rkey is not None:
-                        val = self._recv_value(server, flags, rlen)
-                        retvals[prefixed_to_orig_key[rkey]] = val   # un-prefix returned key.
-                    line = server.readline()
-            except (_Error, socket.error), msg:
+                # if the server died on the way, don't expect it to respond.
+                continue
+            responses[server] = _GetResponse(self, server,
+                                             prefixed_to_orig_key, retvals)
 
-                if type(msg) is types.TupleType: msg = msg[1]
-                server.mark_dead(msg)
+        self._poll_responses(responses)
         return retvals
 
     def _expectvalue(self, server, line=None):
@@ -867,6 +863,9 @@ class Client(local):
         if len(buf) == rlen:
             buf = buf[:-2]  # strip \r\n
 
+        return self._decode_value(flags, buf)
+
+    def _decode_value(self, flags, buf):
         if flags & Client._FLAG_COMPRESSED:
             buf = decompress(buf)
 
@@ -894,9 +893,107 @@ class Client(local):
         return val
 
 
+class _GetResponse(object):
+    """
+    Incrementally parses one server's response to a multi-key get.
+    """
+
+    def __init__(self, client, server, prefixed_to_orig_key, retvals):
+        self.client = client
+        self.server = server
+        self.prefixed_to_orig_key = prefixed_to_orig_key
+        self.retvals = retvals
+        self.value_header = None
+
+    def feed(self):
+        """
+        Parse as much of the server's buffer as possible.
+
+        @return: True once the END of the response has been read.
+        """
+        # walk the buffer by offset rather than slicing it after every line
+        # so that big responses don't take quadratic time to parse
+        server = self.server
+        buf = server.buffer
+        pos = 0
+        done = False
+        while True:
+            if self.value_header is None:
+                index = buf.find('\r\n', pos)
+                if index < 0:
+                    break
+                line = buf[pos:index]
+                pos = index + 2
+                if line == 'END':
+                    done = True
+                    break
+
+                rkey, flags, rlen = self.client._expectvalue(server, line)
+                #  Bo Yang reports that this can sometimes be None
+                if rkey is not None:
+                    self.value_header = (rkey, flags, rlen)
+            else:
+                rkey, flags, rlen = self.value_header
+                if len(buf) - pos < rlen + 2:
+                    break
+                val = self.client._decode_value(flags, buf[pos:pos+rlen])
+                pos += rlen + 2
+                self.retvals[self.prefixed_to_orig_key[rkey]] = val   # un-prefix returned key.
+                self.value_header = None
+
+        server.buffer = buf[pos:]
+        return done
+
+
+class _StoreResponse(object):
+    """
+    Incrementally parses one server's responses to a series of sets.
+    """
+
+    def __init__(self, server, keys, prefixed_to_orig_key, notstored):
+        self.server = server
+        self.keys = keys
+        self.prefixed_to_orig_key = prefixed_to_orig_key
+        self.notstored = notstored
+        self.position = 0
+
+    def feed(self):
+        """
+        Parse as much of the server's buffer as possible.
+
+        @return: True once a response has been read for every key.
+        """
+        server = self.server
+        buf = server.buffer
+        pos = 0
+        while self.position < len(self.keys):
+            index = buf.find('\r\n', pos)
+            if index < 0:
+                break
+            line = buf[pos:index]
+            pos = index + 2
+            if line != 'STORED':
+                key = self.keys[self.position]
+                self.notstored.append(self.prefixed_to_orig_key[key]) #un-mangle.
+            self.position += 1
+
+        server.buffer = buf[pos:]
+        return self.position == len(self.keys)
+
+    def abandon(self):
+        """
+        Count any keys we never got a response for as not stored.
+        """
+        for key in self.keys[self.position:]:
+            self.notstored.append(self.prefixed_to_orig_key[key])
+        self.position = len(self.keys)
+
+
 class _Host:
     _DEAD_RETRY = 1  # number of seconds before retrying a dead server.
+    _MAX_DEAD_RETRY = 30  # cap on the backoff for a server that keeps failing.
     _SOCKET_TIMEOUT = 3  #  number of seconds before sockets timeout.
+    _RECV_SIZE = 65536
 
     def __init__(self, host, debugfunc=None):
         if isinstance(host, types.TupleType):
@@ -928,6 +1025,8 @@ class _Host:
         self.debuglog = debugfunc
 
         self.deaduntil = 0
+        self.failures = 0
+        self.last_error = None
         self.socket = None
 
         self.buffer = ''
@@ -945,9 +1044,18 @@ class _Host:
 
     def mark_dead(self, reason):
         self.debuglog("MemCache: %s: %s.  Marking dead." % (self, reason))
-        self.deaduntil = time.time() + _Host._DEAD_RETRY
+        # back off exponentially from servers that keep failing
+        self.failures += 1
+        self.last_error = str(reason)
+        retry = min(_Host._DEAD_RETRY * 2 ** min(self.failures - 1, 16),
+                    _Host._MAX_DEAD_RETRY)
+        self.deaduntil = time.time() + retry
         self.close_socket()
 
+    def mark_alive(self):
+        self.failures = 0
+        self.deaduntil = 0
+
     def _get_socket(self):
         if self._check_dead():
             return None
@@ -966,6 +1074,8 @@ class _Host:
             return None
         self.socket = s
         self.buffer = ''
+        # the server is back, so start its backoff over next time it fails
+        self.failures = 0
         return s
 
     def close_socket(self):
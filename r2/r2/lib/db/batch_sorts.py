@@ -0,0 +1,148 @@
+# The contents of this file are subject to the Common Public Attribution
+# License Version 1.0. (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://code.reddit.com/LICENSE. The License is based on the Mozilla Public
+# License Version 1.1, but Sections 14 and 15 have been added to cover use of
+# software over a computer network and provide for limited attribution for the
+# Original Developer. In addition, Exhibit A has been modified to be consistent
+# with Exhibit B.
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License for
+# the specific language governing rights and limitations under the License.
+#
+# The Original Code is reddit.
+#
+# The Original Developer is the Initial Developer.  The Initial Developer of
+# the Original Code is reddit Inc.
+#
+# All portions of the code written by reddit are Copyright (c) 2006-2012 reddit
+# Inc. All Rights Reserved.
+###############################################################################
+"""Compute sort values for many things at once.
+
+These give exactly the same results as the scalar functions in
+r2.lib.db._sorts (bit for bit, so sorting on either agrees) but take lists
+of ups, downs and epoch seconds and work on whole arrays with NumPy.  Each
+function returns a plain list of Python numbers, like calling the scalar
+function on each item would.  Without NumPy they fall back to doing just
+that.
+
+To stay bit-identical the array code mirrors the C that Cython generates
+for _sorts: _confidence mixes single and double precision arithmetic, the
+logarithm in _hot comes from the C library rather than NumPy's own
+implementation, and _hot's round(x, 7) is redone with Python's round for
+the rare values where scaling by 10**7 could tip the result across a
+rounding boundary.
+
+"""
+
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from r2.lib.db import _sorts
+
+
+HOT_EPOCH = 1134028003
+HOT_DIVISOR = 45000
+CONFIDENCE_Z = 1.281551565545 # 80% confidence
+
+
+def _ints(values):
+    return numpy.asarray(values, dtype=numpy.int64)
+
+
+def _log10(values):
+    """log10 of an array of positive integers, computed by the C library."""
+    uniques, positions = numpy.unique(values, return_inverse=True)
+    logs = numpy.array([math.log10(v) for v in uniques.tolist()],
+                       dtype=numpy.float64)
+    return logs[positions]
+
+
+def scores(ups, downs):
+    if numpy is None:
+        return [_sorts.score(u, d) for u, d in zip(ups, downs)]
+
+    return (_ints(ups) - _ints(downs)).tolist()
+
+
+def controversies(ups, downs):
+    if numpy is None:
+        return [_sorts.controversy(u, d) for u, d in zip(ups, downs)]
+
+    ups, downs = _ints(ups), _ints(downs)
+    total = (ups + downs).astype(numpy.float64)
+    return (total / numpy.maximum(numpy.abs(ups - downs), 1)).tolist()
+
+
+def hots(ups, downs, dates):
+    """The hot formula for dates given in epoch seconds (see _sorts._hot)."""
+    if numpy is None:
+        return [_sorts._hot(u, d, date)
+                for u, d, date in zip(ups, downs, dates)]
+
+    s = _ints(ups) - _ints(downs)
+    if not len(s):
+        return []
+
+    dates = numpy.asarray(dates, dtype=numpy.float64)
+    order = _log10(numpy.maximum(numpy.abs(s), 1))
+    sign = numpy.sign(s).astype(numpy.float64)
+    seconds = dates - HOT_EPOCH
+    unrounded = order + sign * seconds / HOT_DIVISOR
+
+    # round(x, 7) gives the double nearest to x rounded to 7 decimal places
+    # which, since the division is correctly rounded, is the nearest integer
+    # to x * 10**7 divided by 10**7. scaling x is itself rounded though, so
+    # anything that lands close to halfway between two integers has to go
+    # through round() to decide which way it really goes
+    scaled = unrounded * 1e7
+    rounded = numpy.rint(scaled)
+    halfway = numpy.abs(numpy.abs(scaled - rounded) - 0.5)
+    unsure = numpy.nonzero(halfway <= numpy.abs(scaled) * 1e-14 + 1e-9)[0]
+
+    ret = (rounded / 1e7).tolist()
+    if len(unsure):
+        unrounded = unrounded.tolist()
+        for i in unsure.tolist():
+            ret[i] = round(unrounded[i], 7)
+    return ret
+
+
+def confidences(ups, downs):
+    if numpy is None:
+        return [_sorts.confidence(u, d) for u, d in zip(ups, downs)]
+
+    ups, downs = _ints(ups), _ints(downs)
+    if not len(ups):
+        return []
+
+    f32, f64 = numpy.float32, numpy.float64
+
+    # the casts and literals below follow the C generated for _confidence,
+    # where n, z and p (and some temporaries) are single precision floats
+    n = (ups + downs).astype(f32)
+    z = f32(CONFIDENCE_Z)
+    empty = n == 0
+    n[empty] = 1
+
+    n64, z64 = n.astype(f64), f64(z)
+    p = (ups.astype(f64) / n64).astype(f32)
+    p64 = p.astype(f64)
+
+    left = p64 + ((1.0 / (2.0 * n64).astype(f32).astype(f64)) * z64) * z64
+    variance = (p64 * (1.0 - p64)).astype(f32)
+    spread = (z * z) / ((4.0 * n64) * n64).astype(f32)
+    right = z64 * numpy.sqrt(((variance / n) + spread).astype(f64))
+    under = 1.0 + ((1.0 / n64) * z64) * z64
+
+    ret = ((left - right) / under).tolist()
+    for i in numpy.nonzero(empty)[0].tolist():
+        # confidence() returns an integer 0 for things with no votes
+        ret[i] = 0
+    return ret
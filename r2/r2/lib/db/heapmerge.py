@@ -0,0 +1,157 @@
+# The contents of this file are subject to the Common Public Attribution
+# License Version 1.0. (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://code.reddit.com/LICENSE. The License is based on the Mozilla Public
+# License Version 1.1, but Sections 14 and 15 have been added to cover use of
+# software over a computer network and provide for limited attribution for the
+# Original Developer. In addition, Exhibit A has been modified to be consistent
+# with Exhibit B.
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License for
+# the specific language governing rights and limitations under the License.
+#
+# The Original Code is reddit.
+#
+# The Original Developer is the Initial Developer.  The Initial Developer of
+# the Original Code is reddit Inc.
+#
+# All portions of the code written by reddit are Copyright (c) 2006-2012 reddit
+# Inc. All Rights Reserved.
+###############################################################################
+
+"""Priority-queue based k-way merging of sorted streams.
+
+Each input stream must already be ordered by the same sort (a list of
+operators.asc/operators.desc).  Rather than comparing one column at a time
+across every stream for every item produced, a composite sort key is built
+once per item and the streams are merged through a heap, so producing each
+item costs O(log k) for k streams.
+
+"""
+
+from heapq import heapify, heappop, heapreplace
+from operator import attrgetter, itemgetter
+
+from r2.lib.db import operators
+
+
+_NUMBER_TYPES = (int, long, float)
+
+
+class Descending(object):
+    """Wraps a value so that it sorts in reverse order.
+
+    Used for descending sort columns whose values can't simply be negated
+    (dates, strings, etc.)
+
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __ne__(self, other):
+        return self.value != other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __le__(self, other):
+        return other.value <= self.value
+
+    def __gt__(self, other):
+        return other.value > self.value
+
+    def __ge__(self, other):
+        return other.value >= self.value
+
+    def __repr__(self):
+        return "Descending(%r)" % (self.value,)
+
+
+def descending(value):
+    """Return a key component that sorts value in descending order."""
+    if isinstance(value, _NUMBER_TYPES) and not isinstance(value, bool):
+        return -value
+    return Descending(value)
+
+
+def make_sort_key(sorts, getters=None):
+    """Build a function mapping an item to a composite sort key.
+
+    sorts is a sequence of operators.sort instances.  getters, if given, is a
+    parallel sequence of functions for extracting each column from an item;
+    by default the columns are looked up as attributes.  Smaller keys sort
+    first, so the resulting keys can be compared directly (or used by
+    sorted() or heapq) to honour mixed asc/desc sorts.
+
+    """
+
+    if getters is None:
+        getters = [attrgetter(s.col) for s in sorts]
+    columns = [(getter, not isinstance(s, operators.asc))
+               for s, getter in zip(sorts, getters)]
+
+    if not columns:
+        return lambda item: ()
+
+    if len(columns) == 1:
+        getter, is_desc = columns[0]
+        if is_desc:
+            return lambda item: (descending(getter(item)),)
+        return lambda item: (getter(item),)
+
+    def sort_key(item):
+        return tuple(descending(getter(item)) if is_desc else getter(item)
+                     for getter, is_desc in columns)
+    return sort_key
+
+
+def make_tuple_sort_key(sorts):
+    """Build a sort key function for (fullname, *sort_values) tuples.
+
+    This is the layout used for items in the query cache.
+
+    """
+
+    return make_sort_key(sorts, [itemgetter(i + 1)
+                                 for i in xrange(len(sorts))])
+
+
+def merge(iterables, key):
+    """Lazily merge sorted iterables into one sorted stream.
+
+    Items with equal keys are produced in the order of the iterables they
+    came from, so merging is stable.
+
+    """
+
+    heap = []
+    for i, iterable in enumerate(iterables):
+        iterator = iter(iterable)
+        for item in iterator:
+            heap.append((key(item), i, item, iterator))
+            break
+    heapify(heap)
+
+    while len(heap) > 1:
+        _, i, item, iterator = heap[0]
+        yield item
+
+        for item in iterator:
+            heapreplace(heap, (key(item), i, item, iterator))
+            break
+        else:
+            heappop(heap)
+
+    # only one stream left, just dump it
+    if heap:
+        _, _, item, iterator = heap[0]
+        yield item
+        for item in iterator:
+            yield item
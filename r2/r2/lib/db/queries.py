@@ -22,12 +22,13 @@
 
 from r2.models import Account, Link, Comment, Vote, Report
 from r2.models import Message, Inbox, Subreddit, ModContribSR, ModeratorInbox, MultiReddit
-from r2.lib.db.thing import Thing, Merge
+from r2.lib.db.thing import Thing, Merge, NotFound
+from r2.lib.db import heapmerge
 from r2.lib.db.operators import asc, desc, timeago
 from r2.lib.db.sorts import epoch_seconds
 from r2.lib.utils import fetch_things2, tup, UniqueIterator, set_last_modified
 from r2.lib import utils
-from r2.lib import amqp, sup, filters
+from r2.lib import amqp, sup, filters, frontpage
 from r2.lib.comment_tree import add_comments, update_comment_votes
 from r2.models.promo import PROMOTE_STATUS, get_promote_srid
 from r2.models.query_cache import (
@@ -47,8 +48,10 @@ from r2.lib.utils import SimpleSillyStub
 import cPickle as pickle
 
 from datetime import datetime
+from operator import itemgetter
 import itertools
 import collections
+import random
 from copy import deepcopy
 from r2.lib.db.operators import and_, or_
 
@@ -60,6 +63,12 @@ worker = amqp.worker
 stats = g.stats
 
 precompute_limit = 1000
+# with g.chunked_listings, precomputed listings are stored as chunks of
+# this many items (see CachedResults)
+precompute_chunk_size = 50
+# chunks replaced by a newer version are kept this long for readers of the
+# head that pointed at them
+precompute_chunk_grace = 10 * 60
 
 db_sorts = dict(hot = (desc, '_hot'),
                 new = (desc, '_date'),
@@ -92,9 +101,77 @@ def filter_thing2(x):
     the object of the relationship."""
     return x._thing2
 
+def _is_chunked(value):
+    return isinstance(value, dict) and 'chunk_size' in value
+
+def _chunk_key(iden, i, gen):
+    return '%s/%d/%s' % (iden, i, gen)
+
+def _chunk_keys(iden, head):
+    return [_chunk_key(iden, i, gen) for i, gen in enumerate(head['gens'])]
+
+def _split_chunks(data, chunk_size=precompute_chunk_size):
+    return [data[i:i + chunk_size] for i in xrange(0, len(data), chunk_size)]
+
+def _make_head(chunks, gens, chunk_size=precompute_chunk_size):
+    # the last item of each chunk is enough to tell which chunk any
+    # position in the listing falls in
+    return dict(chunk_size=chunk_size,
+                count=sum(len(chunk) for chunk in chunks),
+                bounds=[chunk[-1] for chunk in chunks],
+                gens=gens)
+
+def _chunk_writes(iden, data, old_head=None, old_chunks=None):
+    """Work out how to store data as chunks, replacing old_head's.
+
+    Chunks are never overwritten, as a reader could be holding an older
+    head: a chunk whose contents change is written under a key with a
+    new generation, and the one it replaces is rewritten to expire after
+    precompute_chunk_grace.  Returns ({key: chunk} to write,
+    {key: chunk} to expire, the new head).
+
+    """
+    chunks = _split_chunks(data)
+    old_keys = _chunk_keys(iden, old_head) if old_head else []
+    old_gens = old_head['gens'] if old_head else []
+    old_chunks = old_chunks or []
+    gen = None
+    while gen is None or gen in old_gens:
+        gen = '%08x' % random.getrandbits(32)
+
+    changed = {}
+    gens = []
+    for i, chunk in enumerate(chunks):
+        if i < len(old_chunks) and old_chunks[i] == chunk:
+            gens.append(old_gens[i])
+        else:
+            gens.append(gen)
+            changed[_chunk_key(iden, i, gen)] = chunk
+
+    kept = set(_chunk_key(iden, i, gen) for i, gen in enumerate(gens))
+    expired = dict((key, chunk) for key, chunk in zip(old_keys, old_chunks)
+                   if key not in kept and chunk)
+    return changed, expired, _make_head(chunks, gens)
+
 class CachedResults(object):
     """Given a query returns a list-like object that will lazily look up
-    the query from the persistent cache. """
+    the query from the persistent cache.
+
+    The tuples are stored either as one list under the query's iden or,
+    when g.chunked_listings is on, as chunks of precompute_chunk_size
+    tuples under "<iden>/<n>/<generation>" with a small head record under
+    the iden (see _make_head and _chunk_writes). Chunked listings can be
+    read a piece at a time with iter_after, and only the chunks that
+    change are written on mutation.
+
+    The hot listings of subreddits (get_links(sr, 'hot', 'all')) have
+    hot_sr_id set, and keep the subreddit's stream of normalized hot
+    links for front pages up to date as they're mutated (see
+    r2.lib.frontpage).
+    """
+    _head = None
+    hot_sr_id = None
+
     def __init__(self, query, filter):
         self.query = query
         self.query._limit = precompute_limit
@@ -118,12 +195,41 @@ class CachedResults(object):
         if not unfetched:
             return
 
-        cached = query_cache.get_multi([cr.iden for cr in unfetched],
-                                       allow_local = not force)
+        cls._fetch_heads(unfetched, force=force)
+
+        chunked = [cr for cr in unfetched if cr._head]
+        if chunked:
+            keys = [key for cr in chunked
+                    for key in _chunk_keys(cr.iden, cr._head)]
+            chunks = query_cache.get_multi(keys, allow_local = not force)
+            for cr in chunked:
+                cr.data = []
+                for key in _chunk_keys(cr.iden, cr._head):
+                    cr.data.extend(chunks.get(key) or [])
+
         for cr in unfetched:
-            cr.data = cached.get(cr.iden) or []
             cr._fetched = True
 
+    @classmethod
+    def _fetch_heads(cls, crs, force=False):
+        """Load the stored listings, but only the heads of chunked ones."""
+        cached = query_cache.get_multi([cr.iden for cr in crs],
+                                       allow_local = not force)
+        for cr in crs:
+            value = cached.get(cr.iden) or []
+            if _is_chunked(value):
+                cr._head = value
+                cr.data = []
+            else:
+                cr._head = None
+                cr.data = value
+
+    def iter_after(self, after):
+        """Iterate over the fullnames in the listing that come after the
+           thing `after` (or from the start if it's None), reading only
+           as many chunks as are consumed"""
+        return _iter_merged_after([self], after)
+
     def make_item_tuple(self, item):
         """Given a single 'item' from the result of a query build the tuple
         that will be stored in the query cache. It is effectively the
@@ -166,9 +272,43 @@ class CachedResults(object):
         return True
 
     def _mutate(self, fn, willread=True):
-        self.data = query_cache.mutate(self.iden, fn, default=[], willread=willread)
+        chunked = g.chunked_listings
+        result = []
+
+        def _mutate_stored(value):
+            old_head = old_chunks = None
+            if _is_chunked(value):
+                old_head = value
+                keys = _chunk_keys(self.iden, old_head)
+                stored = query_cache.get_multi(keys)
+                old_chunks = [stored.get(key) or [] for key in keys]
+                value = list(itertools.chain(*old_chunks))
+
+            data = fn(value)
+            result.append(data)
+            if self.hot_sr_id is not None:
+                frontpage.update_sr_links(self.hot_sr_id, data)
+            if not chunked:
+                return data
+            return self._write_chunks(data, old_head, old_chunks)
+
+        query_cache.mutate(self.iden, _mutate_stored, default=[],
+                           willread=willread)
+        self.data = result[-1]
+        self._head = None
         self._fetched=True
 
+    def _write_chunks(self, data, old_head=None, old_chunks=None):
+        """Store the chunks of data that differ from old_chunks and
+           return the head to store under the iden."""
+        changed, expired, head = _chunk_writes(self.iden, data, old_head,
+                                               old_chunks)
+        if changed:
+            query_cache.set_multi(changed)
+        if expired:
+            query_cache.set_multi(expired, time=precompute_chunk_grace)
+        return head
+
     def insert(self, items):
         """Inserts the item into the cached data. This only works
            under certain criteria, see can_insert."""
@@ -219,12 +359,55 @@ class CachedResults(object):
             return tuples
         self._mutate(_mutate, willread=False)
 
+    @classmethod
+    def _replace_multi(cls, replacements):
+        """Like _replace, for a list of (CachedResults, tuples) pairs
+           written to the permacache in one batch. Also private to
+           mr_top"""
+        if g.chunked_listings:
+            # the chunks being replaced have to be read to be expired
+            old_heads = query_cache.get_multi([cr.iden
+                                               for cr, tuples in replacements])
+            old_heads = dict((iden, head)
+                             for iden, head in old_heads.iteritems()
+                             if _is_chunked(head))
+            old_chunks = query_cache.get_multi(
+                [key for iden, head in old_heads.iteritems()
+                 for key in _chunk_keys(iden, head)])
+
+            # write all of the chunks before any of the heads that
+            # point at them
+            chunks = {}
+            expired = {}
+            heads = {}
+            for cr, tuples in replacements:
+                old_head = old_heads.get(cr.iden)
+                cr_old_chunks = None
+                if old_head:
+                    cr_old_chunks = [old_chunks.get(key) or []
+                                     for key in _chunk_keys(cr.iden, old_head)]
+                cr_chunks, cr_expired, heads[cr.iden] = _chunk_writes(
+                    cr.iden, tuples, old_head, cr_old_chunks)
+                chunks.update(cr_chunks)
+                expired.update(cr_expired)
+            if chunks:
+                query_cache.set_multi(chunks)
+            query_cache.set_multi(heads)
+            if expired:
+                query_cache.set_multi(expired, time=precompute_chunk_grace)
+        else:
+            query_cache.set_multi(dict((cr.iden, tuples)
+                                       for cr, tuples in replacements))
+
+        for cr, tuples in replacements:
+            cr.data = tuples
+            cr._head = None
+            cr._fetched = True
+
     def update(self):
         """Runs the query and stores the result in the cache. This is
            only run by hand."""
-        self.data = [self.make_item_tuple(i) for i in self.query]
-        self._fetched = True
-        query_cache.set(self.iden, self.data)
+        self._replace([self.make_item_tuple(i) for i in self.query])
 
     def __repr__(self):
         return '<CachedResults %s %s>' % (self.query._rules, self.query._sort)
@@ -244,23 +427,29 @@ class MergedCachedResults(object):
 
     def __init__(self, results):
         self.cached_results = results
-        CachedResults.fetch_multi([r for r in results
-                                   if isinstance(r, CachedResults)])
-        CachedQuery._fetch_multi([r for r in results
-                                   if isinstance(r, CachedQuery)])
-        self._fetched = True
-
         self.sort = results[0].sort
-        comparator = ThingTupleComparator(self.sort)
         # make sure they're all the same
         assert all(r.sort == self.sort for r in results[1:])
+        self._data = None
 
-        all_items = []
-        for cr in results:
-            all_items.extend(cr.data)
-        all_items.sort(cmp=comparator)
-        self.data = all_items
-
+    @property
+    def data(self):
+        """All of the merged tuples. Fetches all of every listing, so
+           prefer iter_after when only the start of the listing is
+           needed"""
+        if self._data is None:
+            results = self.cached_results
+            CachedResults.fetch_multi([r for r in results
+                                       if isinstance(r, CachedResults)])
+            CachedQuery._fetch_multi([r for r in results
+                                       if isinstance(r, CachedQuery)])
+            self._data = _merge_sorted_data(results, self.sort)
+        return self._data
+
+    def iter_after(self, after):
+        """Like CachedResults.iter_after, merging the listings lazily so
+           that the chunks past the requested window are never read"""
+        return _iter_merged_after(self.cached_results, after)
 
     def __repr__(self):
         return '<MergedCachedResults %r>' % (self.cached_results,)
@@ -273,6 +462,151 @@ class MergedCachedResults(object):
         for x in self.cached_results:
             x.update()
 
+def _merge_sorted_data(results, sort):
+    all_items = []
+    for cr in results:
+        all_items.extend(cr.data)
+    all_items.sort(cmp=ThingTupleComparator(sort))
+    return all_items
+
+def _names_after(data, after):
+    names = [t[0] for t in data]
+    if after:
+        try:
+            i = names.index(after._fullname)
+        except ValueError:
+            return iter(())
+        names = names[i + 1:]
+    return iter(names)
+
+class _ChunkCursor(object):
+    """Reads the tuples of one fetched-or-headed CachedResults by chunk."""
+
+    def __init__(self, cr):
+        self.iden = cr.iden
+        self.chunks = {}
+        if cr._head and not cr._fetched:
+            self.bounds = cr._head['bounds']
+            self.keys = _chunk_keys(cr.iden, cr._head)
+        else:
+            # not chunked (or already loaded): it's all one chunk
+            self.bounds = [cr.data[-1]] if cr.data else []
+            self.keys = None
+            self.chunks[0] = cr.data
+
+    def chunk_for(self, key, sort_key):
+        """The first chunk that could contain an item with sort key key."""
+        lo, hi = 0, len(self.bounds)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if sort_key(self.bounds[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def needs(self, i):
+        return i < len(self.bounds) and i not in self.chunks
+
+    def get_chunk(self, i):
+        if self.needs(i):
+            self.chunks[i] = query_cache.get(self.keys[i]) or []
+        return self.chunks.get(i, [])
+
+    def items(self, start=0, skip=None):
+        """Yield the tuples from chunk start on, skipping the leading ones
+           that skip returns True for."""
+        for i in xrange(start, len(self.bounds)):
+            for t in self.get_chunk(i):
+                if skip is not None:
+                    if skip(t):
+                        continue
+                    skip = None
+                yield t
+
+def _load_chunks(wanted):
+    """Read the chunks for (cursor, chunk number) pairs in one batch."""
+    keys = dict((cursor.keys[i], (cursor, i))
+                for cursor, i in wanted if cursor.needs(i))
+    if keys:
+        stored = query_cache.get_multi(keys.keys())
+        for key, (cursor, i) in keys.iteritems():
+            cursor.chunks[i] = stored.get(key) or []
+
+def _iter_merged_after(results, after):
+    """Lazily merge the listings in results, yielding the fullnames after
+       the thing `after` in the order a full sort would give them.
+
+    Only the chunks that the merge reaches are read: the chunk that the
+    listing starts in for each result up front, and the following ones as
+    they're needed. If `after` isn't where its current sort values say it
+    should be (e.g. its score changed since the listing was computed) or
+    the listings can't be read in chunks, fall back to reading everything.
+
+    """
+    sort = results[0].sort
+    lazy = all(isinstance(r, CachedResults) and r.filter is filter_identity
+               for r in results)
+    if not lazy:
+        merged = MergedCachedResults(results)
+        return _names_after(merged.data, after)
+
+    sort_key = heapmerge.make_tuple_sort_key(sort)
+    CachedResults._fetch_heads([r for r in results if not r._fetched])
+    cursors = [_ChunkCursor(r) for r in results]
+
+    if not after:
+        _load_chunks((cursor, 0) for cursor in cursors)
+        sources = [cursor.items() for cursor in cursors]
+    else:
+        # find the chunk that after is stored in, so that we know its
+        # stored sort values and where each listing picks up from there
+        estimate = sort_key(results[0].make_item_tuple(after))
+        starts = [cursor.chunk_for(estimate, sort_key) for cursor in cursors]
+        _load_chunks(zip(cursors, starts))
+
+        found = None
+        for j, (cursor, start) in enumerate(zip(cursors, starts)):
+            for t in cursor.chunks.get(start, ()):
+                if t[0] == after._fullname:
+                    found = j, sort_key(t)
+                    break
+            if found:
+                break
+
+        if not found:
+            CachedResults.fetch_multi(results)
+            return _names_after(_merge_sorted_data(results, sort), after)
+
+        j, after_key = found
+        starts = [starts[j] if k == j
+                  else cursor.chunk_for(after_key, sort_key)
+                  for k, cursor in enumerate(cursors)]
+        _load_chunks(zip(cursors, starts))
+
+        def make_skip(k):
+            # skip what a stable sort of all of the listings would put
+            # before after: ties go to the earlier listing
+            def skip(t):
+                key = sort_key(t)
+                return key < after_key or (key == after_key and k < j)
+            return skip
+
+        sources = []
+        for k, (cursor, start) in enumerate(zip(cursors, starts)):
+            if k == j:
+                items = cursor.items(start)
+                for t in items:
+                    if t[0] == after._fullname:
+                        break
+            else:
+                items = cursor.items(start, make_skip(k))
+            sources.append(items)
+
+    merged = heapmerge.merge(sources, sort_key)
+    return itertools.imap(itemgetter(0),
+                          UniqueIterator(merged, key=itemgetter(0)))
+
 def make_results(query, filter = filter_identity):
     return CachedResults(query, filter)
 
@@ -334,6 +668,8 @@ def _get_links(sr_id, sort, time):
         q._filter(db_times[time])
 
     res = make_results(q)
+    if sort == 'hot' and time == 'all':
+        res.hot_sr_id = sr_id
 
     return res
 
@@ -797,6 +1133,44 @@ def add_queries(queries, insert_items=None, delete_items=None, foreground=False)
             for query in new_queries:
                 m.delete(query, tup(delete_items))
 
+class QueryBatch(object):
+    """Collects listing insertions so that each listing is mutated once.
+
+    Used by batched queue processors: rather than calling add_queries for
+    every item, the items inserted into each listing are accumulated and
+    written by send() in one mutation per listing.  Inserting the same
+    thing into a listing twice only keeps the latest copy.
+
+    """
+
+    def __init__(self):
+        self.inserts = collections.OrderedDict()
+        self.mutator = CachedQueryMutator()
+
+    def add_queries(self, queries, insert_items):
+        for q in queries:
+            if not q.can_insert():
+                raise Exception("Cannot update query %r!" % (q,))
+
+            query, items = self.inserts.setdefault(
+                q.iden, (q, collections.OrderedDict()))
+            for item in tup(insert_items):
+                items[item._fullname] = item
+
+    def send(self):
+        for query, items in self.inserts.itervalues():
+            items = items.values()
+            log.debug("Inserting %s into query %s" % (items, query))
+            query.insert(items)
+
+            # dual-write any queries that are being migrated to the new
+            # query cache
+            if hasattr(query, 'new_query'):
+                self.mutator.insert(query.new_query, items)
+
+        self.inserts.clear()
+        self.mutator.send()
+
 #can be rewritten to be more efficient
 def all_queries(fn, obj, *param_lists):
     """Given a fn and a first argument 'obj', calls the fn(obj, *params)
@@ -899,7 +1273,13 @@ def new_subreddit(sr):
     amqp.add_item('new_subreddit', sr._fullname)
 
 
-def new_vote(vote, foreground=False, timer=None):
+def new_vote(vote, foreground=False, timer=None, batch=None):
+    """Update the listings affected by a vote.
+
+    If a QueryBatch is given, the listing updates are added to it instead
+    of being written immediately.
+
+    """
     user = vote._thing1
     item = vote._thing2
 
@@ -935,23 +1315,28 @@ def new_vote(vote, foreground=False, timer=None):
                     for sort in ("hot", "top", "controversial"):
                         results.append(get_domain_links(domain, sort, "all"))
 
-        add_queries(results, insert_items = item, foreground=foreground)
+        if batch:
+            batch.add_queries(results, insert_items=item)
+        else:
+            add_queries(results, insert_items = item, foreground=foreground)
 
     timer.intermediate("permacache")
     
     if isinstance(item, Link):
         # must update both because we don't know if it's a changed
         # vote
-        with CachedQueryMutator() as m:
-            if vote._name == '1':
-                m.insert(get_liked(user), [vote])
-                m.delete(get_disliked(user), [vote])
-            elif vote._name == '-1':
-                m.delete(get_liked(user), [vote])
-                m.insert(get_disliked(user), [vote])
-            else:
-                m.delete(get_liked(user), [vote])
-                m.delete(get_disliked(user), [vote])
+        m = batch.mutator if batch else CachedQueryMutator()
+        if vote._name == '1':
+            m.insert(get_liked(user), [vote])
+            m.delete(get_disliked(user), [vote])
+        elif vote._name == '-1':
+            m.delete(get_liked(user), [vote])
+            m.insert(get_disliked(user), [vote])
+        else:
+            m.delete(get_liked(user), [vote])
+            m.delete(get_disliked(user), [vote])
+        if not batch:
+            m.send()
 
 def new_message(message, inbox_rels):
     from r2.lib.comment_tree import add_message
@@ -1396,6 +1781,7 @@ def queue_vote(user, thing, dir, ip, organic = False,
     # set the vote in memcached so the UI gets updated immediately
     key = prequeued_vote_key(user, thing)
     g.cache.set(key, '1' if dir is True else '0' if dir is None else '-1')
+    Vote.cache_vote(user, thing)
     # queue the vote to be stored unless told not to
     if store:
         if g.amqp_host:
@@ -1433,7 +1819,8 @@ def get_likes(user, items):
 
     res = {}
 
-    # check the prequeued_vote_keys
+    # check the prequeued_vote_keys, fetching the vote caches Vote.likes
+    # will need in the same round trip
     keys = {}
     for item in items:
         if (user, item) in res:
@@ -1441,12 +1828,15 @@ def get_likes(user, items):
 
         key = prequeued_vote_key(user, item)
         keys[key] = (user, item)
+    cached = {}
     if keys:
-        r = g.cache.get_multi(keys.keys())
-        for key, v in r.iteritems():
-            res[keys[key]] = (True if v == '1'
-                              else False if v == '-1'
-                              else None)
+        vote_cache_keys = Vote.likes_cache_keys(user, items)
+        cached = g.cache.get_multi(keys.keys() + vote_cache_keys)
+        for key, v in cached.iteritems():
+            if key in keys:
+                res[keys[key]] = (True if v == '1'
+                                  else False if v == '-1'
+                                  else None)
 
     for item in items:
         # already retrieved above
@@ -1457,14 +1847,15 @@ def get_likes(user, items):
         if not isinstance(item, (Link, Comment)):
             res[(user, item)] = None
 
-    likes = Vote.likes(user, [i for i in items if (user, i) not in res])
+    likes = Vote.likes(user, [i for i in items if (user, i) not in res],
+                       cached=cached)
 
     res.update(likes)
 
     return res
 
 def handle_vote(user, thing, dir, ip, organic,
-                cheater=False, foreground=False, timer=None):
+                cheater=False, foreground=False, timer=None, batch=None):
     if timer is None:
         timer = SimpleSillyStub()
 
@@ -1477,7 +1868,7 @@ def handle_vote(user, thing, dir, ip, organic,
         g.log.error("duplicate vote for: %s" % str((user, thing, dir)))
         return
 
-    new_vote(v, foreground=foreground, timer=timer)
+    new_vote(v, foreground=foreground, timer=timer, batch=batch)
 
     timestamps = []
     if isinstance(thing, Link):
@@ -1511,8 +1902,33 @@ def handle_vote(user, thing, dir, ip, organic,
     timer.intermediate("last_modified")
 
 
+def _load_existing(load, ids):
+    """Load ids with load, leaving out the ones that don't exist.
+
+    load is something like Account._byID, returning a dict for a list of
+    ids and raising NotFound if any of them is missing.
+
+    """
+    try:
+        return load(ids, data=True)
+    except NotFound:
+        found = {}
+        for _id in ids:
+            try:
+                found[_id] = load(_id, data=True)
+            except NotFound:
+                g.log.warning("skipping votes for missing %r" % (_id,))
+        return found
+
+
 def process_votes(qname, limit=0):
-    # limit is taken but ignored for backwards compatibility
+    """Process queued votes.
+
+    By default votes are consumed and handled one at a time. If limit is
+    given, up to that many votes are pulled off the queue at once and
+    handled as a batch (see _handle_votes below).
+
+    """
     stats_qname = qname
     if stats_qname.startswith("vote_link"):
         stats_qname = "vote_link_q"
@@ -1543,4 +1959,55 @@ def process_votes(qname, limit=0):
 
         timer.flush()
 
-    amqp.consume_items(qname, _handle_vote, verbose = False)
+    @g.stats.amqp_processor(stats_qname)
+    def _handle_votes(msgs, chan):
+        timer = stats.get_timer("service_time." + stats_qname)
+        timer.start()
+
+        # collapse repeated votes by the same user on the same thing,
+        # the most recently queued one wins
+        votes = collections.OrderedDict()
+        for msg in msgs:
+            uid, tid, dir, ip, organic, cheater = pickle.loads(msg.body)
+            votes.pop((uid, tid), None)
+            votes[(uid, tid)] = (dir, ip, organic, cheater)
+
+        # one missing account or thing mustn't fail the whole batch, or
+        # it would be requeued and fail again forever
+        voters = _load_existing(Account._byID,
+                                list(set(uid for uid, tid in votes)))
+        votees = _load_existing(Thing._by_fullname,
+                                list(set(tid for uid, tid in votes)))
+        timer.intermediate("preamble")
+
+        batch = QueryBatch()
+        comments = {}
+        for (uid, tid), (dir, ip, organic, cheater) in votes.iteritems():
+            voter = voters.get(uid)
+            votee = votees.get(tid)
+            if voter is None or votee is None:
+                continue
+
+            # I don't know how, but somebody is sneaking in votes
+            # for subreddits
+            if isinstance(votee, (Link, Comment)):
+                handle_vote(voter, votee, dir, ip, organic,
+                            cheater=cheater, foreground=True, timer=timer,
+                            batch=batch)
+
+            if isinstance(votee, Comment):
+                comments[votee._fullname] = votee
+
+        batch.send()
+        timer.intermediate("permacache_batch")
+
+        if comments:
+            update_comment_votes(comments.values())
+            timer.intermediate("update_comment_votes")
+
+        timer.flush()
+
+    if limit:
+        amqp.handle_items(qname, _handle_votes, limit=limit, verbose=False)
+    else:
+        amqp.consume_items(qname, _handle_vote, verbose = False)
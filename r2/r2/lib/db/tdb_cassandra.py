@@ -919,13 +919,7 @@ class DenormalizedRelation(object):
         if not thing2s:
             return {}
 
-        # fetch the row from cassandra. if it doesn't exist, thing1 has no
-        # relation of this type to any thing2!
-        try:
-            columns = [thing2._id36 for thing2 in thing2s]
-            results = cls._cf.get(thing1._id36, columns)
-        except NotFoundException:
-            results = {}
+        results = cls._get_columns(thing1, thing2s)
 
         # return the data in the expected format
         if not thing2s_is_single:
@@ -941,6 +935,17 @@ class DenormalizedRelation(object):
                 raise NotFound("<%s %r>" % (cls.__name__, (thing1._id36,
                                                            thing2._id36)))
 
+    @classmethod
+    def _get_columns(cls, thing1, thing2s):
+        """Fetch {thing2._id36 : value} for thing2s from thing1's row."""
+        # fetch the row from cassandra. if it doesn't exist, thing1 has no
+        # relation of this type to any thing2!
+        try:
+            columns = [thing2._id36 for thing2 in thing2s]
+            return cls._cf.get(thing1._id36, columns)
+        except NotFoundException:
+            return {}
+
 
 class ColumnQuery(object):
     """
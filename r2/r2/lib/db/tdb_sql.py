@@ -33,6 +33,7 @@ import sqlalchemy as sa
 
 from r2.lib import filters
 from r2.lib.utils import (
+    in_chunks,
     iters,
     Results,
     simple_traceback,
@@ -661,6 +662,68 @@ def get_thing(type_id, thing_id):
             res[row.thing_id] = stor
     return res
 
+def get_things_with_data(type_id, thing_ids, chunk_size=1000):
+    """Stream (thing_id, props, data) for each of thing_ids that exists.
+
+    Rather than fetching from the thing and data tables separately, each
+    chunk of ids is fetched with a single outer join and the rows are
+    grouped as they're read off the cursor.  Things come back in id order
+    within each chunk.
+
+    """
+    thing_table, data_table = get_thing_table(type_id)
+    joined = thing_table.outerjoin(
+        data_table, data_table.c.thing_id == thing_table.c.thing_id)
+    columns = [thing_table.c.thing_id,
+               thing_table.c.ups,
+               thing_table.c.downs,
+               thing_table.c.date,
+               thing_table.c.deleted,
+               thing_table.c.spam,
+               data_table.c.key,
+               data_table.c.value,
+               data_table.c.kind]
+
+    for chunk in in_chunks(thing_ids, chunk_size):
+        s = sa.select(columns, thing_table.c.thing_id.in_(chunk),
+                      from_obj=[joined], order_by=thing_table.c.thing_id)
+        s = add_request_info(s).execution_options(stream_results=True)
+
+        try:
+            r = s.execute()
+        except Exception, e:
+            dbm.mark_dead(thing_table.bind)
+            # this thread must die so that others may live
+            raise
+
+        current = props = data = None
+        while True:
+            # iterating over the result directly fetches a row at a time
+            rows = r.fetchmany(chunk_size)
+            if not rows:
+                break
+
+            for (thing_id, ups, downs, date, deleted, spam,
+                 key, value, kind) in rows:
+                if thing_id != current:
+                    if current is not None:
+                        yield current, props, data
+                    current = thing_id
+                    props = storage(ups = ups,
+                                    downs = downs,
+                                    date = date,
+                                    deleted = deleted,
+                                    spam = spam)
+                    data = storage()
+
+                # things without any data get a single row of NULLs from
+                # the data table
+                if key is not None:
+                    data[key] = db2py(value, kind)
+
+        if current is not None:
+            yield current, props, data
+
 def set_rel_data(rel_type_id, thing_id, brand_new_thing, **vals):
     table = get_rel_table(rel_type_id, action = 'write')[3]
 
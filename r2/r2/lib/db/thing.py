@@ -27,11 +27,13 @@ import hashlib
 from datetime import datetime
 from copy import copy, deepcopy
 
+import heapmerge
 import operators
 import tdb_sql as tdb
 import sorts
 from .. utils import iters, Results, tup, to36, Storage, timefromnow
 from .. utils import iters, Results, tup, to36, Storage, thing_utils, timefromnow
+from .. utils import in_chunks
 from r2.config import cache
 from r2.lib.cache import sgm
 from r2.lib.log import log_text
@@ -567,6 +569,7 @@ class Thing(DataThing):
     _get_data = staticmethod(tdb.get_thing_data)
     _set_data = staticmethod(tdb.set_thing_data)
     _get_item = staticmethod(tdb.get_thing)
+    _get_items_with_data = staticmethod(tdb.get_things_with_data)
     _incr_data = staticmethod(tdb.incr_thing_data)
     _type_prefix = 't'
 
@@ -623,6 +626,32 @@ class Thing(DataThing):
         return cls(bases.ups, bases.downs, bases.date,
                    bases.deleted, bases.spam, id)
 
+    @classmethod
+    def _byID_bulk(cls, ids, chunk_size=1000):
+        """Load things with their data straight from the database.
+
+        This is for jobs that walk through lots of things: the cache is
+        neither read nor written, and each chunk of ids is loaded in one
+        round trip rather than one for the things and another for their
+        data. Things are yielded in the order of `ids`, and ids that don't
+        exist are skipped.
+
+        """
+        for chunk in in_chunks(ids, chunk_size):
+            found = {}
+            rows = cls._get_items_with_data(cls._type_id, chunk,
+                                            chunk_size=chunk_size)
+            for thing_id, bases, data in rows:
+                thing = cls._build(thing_id, bases)
+                thing._t.update(data)
+                thing._loaded = True
+                thing._asked_for_data = True
+                found[thing_id] = thing
+
+            for thing_id in chunk:
+                if thing_id in found:
+                    yield found[thing_id]
+
     @classmethod
     def _query(cls, *all_rules, **kw):
         need_deleted = True
@@ -904,6 +933,9 @@ class Query(object):
         self._cache_time = kw.get('cache_time', 0)
         self._limit = kw.get('limit')
         self._data = kw.get('data')
+        # load results (with their data) from the db in bulk, skipping the
+        # thing cache. see Thing._byID_bulk
+        self._bulk = kw.get('bulk', False)
         self._sort = kw.get('sort', ())
         self._filter_primary_sort_only = kw.get('filter_primary_sort_only', False)
 
@@ -1082,6 +1114,9 @@ class Things(Query):
             else:
                 _ids = rows
                 extra_props = {}
+
+            if self._bulk and not extra_props:
+                return list(self._kind._byID_bulk(_ids))
             return self._kind._byID(_ids, self._data, False, extra_props)
 
         return Results(c, row_fn, True)
@@ -1152,59 +1187,19 @@ class MultiCursor(object):
 
 class MergeCursor(MultiCursor):
     def _execute(self, cursors, sorts):
-        #a "pair" is a (cursor, item, done) tuple
-        def safe_next(c):
-            try:
-                #hack to keep searching even if fetching a thing returns notfound
-                while True:
-                    try:
-                        return [c, c.fetchone(), False]
-                    except NotFound:
-                        #skips the broken item
-                        pass
-            except StopIteration:
-                return c, None, True
-
-        def undone(pairs):
-            return [p for p in pairs if not p[2]]
-
-        pairs = undone(safe_next(c) for c in cursors)
-
-        while pairs:
-            #only one query left, just dump it
-            if len(pairs) == 1:
-                c, item, done = pair = pairs[0]
-                while not done:
-                    yield item
-                    c, item, done = safe_next(c)
-                    pair[:] = c, item, done
-            else:
-                #by default, yield the first item
-                yield_pair = pairs[0]
-                for s in sorts:
-                    col = s.col
-                    #sort direction?
-                    max_fn = min if isinstance(s, operators.asc) else max
-
-                    #find the max (or min) val
-                    vals = [(getattr(i[1], col), i) for i in pairs]
-                    max_pair = vals[0]
-                    all_equal = True
-                    for pair in vals[1:]:
-                        if all_equal and pair[0] != max_pair[0]:
-                            all_equal = False
-                        max_pair = max_fn(max_pair, pair, key=lambda x: x[0])
-
-                    if not all_equal:
-                        yield_pair = max_pair[1]
-                        break
-
-                c, item, done = yield_pair
-                yield item
-                yield_pair[:] = safe_next(c)
-
-            pairs = undone(pairs)
-        raise StopIteration
+        def found_items(c):
+            while True:
+                try:
+                    yield c.fetchone()
+                except NotFound:
+                    #hack to keep searching even if fetching a thing
+                    #returns notfound: skips the broken item
+                    pass
+                except StopIteration:
+                    return
+
+        return heapmerge.merge([found_items(c) for c in cursors],
+                               heapmerge.make_sort_key(sorts))
 
 class MultiQuery(Query):
     def __init__(self, queries, *rules, **kw):
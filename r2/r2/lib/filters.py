@@ -21,6 +21,7 @@
 ###############################################################################
 
 import cgi
+import hashlib
 import os
 import urllib
 import re
@@ -218,8 +219,89 @@ def markdown_souptest(text, nofollow=False, target=None, renderer=None):
 
     return smd
 
-#TODO markdown should be looked up in batch?
-#@memoize('markdown')
+MARKDOWN_CACHE_PREFIX = 'md.'
+
+def _markdown_key(text, nofollow, target):
+    # text must already be utf8. snudown's version is part of the key so
+    # that upgrading it doesn't serve markup rendered by the old one
+    h = hashlib.md5(repr((bool(nofollow), target,
+                          getattr(snudown, '__version__', None))))
+    h.update(text)
+    return MARKDOWN_CACHE_PREFIX + h.hexdigest()
+
+# well over a page's worth, so a request never outgrows it. scripts and
+# queue consumers share one c for their whole run, so it's emptied past this
+MAX_RENDERED_MARKDOWN = 2000
+
+def _rendered_markdown():
+    """The markdown rendered or fetched so far in this request, by (text,
+    nofollow, target)."""
+    rendered = c.rendered_markdown
+    if not isinstance(rendered, dict) or len(rendered) > MAX_RENDERED_MARKDOWN:
+        rendered = c.rendered_markdown = {}
+    return rendered
+
+def render_markdown(text, nofollow=False, target=None):
+    """Render text with snudown, looking it up in g.markdowncache first.
+
+    The cache is keyed by a hash of the text and the renderer options, so
+    entries never need to be invalidated."""
+    rendered = _rendered_markdown()
+    options = (text, bool(nofollow), target)
+    html = rendered.get(options)
+    if html is None:
+        text = _force_utf8(text)
+        key = _markdown_key(text, nofollow, target)
+        html = g.markdowncache.get(key)
+        if html is None:
+            g.stats.cache_count('markdown.miss')
+            html = snudown.markdown(text, nofollow, target)
+            g.markdowncache.set(key, html)
+        else:
+            g.stats.cache_count('markdown.hit')
+        rendered[options] = html
+    return html
+
+def prefetch_markdown(items):
+    """Render the markdown for a page's worth of (text, nofollow, target)
+    in one go, so that the templates find it ready.
+
+    Everything is looked up in g.markdowncache with one get_multi, and
+    whatever's missing is rendered and stored with one set_multi."""
+    rendered = _rendered_markdown()
+    wanted = {}
+    for text, nofollow, target in items:
+        options = (text, bool(nofollow), target)
+        if text and options not in rendered:
+            utf8 = _force_utf8(text)
+            wanted[_markdown_key(utf8, nofollow, target)] = (options, utf8)
+
+    if not wanted:
+        return
+
+    found = g.markdowncache.get_multi(wanted.keys())
+    missing = {}
+    for key, (options, utf8) in wanted.iteritems():
+        html = found.get(key)
+        if html is None:
+            text, nofollow, target = options
+            html = missing[key] = snudown.markdown(utf8, nofollow, target)
+        rendered[options] = html
+
+    g.stats.cache_count_multi({'markdown.hit': len(found),
+                               'markdown.miss': len(missing)})
+    if missing:
+        g.markdowncache.set_multi(missing)
+
+def prerender_markdown(text):
+    """Render newly written text ahead of its first view.
+
+    Only done if markdown_prerender is on. It covers the options most
+    views use: no target and either nofollow setting."""
+    if not text or not g.markdown_prerender:
+        return
+    prefetch_markdown([(text, False, None), (text, True, None)])
+
 def safemarkdown(text, nofollow=False, wrap=True, **kwargs):
     if not text:
         return None
@@ -230,7 +312,7 @@ def safemarkdown(text, nofollow=False, wrap=True, **kwargs):
     if "target" not in kwargs and c.cname:
         target = "_top"
 
-    text = snudown.markdown(_force_utf8(text), nofollow, target)
+    text = render_markdown(text, nofollow, target)
 
     if wrap:
         return SC_OFF + MD_START + text + MD_END + SC_ON
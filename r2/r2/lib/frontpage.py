@@ -0,0 +1,196 @@
+# The contents of this file are subject to the Common Public Attribution
+# License Version 1.0. (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://code.reddit.com/LICENSE. The License is based on the Mozilla Public
+# License Version 1.1, but Sections 14 and 15 have been added to cover use of
+# software over a computer network and provide for limited attribution for the
+# Original Developer. In addition, Exhibit A has been modified to be consistent
+# with Exhibit B.
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License for
+# the specific language governing rights and limitations under the License.
+#
+# The Original Code is reddit.
+#
+# The Original Developer is the Initial Developer.  The Initial Developer of
+# the Original Code is reddit Inc.
+#
+# All portions of the code written by reddit are Copyright (c) 2006-2012 reddit
+# Inc. All Rights Reserved.
+###############################################################################
+"""Materialized front pages.
+
+A front page is the normalized hot listing of each of a set of subreddits
+(see r2.lib._normalized_hot) merged together.  Rather than merging for
+every request, the front page is materialized once per distinct set of
+subreddits and shared by everybody subscribed to that set, so that serving
+it is a single cache read.
+
+Each subreddit's normalized hot links are kept in the cache as a sorted
+stream shared by every set including that subreddit.  The stream is
+maintained by CachedResults whenever the subreddit's hot listing is
+written (see update_sr_links), so refreshing a front page that has gone
+stale is only a k-way merge of the streams down to the first max_links
+links, rather than normalizing and sorting every listing again.
+
+Writing a stream also bumps the subreddit's version.  A front page is
+stored with the versions of the streams it was merged from, and is
+refreshed as soon as any of them changes (e.g. after a vote or a new
+link), or at the latest once it's older than page_cache_time.  The page
+and the versions are read together in one get_multi.  While one process
+refreshes a page the others keep serving their stale copy.
+
+How well front pages are shared is reported under the frontpage counter:
+"read" for every front page served, "materialize" for every refresh and
+"stale" for stale copies served during one, and "sr_reused" and
+"sr_computed" for the streams used by the refreshes.
+
+"""
+
+from hashlib import md5
+from itertools import islice
+from time import time
+
+from pylons import g
+
+from r2.lib.db import heapmerge
+from r2.lib.singleflight import flights
+
+
+# the number of links in a front page, as many as in the listings it's
+# made from (queries.precompute_limit)
+max_links = 1000
+
+# streams of subreddits whose hot listings haven't been written in this
+# long are dropped and rebuilt from the listing on demand
+SR_LINKS_TIME = 60 * 60
+
+SR_LINKS_PREFIX = 'frontpage_sr.'
+VERSION_PREFIX = 'frontpage_sr_version.'
+
+# how long a refresh may take before another process takes it over
+LEASE_TIME = 30
+
+
+def _front_page_key(sr_ids, obey_age_limit):
+    h = md5(','.join(str(sr_id) for sr_id in sr_ids)).hexdigest()
+    return 'frontpage.%d.%s' % (bool(obey_age_limit), h)
+
+
+def _count(name, delta=1):
+    counter = g.stats.get_counter('frontpage')
+    if counter:
+        counter.increment(name, delta=delta)
+
+
+def update_sr_links(sr_id, tuples):
+    """Replace the stream of a subreddit from its hot listing's tuples.
+
+    This must be called with the listing locked, so that concurrent
+    writes of the listing update the stream in the same order.  The
+    version is bumped after the stream is written, so that a refresh
+    racing with this can only record the old version and be redone.
+
+    """
+    from r2.lib._normalized_hot import normalize_hot
+
+    g.cache.set(SR_LINKS_PREFIX + str(sr_id), normalize_hot(tuples),
+                time=SR_LINKS_TIME)
+    g.cache.set(VERSION_PREFIX + str(sr_id), time(), time=SR_LINKS_TIME)
+
+
+def _get_sr_links(sr_ids):
+    """Return the stream of each subreddit, building the missing ones."""
+    from r2.models import Subreddit
+    from r2.lib.db.queries import CachedResults, get_links
+    from r2.lib._normalized_hot import normalize_hot
+
+    sr_links = g.cache.get_multi(sr_ids, prefix=SR_LINKS_PREFIX)
+    missing = [sr_id for sr_id in sr_ids if sr_id not in sr_links]
+
+    _count('sr_reused', len(sr_links))
+    _count('sr_computed', len(missing))
+
+    if missing:
+        srs = Subreddit._byID(missing, return_dict=False)
+        results = [get_links(sr, 'hot', 'all') for sr in srs]
+        CachedResults.fetch_multi(results)
+        built = dict((sr._id, normalize_hot(list(cr.data)))
+                     for sr, cr in zip(srs, results))
+        # only add them, a stream written since the listings were read is
+        # more recent than these
+        g.cache.add_multi(built, prefix=SR_LINKS_PREFIX, time=SR_LINKS_TIME)
+        sr_links.update(built)
+
+    return sr_links
+
+
+def _merge_key(link):
+    # hottest first, the same order as sorting the tuples in reverse
+    ehot, hot, fullname, es = link
+    return (-ehot, -hot, heapmerge.descending(fullname))
+
+
+def _materialize(sr_ids, obey_age_limit):
+    _count('materialize')
+    streams = _get_sr_links(sr_ids).values()
+
+    if obey_age_limit and g.HOT_PAGE_AGE:
+        oldest = time() - 60*60*24*g.HOT_PAGE_AGE
+        streams = [(link for link in stream if link[3] > oldest)
+                   for stream in streams]
+
+    merged = heapmerge.merge(streams, key=_merge_key)
+    return [link[2] for link in islice(merged, max_links)]
+
+
+def _refresh(key, sr_ids, obey_age_limit, versions, stale):
+    """Materialize and store a front page, or return the stale copy if
+    another process is already refreshing it."""
+    lease_key = 'frontpage_lease(%s)' % key
+
+    def fill():
+        if stale is not None:
+            if not g.lock_cache.add(lease_key, 1, time=LEASE_TIME):
+                _count('stale')
+                return stale
+
+        try:
+            fullnames = _materialize(sr_ids, obey_age_limit)
+            g.cache.set(key, (versions, time(), fullnames),
+                        time=2 * g.page_cache_time)
+        finally:
+            if stale is not None:
+                g.lock_cache.delete(lease_key)
+        return fullnames
+
+    return flights.do(('frontpage', key), fill)[0]
+
+
+def get_front_page(sr_ids, obey_age_limit=True):
+    """Return the fullnames of the front page for a sorted list of sr_ids.
+
+    The stored page is served as long as none of the subreddits' streams
+    have changed since it was materialized and it's not older than
+    page_cache_time.
+
+    """
+    _count('read')
+    key = _front_page_key(sr_ids, obey_age_limit)
+    version_keys = [VERSION_PREFIX + str(sr_id) for sr_id in sr_ids]
+
+    cached = g.cache.get_multi([key] + version_keys)
+    # the versions are read before the streams are, see update_sr_links
+    versions = [cached.get(version_key) for version_key in version_keys]
+
+    stale = None
+    page = cached.get(key)
+    if isinstance(page, tuple):
+        page_versions, materialized, fullnames = page
+        if (page_versions == versions
+                and time() < materialized + g.page_cache_time):
+            return fullnames
+        stale = fullnames
+
+    return _refresh(key, sr_ids, obey_age_limit, versions, stale)
@@ -44,8 +44,12 @@ class ObjectTemplate(StringTemplate):
         self.d = d
 
     def update(self, kw):
+        start_delim = StringTemplate.start_delim
         def _update(obj):
             if isinstance(obj, (str, unicode)):
+                # most strings have no variables, so skip templating them
+                if isinstance(obj, unicode) and start_delim not in obj:
+                    return obj
                 return StringTemplate(obj).finalize(kw)
             elif isinstance(obj, dict):
                 return dict((k, _update(v)) for k, v in obj.iteritems())
@@ -60,6 +64,10 @@ class ObjectTemplate(StringTemplate):
 
     def finalize(self, kw = {}):
         return self.update(kw).d
+
+    def segments(self):
+        # there is no text to split: stubs are objects in here
+        return None
     
 class JsonTemplate(Template):
     def __init__(self): pass
@@ -25,11 +25,9 @@ from hashlib import md5
 from r2.config import cache
 from r2.lib.filters import _force_utf8
 from r2.lib.cache import NoneResult, make_key
-from r2.lib.lock import make_lock_factory
+from r2.lib.singleflight import get_or_compute
 from pylons import g
 
-make_lock = g.make_lock
-
 def memoize(iden, time = 0, stale=False, timeout=30):
     def memoize_fn(fn):
         from r2.lib.memoize import NoneResult
@@ -41,25 +39,19 @@ def memoize(iden, time = 0, stale=False, timeout=30):
 
             key = make_key(iden, *a, **kw)
 
-            res = None if update else cache.get(key, stale=stale)
-
-            if res is None:
-                # not cached, we should calculate it.
-                with make_lock("memoize", 'memoize_lock(%s)' % key,
-                               time=timeout, timeout=timeout):
+            def compute():
+                res = fn(*a, **kw)
+                if res is None:
+                    res = NoneResult
+                return res
 
-                    # see if it was completed while we were waiting
-                    # for the lock
-                    stored = None if update else cache.get(key)
-                    if stored is not None:
-                        # it was calculated while we were waiting
-                        res = stored
-                    else:
-                        # okay now go and actually calculate it
-                        res = fn(*a, **kw)
-                        if res is None:
-                            res = NoneResult
-                        cache.set(key, res, time = time)
+            # concurrent misses (in this process or others) will share a
+            # single computation of the value, see r2.lib.singleflight
+            res = get_or_compute(cache, key, compute, time=time, stale=stale,
+                                 update=update, lease_cache=g.lock_cache,
+                                 lease_time=timeout,
+                                 soft_expire=g.memoize_soft_expire,
+                                 stats=g.stats, stats_name="memoize")
 
             if res == NoneResult:
                 res = None
@@ -20,10 +20,12 @@
 # Inc. All Rights Reserved.
 ###############################################################################
 
+import sys
+
 from r2.lib import mr_tools
 from r2.lib import utils
 from r2.lib.utils import to36
-from r2.lib.db import sorts
+from r2.lib.db import batch_sorts
 
 # dumps | sort | join_comments() | combine_links | sort | store_sorts()
 
@@ -32,24 +34,34 @@ from r2.lib.db import sorts
 def join_comments():
     return mr_tools.join_things(('link_id',))
 
-def combine_links():
+def combine_links(fd = sys.stdin, chunk_size = 10000):
     @mr_tools.dataspec_m_thing(('link_id', int))
-    def _process(t):
-        thing_id = t.thing_id
-        id36 = to36(thing_id)
+    def _parse(t):
+        return t
 
-        link_id = t.link_id
-        link_id36 = to36(link_id)
+    def _process(things):
+        # compute the sorts for a whole chunk of comments at once
+        ups = [t.ups for t in things]
+        downs = [t.downs for t in things]
+        timestamps = [t.timestamp for t in things]
+        values = zip(batch_sorts.controversies(ups, downs),
+                     batch_sorts.hots(ups, downs, timestamps),
+                     batch_sorts.confidences(ups, downs),
+                     batch_sorts.scores(ups, downs))
 
-        ups, downs, timestamp = t.ups, t.downs, t.timestamp
+        for t, (controversy, hot, confidence, score) in zip(things, values):
+            id36 = to36(t.thing_id)
+            link_id36 = to36(t.link_id)
 
-        yield link_id36+'_controversy', id36, sorts.controversy(ups, downs)
-        yield link_id36+'_hot',         id36, sorts._hot(ups, downs, timestamp)
-        yield link_id36+'_confidence',  id36, sorts.confidence(ups, downs)
-        yield link_id36+'_score',       id36, sorts.score(ups, downs)
-        yield link_id36+'_date',        id36, timestamp
+            yield link_id36+'_controversy', id36, controversy
+            yield link_id36+'_hot',         id36, hot
+            yield link_id36+'_confidence',  id36, confidence
+            yield link_id36+'_score',       id36, score
+            yield link_id36+'_date',        id36, t.timestamp
 
-    return mr_tools.mr_map(_process)
+    things = (_parse(line.strip('\n').split('\t')) for line in fd)
+    for chunk in utils.in_chunks(things, chunk_size):
+        mr_tools.emit_all(_process(chunk))
 
 def store_sorts():
     from r2.models import CommentSortsCache
@@ -351,6 +351,31 @@ def convert_query_cache_to_json():
                 out[ckey] = json.dumps(raw)
             m.insert(key, out)
 
+def convert_query_cache_to_sorted(model, sorted_model, sorts):
+    """Copy the rows of a query cache into its sorted counterpart.
+
+    sorts maps the name of each query (the start of its row key, e.g.
+    "spam_links") to its sort, e.g. [desc('_date')]. Rows of other queries,
+    and precomputed ones, are skipped.
+
+    """
+    from r2.models.query_cache import json, _encode_sort_key
+
+    with sorted_model._cf.batch() as m:
+        for key, columns in model._cf.get_range():
+            sort = sorts.get(key.split('.')[0])
+            if not sort or '/' in key:
+                continue
+
+            out = {}
+            for fullname, value in columns.iteritems():
+                values = json.loads(value)
+                column = _encode_sort_key(sort, values) + fullname
+                out[column] = json.dumps([fullname] + values)
+                out['~' + fullname] = column
+            if out:
+                m.insert(key, out)
+
 def populate_spam_filtered():
     from r2.lib.db.queries import get_spam_links, get_spam_comments
     from r2.lib.db.queries import get_spam_filtered_links, get_spam_filtered_comments
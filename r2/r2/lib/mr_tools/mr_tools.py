@@ -20,11 +20,16 @@
 # Inc. All Rights Reserved.
 ###############################################################################
 
+import gc
+import marshal
 import sys
 import multiprocessing
+from heapq import heappush, heapreplace
+from itertools import islice
+from Queue import Empty, Full
 
 from r2.lib.mr_tools._mr_tools import mr_map, mr_reduce, format_dataspec
-from r2.lib.mr_tools._mr_tools import stdin, emit
+from r2.lib.mr_tools._mr_tools import stdin, emit, in_chunks
 
 def join_things(fields, deleted=False, spam=True):
     """A reducer that joins thing table dumps and data table dumps"""
@@ -99,6 +104,141 @@ def mr_map_parallel(processor, fd = stdin,
         for subres in res:
             emit(subres)
 
+def _put(queue, item, procs):
+    # a blocking put that gives up if the processes that would drain the
+    # queue have died, rather than hanging forever
+    while True:
+        try:
+            queue.put(item, timeout=1)
+            return
+        except Full:
+            _check_procs(procs)
+
+def _check_procs(procs):
+    for proc in procs:
+        if proc.exitcode:
+            raise Exception("%s exited with %d" % (proc.name, proc.exitcode))
+
+def _map_max_worker(process, inq, reducer_qs):
+    # nothing we handle has cycles, and collecting is expensive with this
+    # many live objects
+    gc.disable()
+    reducers = len(reducer_qs)
+    while True:
+        lines = inq.get()
+        if lines is None:
+            break
+
+        partitions = [[] for x in xrange(reducers)]
+        for key, item in process(lines):
+            partitions[hash(key) % reducers].append((key, item))
+
+        for queue, partition in zip(reducer_qs, partitions):
+            if partition:
+                # marshal is several times faster than the pickling
+                # that Queue would otherwise do
+                queue.put(marshal.dumps(partition))
+
+    for queue in reducer_qs:
+        queue.put(None)
+
+def _reduce_max_worker(inq, outq, num, mappers, post_size):
+    # a bounded min-heap of the largest items per key, so that adding an
+    # item that doesn't make the cut is a single comparison
+    gc.disable()
+    heaps = {}
+
+    while mappers:
+        pairs = inq.get()
+        if pairs is None:
+            mappers -= 1
+            continue
+
+        for key, item in marshal.loads(pairs):
+            heap = heaps.get(key)
+            if heap is None:
+                heaps[key] = [item]
+            elif len(heap) < num:
+                heappush(heap, item)
+            elif item > heap[0]:
+                heapreplace(heap, item)
+
+    for chunk in in_chunks(heaps.iteritems(), post_size):
+        outq.put([(key, sorted(items, reverse=True))
+                  for key, items in chunk])
+    outq.put(None)
+
+def mr_max_per_key_parallel(process, post, num = 10, fd = stdin,
+                            workers = multiprocessing.cpu_count(),
+                            chunk_size = 1000, post_size = 100):
+    """Find the largest `num` items for every key without sorting the input.
+
+    `process` is called in a fork()d mapper process with lists of up to
+    `chunk_size` lines from `fd` and yields (key, item) pairs, which must
+    be made of strs, numbers and tuples so that they can be marshalled.
+    The pairs are partitioned by key between reducer processes, each of which only
+    keeps the largest `num` items that it has seen for each of its keys.
+    When the input is exhausted, `post` is called in this process with
+    lists of up to `post_size` (key, items) pairs, the items sorted
+    largest first.
+
+    This replaces an external sort of the mapper's output followed by
+    mr_reduce_max_per_key, and only has to hold the final listings in
+    memory.
+
+    """
+    mappers = reducers = max(1, workers)
+
+    inq = multiprocessing.Queue(mappers * 2)
+    reducer_qs = [multiprocessing.Queue(mappers * 2)
+                  for x in xrange(reducers)]
+    outq = multiprocessing.Queue()
+
+    map_procs = [multiprocessing.Process(target=_map_max_worker,
+                                         name='mapper-%d' % i,
+                                         args=(process, inq, reducer_qs))
+                 for i in xrange(mappers)]
+    reduce_procs = [multiprocessing.Process(target=_reduce_max_worker,
+                                            name='reducer-%d' % i,
+                                            args=(queue, outq, num, mappers,
+                                                  post_size))
+                    for i, queue in enumerate(reducer_qs)]
+    procs = map_procs + reduce_procs
+
+    for proc in procs:
+        proc.daemon = True
+        proc.start()
+
+    try:
+        while True:
+            lines = list(islice(fd, chunk_size))
+            if not lines:
+                break
+            _put(inq, lines, procs)
+
+        for proc in map_procs:
+            _put(inq, None, procs)
+
+        remaining = reducers
+        while remaining:
+            try:
+                results = outq.get(timeout=1)
+            except Empty:
+                _check_procs(procs)
+                continue
+
+            if results is None:
+                remaining -= 1
+            else:
+                post(results)
+
+        for proc in procs:
+            proc.join()
+    finally:
+        for proc in procs:
+            if proc.is_alive():
+                proc.terminate()
+
 def test():
     from r2.lib.mr_tools._mr_tools import keyiter
 
@@ -52,32 +52,13 @@ time psql -F"\t" -A -t -d newreddit -U $USER -h $LINKDBHOST \
                   )
                   to 'reddit_data_link.dump'"
 cat reddit_data_link.dump reddit_thing_link.dump | sort -T. -S200m | paster --plugin=r2 run $INI r2/lib/mr_top.py -c "join_links()" > links.joined
-cat links.joined | paster --plugin=r2 run $INI r2/lib/mr_top.py -c "time_listings()" | sort -T. -S200m | paster --plugin=r2 run $INI r2/lib/mr_top.py -c "write_permacache()"
+cat links.joined | paster --plugin=r2 run $INI r2/lib/mr_top.py -c "top_listings()"
 """
-## """
-## psql -F"\t" -A -t -d newreddit -U ri -h $LINKDBHOST \
-##     -c "\\copy (select t.thing_id,
-##                        'link',
-##                        t.ups,
-##                        t.downs,
-##                        t.deleted,
-##                        t.spam,
-##                        extract(epoch from t.date),
-##                        d.value
-##                   from reddit_thing_link t,
-##                        reddit_data_link d
-##                  where t.thing_id = d.thing_id
-##                    and not t.spam and not t.deleted
-##                    and d.key = 'sr_id'
-##                    and t.date > now() - interval '1 year'
-##                ) to 'links.year.joined'"
-## cat links.year.joined | paster --plugin=r2 run production.ini r2/lib/mr_top.py -c "time_listings()" \
-##  | sort -T. -S200mW \
-##  | paster --plugin=r2 run production.ini r2/lib/mr_top.py -c "write_permacache()"
-## """
+# top_listings() keeps only the top of each listing in memory and spreads
+# the work over all of the CPUs rather than sorting everything on disk
 
 # that can be run with s/year/hour/g and
-# s/time_listings/time_listings(('hour',))/ for a much faster version
+# s/top_listings()/top_listings(('hour',))/ for a much faster version
 # that just does the hour listings. Usually these jobs dump the thing
 # and data tables separately and join them with mr_tools.join_things,
 # but some quick profiling shows that getting postgres to do the
@@ -90,10 +71,12 @@ cat links.joined | paster --plugin=r2 run $INI r2/lib/mr_top.py -c "time_listing
 # list. I'll call it a feature.
 
 import sys
+import multiprocessing
+from itertools import izip
 
-from r2.models import Account, Subreddit, Link
-from r2.lib.db.sorts import epoch_seconds, score, controversy
-from r2.lib.db import queries
+from r2.models import Subreddit, Link
+from r2.lib.db.sorts import epoch_seconds
+from r2.lib.db import batch_sorts, queries
 from r2.lib import mr_tools
 from r2.lib.utils import timeago, UrlParser
 from r2.lib.jsontemplates import make_fullname # what a strange place
@@ -103,65 +86,66 @@ def join_links():
     mr_tools.join_things(('url', 'sr_id'))
 
 
-def time_listings(times = ('year','month','week','day','hour')):
-    oldests = dict((t, epoch_seconds(timeago('1 %s' % t)))
-                   for t in times)
+@mr_tools.dataspec_m_thing(("url", str),('sr_id', int),)
+def _parse_link(link):
+    assert link.thing_type == 'link'
+    return link
 
-    @mr_tools.dataspec_m_thing(("url", str),('sr_id', int),)
-    def process(link):
-        assert link.thing_type == 'link'
+def _listing_items(links, oldests):
+    """Yield (listing key, (sort value, timestamp, fullname)) for each of
+       the time-filtered listings that a chunk of links belongs in"""
+    # compute the sorts for a whole chunk of links at once
+    links = [link for link in links if not link.spam and not link.deleted]
+    ups = [link.ups for link in links]
+    downs = [link.downs for link in links]
+    scores = batch_sorts.scores(ups, downs)
+    controversies = batch_sorts.controversies(ups, downs)
 
+    for link, sc, contr in izip(links, scores, controversies):
         timestamp = link.timestamp
         fname = make_fullname(Link, link.thing_id)
-
-        if not link.spam and not link.deleted:
-            sr_id = link.sr_id
-            if link.url:
-                domains = UrlParser(link.url).domain_permutations()
-            else:
-                domains = []
-            ups, downs = link.ups, link.downs
-
-            for tkey, oldest in oldests.iteritems():
-                if timestamp > oldest:
-                    sc = score(ups, downs)
-                    contr = controversy(ups, downs)
-                    yield ('sr-top-%s-%d' % (tkey, sr_id),
-                           sc, timestamp, fname)
-                    yield ('sr-controversial-%s-%d' % (tkey, sr_id),
-                           contr, timestamp, fname)
-                    for domain in domains:
-                        yield ('domain/top/%s/%s' % (tkey, domain),
-                               sc, timestamp, fname)
-                        yield ('domain/controversial/%s/%s' % (tkey, domain),
-                               contr, timestamp, fname)
-
-    mr_tools.mr_map(process)
-
-def store_keys(key, maxes):
-    # we're building queries using queries.py, but we could make the
-    # queries ourselves if we wanted to avoid the individual lookups
-    # for accounts and subreddits.
-
-    # Note that we're only generating the 'sr-' type queries here, but
-    # we're also able to process the other listings generated by the
-    # old migrate.mr_permacache for convenience
-
-    userrel_fns = dict(liked = queries.get_liked,
-                       disliked = queries.get_disliked,
-                       saved = queries.get_saved,
-                       hidden = queries.get_hidden)
-
-    if key.startswith('user-'):
-        acc_str, keytype, account_id = key.split('-')
-        account_id = int(account_id)
-        fn = queries._get_submitted if keytype == 'submitted' else queries._get_comments
-        q = fn(account_id, 'new', 'all')
-        q._replace([(fname, float(timestamp))
-                    for (timestamp, fname)
-                    in maxes])
-
-    elif key.startswith('sr-'):
+        sr_id = link.sr_id
+        if link.url:
+            domains = UrlParser(link.url).domain_permutations()
+        else:
+            domains = []
+
+        for tkey, oldest in oldests.iteritems():
+            if timestamp > oldest:
+                yield ('sr-top-%s-%d' % (tkey, sr_id),
+                       (sc, timestamp, fname))
+                yield ('sr-controversial-%s-%d' % (tkey, sr_id),
+                       (contr, timestamp, fname))
+                for domain in domains:
+                    yield ('domain/top/%s/%s' % (tkey, domain),
+                           (sc, timestamp, fname))
+                    yield ('domain/controversial/%s/%s' % (tkey, domain),
+                           (contr, timestamp, fname))
+
+def _oldests(times):
+    return dict((t, epoch_seconds(timeago('1 %s' % t)))
+                for t in times)
+
+def top_listings(times = ('year','month','week','day','hour'),
+                 fd = sys.stdin, workers = multiprocessing.cpu_count(),
+                 chunk_size = 10000, batch_size = 50):
+    """Build the time-filtered listings from joined links on fd and write
+       them to the permacache, without sorting the intermediate listings
+       (see mr_tools.mr_max_per_key_parallel)"""
+    oldests = _oldests(times)
+
+    def process(lines):
+        links = [_parse_link(line.strip('\n').split('\t'))
+                 for line in lines]
+        return _listing_items(links, oldests)
+
+    mr_tools.mr_max_per_key_parallel(process, write_listings,
+                                     num=queries.precompute_limit, fd=fd,
+                                     workers=workers, chunk_size=chunk_size,
+                                     post_size=batch_size)
+
+def _time_listing_query(key):
+    if key.startswith('sr-'):
         sr_str, sort, time, sr_id = key.split('-')
         sr_id = int(sr_id)
 
@@ -170,25 +154,17 @@ def store_keys(key, maxes):
             # it
             sort = 'controversial'
 
-        q = queries._get_links(sr_id, sort, time)
-        q._replace([tuple([item[-1]] + map(float, item[:-1]))
-                    for item in maxes])
+        return queries._get_links(sr_id, sort, time)
     elif key.startswith('domain/'):
         d_str, sort, time, domain = key.split('/')
-        q = queries.get_domain_links(domain, sort, time)
-        q._replace([tuple([item[-1]] + map(float, item[:-1]))
-                    for item in maxes])
-
-
-    elif key.split('-')[0] in userrel_fns:
-        key_type, account_id = key.split('-')
-        account_id = int(account_id)
-        fn = userrel_fns[key_type]
-        q = fn(Account._byID(account_id))
-        q._replace([tuple([item[-1]] + map(float, item[:-1]))
-                    for item in maxes])
-
-def write_permacache(fd = sys.stdin):
-    mr_tools.mr_reduce_max_per_key(lambda x: map(float, x[:-1]), num=1000,
-                                   post=store_keys,
-                                   fd = fd)
+        return queries.get_domain_links(domain, sort, time)
+
+def write_listings(listings):
+    """Replace the contents of many time-filtered listings in a single
+       batch, given (key, [(sort value, timestamp, fullname), ...])
+       pairs as generated by top_listings"""
+    queries.CachedResults._replace_multi(
+        [(_time_listing_query(key),
+          [(fname, float(value), float(timestamp))
+           for (value, timestamp, fname) in items])
+         for key, items in listings])
@@ -0,0 +1,168 @@
+# The contents of this file are subject to the Common Public Attribution
+# License Version 1.0. (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://code.reddit.com/LICENSE. The License is based on the Mozilla Public
+# License Version 1.1, but Sections 14 and 15 have been added to cover use of
+# software over a computer network and provide for limited attribution for the
+# Original Developer. In addition, Exhibit A has been modified to be consistent
+# with Exhibit B.
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License for
+# the specific language governing rights and limitations under the License.
+#
+# The Original Code is reddit.
+#
+# The Original Developer is the Initial Developer.  The Initial Developer of
+# the Original Code is reddit Inc.
+#
+# All portions of the code written by reddit are Copyright (c) 2006-2012 reddit
+# Inc. All Rights Reserved.
+###############################################################################
+"""Storage for fully rendered pages served to logged out users.
+
+A page is stored in g.pagecache as two entries: a small CachedPage with
+the response's status, headers, cookies and ETag, keyed by the request,
+and the body, gzipped when it's of a compressible type, keyed by its hash
+and encoding. So
+
+  * conditional requests (If-None-Match) are answered from the CachedPage
+    alone, without fetching the body,
+  * clients that accept gzip are sent the stored body as is, and
+  * requests that render identical pages (e.g. only differing in a cookie
+    that didn't change the page) share a single copy of the body.
+
+Per controller action stats are reported under the
+pagecache.<controller>.<action> counters: hit, not_modified, miss (the
+page was rendered and stored), body_miss (the body was evicted before its
+CachedPage), and raw_bytes and stored_bytes for the size of the stored
+bodies before and after compression.
+
+"""
+
+import hashlib
+import zlib
+
+from paste.util.mimeparse import parse_mime_type
+from pylons import g
+
+from r2.lib.gzipper import ENCODABLE_CONTENT_TYPES, GzipMiddleware
+
+
+BODY_PREFIX = 'pagecache_body.'
+
+
+request_accepts_gzip = GzipMiddleware.request_accepts_gzip
+
+
+def count(routes_dict, name, delta=1):
+    counter = g.stats.get_counter('pagecache.%s.%s' %
+                                  (routes_dict.get('controller'),
+                                   routes_dict.get('action')))
+    if counter:
+        counter.increment(name, delta=delta)
+
+
+def gzip_compress(data, compress_level):
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED,
+                                  16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def gzip_decompress(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+def _is_compressible(headerlist):
+    for name, value in headerlist:
+        if name.lower() == 'content-type':
+            type, subtype, params = parse_mime_type(value)
+            return "%s/%s" % (type, subtype) in ENCODABLE_CONTENT_TYPES
+    return False
+
+
+def _add_vary(headerlist, field):
+    varies = []
+    others = []
+    for name, value in headerlist:
+        if name.lower() == 'vary':
+            varies.extend(v.strip().lower() for v in value.split(','))
+        else:
+            others.append((name, value))
+
+    if '*' in varies:
+        varies = ['*']
+    elif field not in varies:
+        varies.append(field)
+
+    others.append(('Vary', ', '.join(varies)))
+    return others
+
+
+class CachedPage(object):
+    """Everything about a cached response but its body."""
+
+    def __init__(self, status_int, headerlist, cookies, etag, gzipped):
+        self.status_int = status_int
+        self.headerlist = headerlist
+        self.cookies = cookies
+        self.etag = etag
+        self.gzipped = gzipped
+
+    @property
+    def body_key(self):
+        # the same body can be stored both raw and gzipped (e.g. served as
+        # text/html and as image/png), so the encoding is part of the key
+        encoding = 'gzip' if self.gzipped else 'identity'
+        return '%s%s.%s' % (BODY_PREFIX, encoding, self.etag.strip('"'))
+
+    def not_modified(self, if_none_match):
+        """Whether an If-None-Match header matches this page."""
+        if not if_none_match:
+            return False
+        etags = [etag.strip() for etag in if_none_match.split(',')]
+        return '*' in etags or self.etag in etags
+
+    def read_body(self, accept_gzip):
+        """Fetch the body, or None if it has been evicted."""
+        body = g.pagecache.get(self.body_key)
+        if body is not None and self.gzipped and not accept_gzip:
+            body = gzip_decompress(body)
+        return body
+
+    def write_response(self, response, body, gzipped):
+        """Send the page as response with the given (already encoded) body."""
+        response.headerlist = list(self.headerlist)
+        if gzipped:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.body = body
+        response.status_int = self.status_int
+
+
+def get(key):
+    page = g.pagecache.get(key)
+    if isinstance(page, CachedPage):
+        return page
+    return None
+
+
+def make_page(response, cookies, compress_level=6):
+    """Build a CachedPage from a response, and the body to store."""
+    body = response.body
+    etag = '"%s"' % hashlib.md5(body).hexdigest()
+
+    headerlist = [(name, value) for name, value in response.headerlist
+                  if name.lower() not in ('content-length', 'etag')]
+    headerlist.append(('ETag', etag))
+
+    gzipped = _is_compressible(headerlist)
+    if gzipped:
+        headerlist = _add_vary(headerlist, 'accept-encoding')
+        body = gzip_compress(body, compress_level)
+
+    return CachedPage(response.status_int, headerlist, cookies, etag,
+                      gzipped), body
+
+
+def store(key, page, body, time):
+    g.pagecache.set_multi({key: page, page.body_key: body}, time=time)
@@ -0,0 +1,175 @@
+# The contents of this file are subject to the Common Public Attribution
+# License Version 1.0. (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://code.reddit.com/LICENSE. The License is based on the Mozilla Public
+# License Version 1.1, but Sections 14 and 15 have been added to cover use of
+# software over a computer network and provide for limited attribution for the
+# Original Developer. In addition, Exhibit A has been modified to be consistent
+# with Exhibit B.
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License for
+# the specific language governing rights and limitations under the License.
+#
+# The Original Code is reddit.
+#
+# The Original Developer is the Initial Developer.  The Initial Developer of
+# the Original Code is reddit Inc.
+#
+# All portions of the code written by reddit are Copyright (c) 2006-2012 reddit
+# Inc. All Rights Reserved.
+###############################################################################
+"""Publish amqp messages from a background thread, in batches.
+
+amqp.add_item used to put every message on an unbounded queue, drained by a
+thread that published them one at a time, so when the broker was slow the
+queue (and the app server's memory) grew without limit and nothing said so.
+A BatchPublisher keeps messages on a bounded queue instead, and publishes
+whatever has piled up (up to batch_size messages) in one channel
+transaction.  The commit is the broker's confirmation that it has the whole
+batch; a batch that fails is retried on a new channel, and since
+uncommitted messages are never delivered nothing is published twice.
+
+When the queue is full, messages are dropped or add() waits for room,
+depending on the block policy.  Queue depth, publish latency and drops are
+reported through r2.lib.stats.
+
+"""
+
+import Queue
+import threading
+import time
+import traceback
+
+
+class BatchPublisher(object):
+    """A bounded queue of messages published from a background thread.
+
+    get_channel(reconnect) returns the channel to publish on (a new one if
+    reconnect is True) and make_message(body, message_id, delivery_mode)
+    makes a message to publish.  If block is False, messages added while the
+    queue is full are dropped, otherwise add() waits up to block_timeout
+    seconds (forever if None) for room first.
+
+    """
+
+    def __init__(self, get_channel, make_message, exchange, max_size=10000,
+                 batch_size=100, block=False, block_timeout=None,
+                 max_attempts=3, stats=None, stats_name='amqp_publisher'):
+        self.get_channel = get_channel
+        self.make_message = make_message
+        self.exchange = exchange
+        self.batch_size = batch_size
+        self.block = block
+        self.block_timeout = block_timeout
+        self.max_attempts = max_attempts
+        self.stats = stats
+        self.stats_name = stats_name
+        self.queue = Queue.Queue(max_size)
+        # the channel transactions were selected on
+        self.tx_channel = None
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def add(self, routing_key, body, message_id=None, delivery_mode=None):
+        """Queue a message, returning False if it was dropped."""
+        item = (routing_key, body, message_id, delivery_mode, time.time())
+        try:
+            self.queue.put(item, self.block, self.block_timeout)
+        except Queue.Full:
+            self._count('dropped')
+            return False
+        return True
+
+    def join(self):
+        """Wait until every message added has been published (or dropped)."""
+        self.queue.join()
+
+    def _run(self):
+        while True:
+            try:
+                self.publish_pending()
+            except:
+                print traceback.format_exc()
+
+    def publish_pending(self, block=True):
+        """Publish the next batch of messages, returning how many were sent.
+
+        If block is True, this waits for a message to be added first.
+
+        """
+        try:
+            items = [self.queue.get(block)]
+        except Queue.Empty:
+            return 0
+        while len(items) < self.batch_size:
+            try:
+                items.append(self.queue.get_nowait())
+            except Queue.Empty:
+                break
+
+        try:
+            published = self.publish(items)
+        finally:
+            for item in items:
+                self.queue.task_done()
+            self._gauge('queue_depth', self.queue.qsize())
+        return len(items) if published else 0
+
+    def publish(self, items):
+        """Publish items in one transaction, retrying on a new channel.
+
+        Returns False if every attempt failed and the items were dropped.
+
+        """
+        for attempt in xrange(self.max_attempts):
+            start = time.time()
+            try:
+                channel = self.get_channel(attempt > 0)
+                if channel is not self.tx_channel:
+                    channel.tx_select()
+                    self.tx_channel = channel
+                for routing_key, body, message_id, delivery_mode, added in items:
+                    message = self.make_message(body, message_id,
+                                                delivery_mode)
+                    channel.basic_publish(message,
+                                          exchange=self.exchange,
+                                          routing_key=routing_key)
+                channel.tx_commit()
+            except Exception:
+                self.tx_channel = None
+                self._count('publish_failed')
+                self._event_count(items, 'enqueue_failed')
+                print traceback.format_exc()
+            else:
+                end = time.time()
+                self._count('published', len(items))
+                self._event_count(items, 'enqueue')
+                if self.stats:
+                    timer = self.stats.get_timer(self.stats_name)
+                    timer.send('publish', start, end)
+                    for item in items:
+                        # how long each message waited to go out
+                        timer.send('latency', item[-1], end)
+                return True
+
+        self._count('dropped', len(items))
+        return False
+
+    def _count(self, name, delta=1):
+        if self.stats:
+            counter = self.stats.get_counter(self.stats_name)
+            counter.increment(name, delta=delta)
+
+    def _event_count(self, items, name):
+        if self.stats:
+            for item in items:
+                self.stats.event_count('amqp.%s' % item[0], name)
+
+    def _gauge(self, name, value):
+        if self.stats:
+            self.stats.get_gauge(self.stats_name).set(value, name)
@@ -0,0 +1,331 @@
+# The contents of this file are subject to the Common Public Attribution
+# License Version 1.0. (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://code.reddit.com/LICENSE. The License is based on the Mozilla Public
+# License Version 1.1, but Sections 14 and 15 have been added to cover use of
+# software over a computer network and provide for limited attribution for the
+# Original Developer. In addition, Exhibit A has been modified to be consistent
+# with Exhibit B.
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License for
+# the specific language governing rights and limitations under the License.
+#
+# The Original Code is reddit.
+#
+# The Original Developer is the Initial Developer.  The Initial Developer of
+# the Original Code is reddit Inc.
+#
+# All portions of the code written by reddit are Copyright (c) 2006-2012 reddit
+# Inc. All Rights Reserved.
+###############################################################################
+"""Rate limiting.
+
+RateLimiter counts requests against any number of limits with a sliding
+window, in a few batched calls to a shared backend (memcache, through
+CacheBackend) however many limits are checked at once.  LocalBackend keeps
+the counters in the process instead, for tests and single process setups.
+
+AgentMatcher finds the configured user agent substrings (g.agents) in a
+user agent with a single regular expression scan instead of a substring
+search per entry, and LocalRateLimiter keeps per-process token buckets
+that can refuse requests before the shared counters are consulted.
+
+"""
+
+import collections
+import re
+import threading
+import time as time_module
+
+
+def _trie_regex(trie):
+    """Build a regex matching the longest string in a trie at a position.
+
+    The trie is a dict mapping characters to subtries, with the empty
+    string as the key marking the end of a string.
+
+    """
+    branches = [re.escape(char) + _trie_regex(subtrie)
+                for char, subtrie in sorted(trie.iteritems()) if char]
+    if not branches:
+        return ''
+
+    if len(branches) == 1:
+        regex = branches[0]
+    else:
+        regex = '(?:%s)' % '|'.join(branches)
+
+    if '' in trie:
+        # a string ends here, but prefer longer ones
+        if len(branches) == 1:
+            regex = '(?:%s)' % regex
+        regex += '?'
+    return regex
+
+
+class AgentMatcher(object):
+    """Find which of a list of substrings occur in a user agent.
+
+    The substrings are compiled into one trie-shaped regex that, through a
+    lookahead, finds the longest substring starting at each position of
+    the user agent, so overlapping occurrences are all seen.  Any other
+    substrings starting at the same position are prefixes of that one and
+    are looked up in a set.
+
+    """
+
+    def __init__(self, agents):
+        self.agents = agents
+        self.order = {}
+        for i, agent in enumerate(agents):
+            if agent:
+                self.order.setdefault(agent, i)
+        self.lengths = sorted(set(len(agent) for agent in self.order))
+
+        trie = {}
+        for agent in self.order:
+            node = trie
+            for char in agent:
+                node = node.setdefault(char, {})
+            node[''] = {}
+
+        if trie:
+            self.regex = re.compile('(?=(%s))' % _trie_regex(trie))
+        else:
+            self.regex = None
+
+    def match(self, user_agent):
+        """Return the agents that are substrings of user_agent.
+
+        The agents are returned in the order they were configured, each
+        only once.
+
+        """
+        if self.regex is None:
+            return []
+
+        found = set()
+        for m in self.regex.finditer(user_agent):
+            longest = m.group(1)
+            for length in self.lengths:
+                if length > len(longest):
+                    break
+                prefix = longest[:length]
+                if prefix in self.order:
+                    found.add(prefix)
+
+        return sorted(found, key=self.order.__getitem__)
+
+
+_agent_matcher = None
+
+def get_agent_matcher(agents):
+    """Return an AgentMatcher for agents, rebuilding it if they've changed."""
+    global _agent_matcher
+    matcher = _agent_matcher
+    if matcher is None or matcher.agents is not agents:
+        matcher = _agent_matcher = AgentMatcher(agents)
+    return matcher
+
+
+class TokenBucket(object):
+    """A bucket of up to capacity tokens refilled at rate tokens a second."""
+
+    def __init__(self, rate, capacity, now=None):
+        self.rate = float(rate)
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time_module.time() if now is None else now
+
+    def consume(self, now=None):
+        """Take a token, returning False if the bucket is empty."""
+        if now is None:
+            now = time_module.time()
+        elapsed = max(now - self.updated, 0)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class LocalRateLimiter(object):
+    """Token buckets per key, kept in this process.
+
+    To bound memory, all the buckets are dropped once there are more than
+    max_keys of them.
+
+    """
+
+    def __init__(self, rate, capacity, max_keys=10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def allow(self, key, now=None):
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.max_keys:
+                    self.buckets.clear()
+                bucket = TokenBucket(self.rate, self.capacity, now)
+                self.buckets[key] = bucket
+            return bucket.consume(now)
+
+
+class CacheBackend(object):
+    """Keep rate limit counters in one of our caches (e.g. memcache)."""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def get_multi(self, keys):
+        return self.cache.get_multi(keys)
+
+    def add_multi(self, values, time):
+        self.cache.add_multi(values, time=time)
+
+    def incr_multi(self, keys):
+        from r2.lib.cache import MemcachedError
+
+        try:
+            self.cache.incr_multi(keys, delta=1)
+        except MemcachedError:
+            # a counter expired since it was read, losing a count is fine
+            pass
+
+
+class LocalBackend(object):
+    """Keep rate limit counters in this process."""
+
+    def __init__(self):
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def _get(self, key, now):
+        value, expires = self.counters.get(key, (None, None))
+        if expires is not None and expires <= now:
+            del self.counters[key]
+            return None
+        return value
+
+    def get_multi(self, keys):
+        now = time_module.time()
+        with self.lock:
+            values = [(key, self._get(key, now)) for key in keys]
+        return dict((key, value) for key, value in values
+                    if value is not None)
+
+    def add_multi(self, values, time):
+        now = time_module.time()
+        with self.lock:
+            for key, value in values.iteritems():
+                if self._get(key, now) is None:
+                    self.counters[key] = (value, now + time)
+
+    def incr_multi(self, keys):
+        now = time_module.time()
+        with self.lock:
+            for key in keys:
+                if self._get(key, now) is not None:
+                    value, expires = self.counters[key]
+                    self.counters[key] = (value + 1, expires)
+
+
+Limit = collections.namedtuple('Limit', 'key limit period')
+
+
+class Usage(object):
+    """How much of a Limit has been used, including the current request."""
+
+    def __init__(self, key, used, limit, reset):
+        self.key = key
+        self.used = used
+        self.limit = limit
+        # seconds until the current window ends
+        self.reset = reset
+
+    @property
+    def remaining(self):
+        return max(self.limit - self.used, 0)
+
+    @property
+    def exceeded(self):
+        return self.used > self.limit
+
+    def headers(self):
+        return {'X-Ratelimit-Used': str(self.used),
+                'X-Ratelimit-Remaining': str(self.remaining),
+                'X-Ratelimit-Reset': str(self.reset)}
+
+
+class RateLimiter(object):
+    """Count requests against limits of so many requests per period.
+
+    Each limit is counted in fixed windows of its period, and the number
+    of requests in the sliding period ending now is estimated as the
+    count in the current window plus the previous window's count weighted
+    by how much of the previous window the period still overlaps.
+
+    """
+
+    def __init__(self, backend, prefix='ratelimit-'):
+        self.backend = backend
+        self.prefix = prefix
+
+    def _window_key(self, limit, window):
+        return '%s%s-%d-%d' % (self.prefix, limit.key, limit.period, window)
+
+    def record(self, limits, now=None):
+        """Count a request against each Limit and return their Usages.
+
+        The requests are counted whether or not they're over the limit.
+        All the limits are read with one get_multi and updated with one
+        incr_multi, after an add_multi of 0 for windows that have just
+        started.  Adding 0 rather than 1 means that concurrent requests
+        that all see a new window each still get counted by the incr.
+        The keys of the limits must be distinct.
+
+        """
+        if now is None:
+            now = time_module.time()
+
+        windows = []
+        for limit in limits:
+            window, offset = divmod(int(now), limit.period)
+            windows.append((self._window_key(limit, window),
+                            self._window_key(limit, window - 1),
+                            offset))
+
+        counts = self.backend.get_multi([key
+                                         for current, previous, _ in windows
+                                         for key in (current, previous)])
+
+        to_add = {}
+        to_incr = []
+        usages = []
+        for limit, (current, previous, offset) in zip(limits, windows):
+            if current not in counts:
+                to_add[current] = 0
+            to_incr.append(current)
+
+            overlap = float(limit.period - offset) / limit.period
+            used = int(counts.get(previous, 0) * overlap +
+                       counts.get(current, 0)) + 1
+            usages.append(Usage(limit.key, used, limit.limit,
+                                reset=limit.period - offset))
+
+        if to_add:
+            # a window's counter has to outlive it so that it can be read
+            # as the previous window
+            ttl = 2 * max(limit.period for limit in limits)
+            self.backend.add_multi(to_add, time=ttl)
+        if to_incr:
+            self.backend.incr_multi(to_incr)
+
+        return usages
@@ -20,6 +20,10 @@
 # Inc. All Rights Reserved.
 ###############################################################################
 
+from pylons import g
+
+from r2.lib.singleflight import flights
+
 # smart get multi:
 # For any keys not found in the cache, miss_fn() is run and the result is
 # stored in the cache. Then it returns everything, both the hits and misses.
@@ -63,8 +67,17 @@ def sgm(cache, keys, miss_fn, str prefix='', int time=0, stale=False, found_fn=N
         # if we didn't get all of the keys from the cache, go to the
         # miss_fn with the keys they asked for minus the ones that we
         # found
-        calculated = miss_fn(still_need)
+        # concurrent misses on the same keys in this process wait for a
+        # single call to miss_fn
+        calculated, shared = flights.do_multi(still_need, miss_fn,
+                                              namespace=(id(cache), prefix))
         ret.update(calculated)
+        ret.update(shared)
+
+        if shared and g.stats:
+            counter = g.stats.get_counter('singleflight.sgm')
+            if counter:
+                counter.increment('collapsed', delta=len(shared))
 
         calculated_to_cache = {}
         for k, v in calculated.iteritems():
@@ -0,0 +1,285 @@
+# The contents of this file are subject to the Common Public Attribution
+# License Version 1.0. (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://code.reddit.com/LICENSE. The License is based on the Mozilla Public
+# License Version 1.1, but Sections 14 and 15 have been added to cover use of
+# software over a computer network and provide for limited attribution for the
+# Original Developer. In addition, Exhibit A has been modified to be consistent
+# with Exhibit B.
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License for
+# the specific language governing rights and limitations under the License.
+#
+# The Original Code is reddit.
+#
+# The Original Developer is the Initial Developer.  The Initial Developer of
+# the Original Code is reddit Inc.
+#
+# All portions of the code written by reddit are Copyright (c) 2006-2012 reddit
+# Inc. All Rights Reserved.
+###############################################################################
+"""Collapse concurrent recomputations of the same cached value.
+
+When a popular cache key expires, every request that misses it would
+otherwise recompute it at the same time.  This module makes sure that
+
+  * within a process, concurrent misses for the same key wait on a single
+    computation (SingleFlight), and
+  * across processes, only the holder of a short-lived lease recomputes a
+    value, the others waiting a moment for it before giving up and
+    computing it too.  Optionally, values are stored with a soft
+    expiration time (SoftExpiring) and kept in the cache for a while
+    longer, so that while one process refreshes an expired value the
+    others keep serving the stale copy instead of waiting
+    (stale-while-revalidate).
+
+"""
+
+import os
+import socket
+import sys
+import threading
+import time as time_module
+
+
+_MISSING = object()
+
+
+class _Call(object):
+    """A computation in progress that other threads can wait on."""
+
+    def __init__(self):
+        self.owner = threading.current_thread()
+        self.event = threading.Event()
+        self.value = _MISSING
+        self.exc_info = None
+
+    def wait(self, timeout):
+        """Wait for the result, returning _MISSING on timeout."""
+        self.event.wait(timeout)
+        if not self.event.is_set():
+            return _MISSING
+        if self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.value
+
+
+class SingleFlight(object):
+    """Collapse concurrent calls for the same key within a process.
+
+    Calls made by the thread already computing a key (i.e. recursively) are
+    never collapsed.  Waiters give up after `timeout` seconds and compute
+    the value themselves.
+
+    """
+
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def _join(self, keys):
+        """Split keys into calls we lead and calls led by other threads."""
+        me = threading.current_thread()
+        mine, theirs = {}, {}
+        with self.lock:
+            for key in keys:
+                call = self.calls.get(key)
+                if call is not None and call.owner is not me:
+                    theirs[key] = call
+                else:
+                    mine[key] = self.calls[key] = _Call()
+        return mine, theirs
+
+    def _finish(self, calls, values=None, exc_info=None):
+        with self.lock:
+            for key, call in calls.iteritems():
+                if self.calls.get(key) is call:
+                    del self.calls[key]
+        for key, call in calls.iteritems():
+            if values is not None:
+                call.value = values.get(key, _MISSING)
+            call.exc_info = exc_info
+            call.event.set()
+
+    def do(self, key, fn):
+        """Return (fn(), shared) where shared is True if another thread's
+        computation of key was used instead of calling fn."""
+        mine, theirs = self._join([key])
+        if theirs:
+            value = theirs[key].wait(self.timeout)
+            if value is not _MISSING:
+                return value, True
+            return fn(), False
+
+        try:
+            value = fn()
+        except:
+            self._finish(mine, exc_info=sys.exc_info())
+            raise
+        self._finish(mine, {key: value})
+        return value, False
+
+    def do_multi(self, keys, fn, namespace=None):
+        """Compute many keys at once, sharing in-flight computations.
+
+        fn takes a set of keys and returns a dict of the values it could
+        compute.  Returns (computed, shared): the values computed here, and
+        the values computed by other threads that were waited on.
+
+        """
+        flight_keys = dict(((namespace, key), key) for key in keys)
+        mine, theirs = self._join(flight_keys)
+
+        computed = {}
+        if mine:
+            try:
+                computed = fn(set(flight_keys[k] for k in mine))
+            except:
+                self._finish(mine, exc_info=sys.exc_info())
+                raise
+            self._finish(mine, dict(((namespace, key), value)
+                                    for key, value in computed.iteritems()))
+
+        shared = {}
+        for flight_key, call in theirs.iteritems():
+            value = call.wait(self.timeout)
+            if value is not _MISSING:
+                shared[flight_keys[flight_key]] = value
+
+        missed = set(flight_keys[k] for k in theirs) - set(shared)
+        if missed:
+            # the other computation timed out or didn't produce these keys
+            computed.update(fn(missed))
+
+        return computed, shared
+
+
+flights = SingleFlight()
+
+
+class SoftExpiring(object):
+    """A cached value that should be recomputed after `expires`.
+
+    The value is stored in the cache for longer than its soft lifetime so a
+    stale copy can be served while one process recomputes it.
+
+    """
+
+    def __init__(self, value, expires):
+        self.value = value
+        self.expires = expires
+
+    def expired(self):
+        return time_module.time() >= self.expires
+
+
+def _count(stats, name, outcome):
+    if stats:
+        counter = stats.get_counter('singleflight.%s' % name)
+        if counter:
+            counter.increment(outcome)
+
+
+def _lease_token():
+    return "%s:%s:%s" % (socket.gethostname(), os.getpid(),
+                         threading.current_thread().ident)
+
+
+def _unwrap(cached):
+    if isinstance(cached, SoftExpiring):
+        return cached.value
+    return cached
+
+
+def get_or_compute(cache, key, compute, time=0, stale=False, update=False,
+                   lease_cache=None, lease_time=30, soft_expire=False,
+                   wait=0.05, stats=None, stats_name="default"):
+    """Return the cached value for key, computing it if necessary.
+
+    compute must not return None.  Only the process holding the lease (an
+    `add` on lease_cache) computes a missing value.  The others wait
+    `wait` seconds once for it to show up and then compute it themselves,
+    so a slow or dead lease holder never holds them up for long.  Without
+    a lease_cache only in-process coalescing is done.
+
+    With soft_expire, values cached with a non-zero time are stored as
+    SoftExpiring and kept for twice as long as requested; after `time`
+    seconds the lease holder recomputes the value while the others keep
+    returning the stale one.  Both formats are read either way, so it can
+    be turned on once every process understands SoftExpiring values.
+
+    Stats about how each call was satisfied are reported under the
+    singleflight.<stats_name> counter: leader, collapsed (waited for
+    another thread in this process), waited (waited for another process),
+    unleased (gave up waiting and computed it without the lease) and stale
+    (served a stale value while another process refreshes it).
+
+    """
+
+    lease_key = 'singleflight_lease(%s)' % key
+    stale_value = _MISSING
+
+    if not update:
+        cached = cache.get(key, stale=stale)
+        if cached is not None:
+            if not isinstance(cached, SoftExpiring):
+                return cached
+            if not cached.expired():
+                return cached.value
+            stale_value = cached.value
+
+    def store(value):
+        if time and soft_expire:
+            cache.set(key,
+                      SoftExpiring(value, time_module.time() + time),
+                      time=time * 2)
+        else:
+            cache.set(key, value, time=time)
+
+    def fill():
+        if lease_cache is None:
+            value = compute()
+            store(value)
+            _count(stats, stats_name, 'leader')
+            return value
+
+        if lease_cache.add(lease_key, _lease_token(), time=lease_time):
+            try:
+                # see if it was completed while we were waiting
+                if not update and stale_value is _MISSING:
+                    stored = cache.get(key)
+                    if stored is not None:
+                        return _unwrap(stored)
+
+                value = compute()
+                store(value)
+                _count(stats, stats_name, 'leader')
+                return value
+            finally:
+                lease_cache.delete(lease_key)
+
+        if stale_value is not _MISSING:
+            # someone else is refreshing it, serve the stale copy
+            _count(stats, stats_name, 'stale')
+            return stale_value
+
+        # a cold miss that another process is computing: give it a moment
+        # to store the value, but rather than queue up behind it compute
+        # the value ourselves if it's not there by then
+        time_module.sleep(wait)
+        stored = cache.get(key, allow_local=False)
+        if stored is not None:
+            _count(stats, stats_name, 'waited')
+            return _unwrap(stored)
+
+        value = compute()
+        store(value)
+        _count(stats, stats_name, 'unleased')
+        return value
+
+    value, shared = flights.do(('get_or_compute', id(cache), key), fill)
+    if shared:
+        _count(stats, stats_name, 'collapsed')
+    return value
@@ -49,8 +49,8 @@ def cache_lists():
     # nsfwstate =:= no_over18 | allow_over18 | only_over18
     bylang = {}
 
-    for sr in fetch_things2(Subreddit._query(sort=desc('_date'),
-                                             data=True)):
+    q = Subreddit._query(sort=desc('_date'), data=True, bulk=True)
+    for sr in fetch_things2(q, prefetch_chunks=True):
         aid = getattr(sr, 'author_id', None)
         if aid is not None and aid < 0:
             # skip special system reddits like promos
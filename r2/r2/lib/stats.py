@@ -98,6 +98,22 @@ class CountingStatBuffer:
             yield k, str(v) + '|c'
 
 
+class GaugeStatBuffer:
+    """Dictionary of keys to the last value recorded for them."""
+
+    def __init__(self):
+        self.data = {}
+
+    def record(self, key, value):
+        self.data[key] = value
+
+    def flush(self):
+        """Yields the latest gauge values and resets the buffer."""
+        data, self.data = self.data, {}
+        for k, v in data.iteritems():
+            yield k, str(v) + '|g'
+
+
 class StatsdConnection:
     def __init__(self, addr, compress=True):
         if addr:
@@ -149,6 +165,7 @@ class StatsdClient:
         self.sample_rate = sample_rate
         self.timing_stats = TimingStatBuffer()
         self.counting_stats = CountingStatBuffer()
+        self.gauge_stats = GaugeStatBuffer()
         self.connect(addr)
 
     def connect(self, addr):
@@ -160,6 +177,7 @@ class StatsdClient:
     def flush(self):
         data = list(self.timing_stats.flush())
         data.extend(self.counting_stats.flush())
+        data.extend(self.gauge_stats.flush())
         self.conn.send(self._data_iterator(data))
 
 
@@ -195,6 +213,16 @@ class Counter:
         return self
 
 
+class Gauge:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def set(self, value, subname=None):
+        name = _get_stat_name(self.name, subname)
+        self.client.gauge_stats.record(name, value)
+
+
 class Timer:
     _time = time.time
 
@@ -263,6 +291,9 @@ class Stats:
     def get_counter(self, name):
         return Counter(self.client, name)
 
+    def get_gauge(self, name):
+        return Gauge(self.client, name)
+
     def action_count(self, counter_name, name, delta=1):
         counter = self.get_counter(counter_name)
         if counter:
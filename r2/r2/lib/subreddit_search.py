@@ -39,8 +39,9 @@ def load_all_reddits():
     q = Subreddit._query(Subreddit.c.type == 'public',
                          Subreddit.c._downs > 1,
                          sort = (desc('_downs'), desc('_ups')),
-                         data = True)
-    for sr in utils.fetch_things2(q):
+                         data = True,
+                         bulk = True)
+    for sr in utils.fetch_things2(q, prefetch_chunks = True):
         name = sr.name.lower()
         for i in xrange(len(name)):
             prefix = name[:i + 1]
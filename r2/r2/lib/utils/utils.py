@@ -30,14 +30,18 @@ from urllib import unquote_plus
 from urllib2 import urlopen, Request
 from urlparse import urlparse, urlunparse
 import signal
+import socket
+import struct
 from copy import deepcopy
 import cPickle as pickle
 import re, math, random
+import bisect
 import boto
 from decimal import Decimal
 
 from BeautifulSoup import BeautifulSoup, SoupStrainer
 
+import time
 from time import sleep
 from datetime import datetime, timedelta
 from pylons import c, g
@@ -765,23 +769,125 @@ def fetch_things(t_class,since,until,batch_fn=None,
         q._after(t)
         things = list(q)
 
-def fetch_things2(query, chunk_size = 100, batch_fn = None, chunks = False):
+def prefetch(it, size=1):
+    """Iterate over `it' in a background thread, keeping up to `size'
+    items ready for the caller.
+
+    This lets the next item (e.g. the next chunk of a query) be fetched
+    while the caller works on the current one. Exceptions raised by `it'
+    are re-raised in the caller. The thread runs with the caller's
+    pylons globals, since the db layer needs them."""
+    import sys
+    import threading
+    from Queue import Queue, Full
+
+    done = object()
+    q = Queue(size)
+    stop = threading.Event()
+
+    proxies = []
+    for proxy in (c, g):
+        try:
+            proxies.append((proxy, proxy._current_obj()))
+        except (AttributeError, TypeError):
+            # not a registered pylons proxy, nothing to carry over
+            pass
+
+    def put(item):
+        # don't block forever if the caller stops iterating early
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def run():
+        for proxy, obj in proxies:
+            proxy._push_object(obj)
+        try:
+            try:
+                for item in it:
+                    if not put((item, None)):
+                        return
+            except:
+                put((done, sys.exc_info()))
+            else:
+                put((done, None))
+        finally:
+            for proxy, obj in proxies:
+                proxy._pop_object(obj)
+
+    t = threading.Thread(target=run)
+    t.setDaemon(True)
+    t.start()
+
+    try:
+        while True:
+            item, exc_info = q.get()
+            if item is done:
+                if exc_info:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                break
+            yield item
+    finally:
+        stop.set()
+
+def fetch_things2(query, chunk_size = 100, batch_fn = None, chunks = False,
+                  prefetch_chunks = False, progress_fn = None):
     """Incrementally run query with a limit of chunk_size until there are
     no results left. batch_fn transforms the results for each chunk
-    before returning."""
+    before returning.
+
+    Each chunk picks up after the last item of the previous one on the
+    query's sort columns, so items that tie with it on all of them are
+    skipped. With prefetch_chunks=True the next chunk is fetched in a
+    background thread while the caller works on the current one; the
+    items of a chunk shouldn't be changed in ways that matter to the
+    query until the chunk after it has been handed out. progress_fn, if
+    given, is called with each chunk as it's handed out, with the number
+    of items so far and the number handed out per second.
+
+    For jobs that walk over lots of things, build the query with bulk=True
+    to load each chunk's things and data from the db in one round trip
+    instead of through the cache."""
 
     assert query._sort, "you must specify the sort order in your query!"
 
+    # the db layer rewrites the rules in place when it runs the query, so
+    # each chunk has to start from a fresh copy of the original ones
     orig_rules = deepcopy(query._rules)
     query._limit = chunk_size
-    items = list(query)
-    done = False
-    while items and not done:
-        #don't need to query again at the bottom if we didn't get enough
-        if len(items) < chunk_size:
-            done = True
 
-        after = items[-1]
+    def fetch_chunks():
+        items = list(query)
+        while items:
+            #don't need to query again if we didn't get enough
+            done = len(items) < chunk_size
+            if not done:
+                # build the rules for the next chunk before handing this one
+                # out, in case batch_fn or the caller changes its items
+                query._rules = deepcopy(orig_rules)
+                query._after(items[-1])
+
+            yield items
+
+            if done:
+                break
+            items = list(query)
+
+    chunk_iter = fetch_chunks()
+    if prefetch_chunks:
+        chunk_iter = prefetch(chunk_iter)
+
+    start = time.time()
+    seen = 0
+    for items in chunk_iter:
+        if progress_fn:
+            seen += len(items)
+            elapsed = time.time() - start
+            progress_fn(seen, seen / elapsed if elapsed else 0.)
 
         if batch_fn:
             items = batch_fn(items)
@@ -792,11 +898,6 @@ def fetch_things2(query, chunk_size = 100, batch_fn = None, chunks = False):
             for i in items:
                 yield i
 
-        if not done:
-            query._rules = deepcopy(orig_rules)
-            query._after(after)
-            items = list(query)
-
 def fix_if_broken(thing, delete = True, fudge_links = False):
     from r2.models import Link, Comment, Subreddit, Message
 
@@ -1410,9 +1511,84 @@ def find_containing_network(ip_ranges, address):
     return None
 
 
+def _parse_ip(address):
+    """Return (version, integer value) of an IP address string.
+
+    This is much cheaper than building an ipaddress object. Raises
+    ValueError if the address isn't valid."""
+    try:
+        if ':' in address:
+            hi, lo = struct.unpack('!QQ',
+                                   socket.inet_pton(socket.AF_INET6, address))
+            return 6, (hi << 64) | lo
+        else:
+            return 4, struct.unpack('!I',
+                                    socket.inet_pton(socket.AF_INET,
+                                                     address))[0]
+    except (socket.error, TypeError, UnicodeError):
+        raise ValueError("%r does not appear to be an IP address" % address)
+
+
+class NetworkIndex(object):
+    """An immutable set of IP networks that can be searched for addresses.
+
+    The networks are merged into sorted, disjoint integer ranges (one list
+    per IP version) so that `address in index` is a binary search rather
+    than a test against each network. Iterating over it gives the networks
+    it was built from, collapsed."""
+
+    def __init__(self, networks=()):
+        self._networks = list(networks)
+        self._collapsed = None
+
+        ranges = {4: [], 6: []}
+        for network in self._networks:
+            ranges[network.version].append((int(network.network_address),
+                                            int(network.broadcast_address)))
+
+        self._starts = {}
+        self._ends = {}
+        for version, version_ranges in ranges.iteritems():
+            starts = []
+            ends = []
+            for start, end in sorted(version_ranges):
+                if ends and start <= ends[-1] + 1:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+            self._starts[version] = starts
+            self._ends[version] = ends
+
+    def __contains__(self, address):
+        version, value = _parse_ip(address)
+        i = bisect.bisect_right(self._starts[version], value) - 1
+        return i >= 0 and value <= self._ends[version][i]
+
+    def _get_collapsed(self):
+        # collapsing is slow and only needed to list the networks, so it
+        # isn't done until then
+        if self._collapsed is None:
+            collapsed = []
+            for version in (4, 6):
+                collapsed.extend(ipaddress.collapse_addresses(
+                    n for n in self._networks if n.version == version))
+            self._collapsed = collapsed
+        return self._collapsed
+
+    def __iter__(self):
+        return iter(self._get_collapsed())
+
+    def __len__(self):
+        return len(self._get_collapsed())
+
+    def __repr__(self):
+        return "<NetworkIndex %r>" % self._get_collapsed()
+
+
 def is_throttled(address):
     """Determine if an IP address is in a throttled range."""
-    return bool(find_containing_network(g.throttles, address))
+    return address in g.throttles
 
 
 def parse_http_basic(authorization_header):
@@ -26,23 +26,8 @@ import re, types
 
 from hashlib import md5
 
-class _TemplateUpdater(object):
-    # this class is just a hack to get around Cython's closure rules
-
-    __slots = ['d', 'start', 'end', 'template', 'pattern']
-
-    def __init__(self, d, start, end, template, pattern):
-        self.d = d
-        self.start, self.end = start, end
-        self.template = template
-        self.pattern = pattern
-
-    def update(self):
-        return self.pattern.sub(self._convert, self.template)
-
-    def _convert(self, m):
-        name = m.group("named")
-        return self.d.get(name, self.start + name + self.end)
+# the value of a variable missing from a replacement dictionary
+_missing = object()
 
 class StringTemplate(object):
     """
@@ -54,6 +39,9 @@ class StringTemplate(object):
     We could use the built in python Template class for this, but
     unfortunately it doesn't handle unicode as gracefully as we'd
     like.
+
+    The template is split on its variables once, the first time it is
+    updated, and updates after that are joins over the segments.
     """
     start_delim = "<$>"
     end_delim = "</$>"
@@ -65,6 +53,10 @@ class StringTemplate(object):
                     )
     pattern2 = re.compile(pattern2,  re.UNICODE)
 
+    # literal text at the even indices and variable names at the odd
+    # ones (as returned by pattern2.split), or None if not split yet
+    _segments = None
+
     def __init__(self, template):
         # for the nth time, we have to transform the string into
         # unicode.  Otherwise, re.sub will choke on non-ascii
@@ -74,24 +66,194 @@ class StringTemplate(object):
         except UnicodeDecodeError:
             self.template = unicode(template, "utf8")
 
+    @classmethod
+    def _from_segments(cls, segments):
+        self = cls.__new__(cls)
+        self._segments = segments
+        self.template = _join_segments(segments, None)
+        return self
+
+    def __getstate__(self):
+        # only the text is cached, so the cached format doesn't change
+        state = self.__dict__.copy()
+        state.pop('_segments', None)
+        return state
+
+    def segments(self):
+        if self._segments is None:
+            self._segments = tuple(self.pattern2.split(self.template))
+        return self._segments
+
     def update(self, d):
         """
         Given a dictionary of replacement rules for the Template,
         replace variables in the template (once!) and return an
         updated Template.
         """
-        if d:
-            updater = _TemplateUpdater(d, self.start_delim, self.end_delim,
-                                       self.template, self.pattern2)
-            return self.__class__(updater.update())
-        return self
+        if not d:
+            return self
+        segments = self.segments()
+        if len(segments) == 1:
+            return self
+
+        # variables in the replacement values are kept as variables
+        # (for the next update), so those values are split too
+        new = []
+        literal = [segments[0]]
+        replaced = False
+        for i in xrange(1, len(segments), 2):
+            name = segments[i]
+            value = d.get(name, _missing)
+            if value is _missing:
+                new.append(u''.join(literal))
+                new.append(name)
+                literal = []
+            else:
+                replaced = True
+                if value is None:
+                    pass
+                elif StringTemplate.start_delim in value:
+                    value_segments = self.pattern2.split(value)
+                    literal.append(value_segments[0])
+                    for j in xrange(1, len(value_segments), 2):
+                        new.append(u''.join(literal))
+                        new.append(value_segments[j])
+                        literal = [value_segments[j + 1]]
+                else:
+                    literal.append(value)
+            literal.append(segments[i + 1])
+        if not replaced:
+            return self
+        new.append(u''.join(literal))
+        return self._from_segments(tuple(new))
 
     def finalize(self, d = {}):
         """
         The same as update, except the dictionary is optional and the
         object returned will be a unicode object.
         """
-        return self.update(d).template
+        if not d:
+            return self.template
+        segments = self.segments()
+        if len(segments) == 1:
+            return self.template
+        return _join_segments(segments, d)
+
+
+def _join_segments(segments, d):
+    parts = [segments[0]]
+    for i in xrange(1, len(segments), 2):
+        name = segments[i]
+        value = d.get(name, _missing) if d else _missing
+        if value is _missing:
+            parts.append(StringTemplate.start_delim)
+            parts.append(name)
+            parts.append(StringTemplate.end_delim)
+        elif value is not None:
+            parts.append(value)
+        parts.append(segments[i + 1])
+    return u''.join(parts)
+
+
+class _StubResolver(object):
+    """
+    Splices rendered cachable templates into the stubs that stand in for
+    them.
+
+    The page is spliced together in one join by render().  When the
+    templates themselves are needed (to be cached), resolve() is used
+    instead; this object then acts as the replacement dictionary passed
+    to StringTemplate.update, and looking up a stub resolves its own
+    stubs first, so every template is only resolved once.
+    """
+    def __init__(self, nodes):
+        # stub name -> (template, kw)
+        self.nodes = nodes
+        self.resolved = {}
+        self.finals = {}
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, name):
+        return name in self.nodes
+
+    def has_key(self, name):
+        return name in self.nodes
+
+    def __getitem__(self, name):
+        if name not in self.nodes:
+            raise KeyError(name)
+        return self.get(name)
+
+    def resolve(self, name):
+        """
+        The template for a stub with the stubs it contains replaced, but
+        not its kw (this is what gets cached).
+        """
+        resolved = self.resolved.get(name)
+        if resolved is None:
+            template, kw = self.nodes[name]
+            resolved = self.resolved[name] = template.update(self)
+        return resolved
+
+    def get(self, name, default = None):
+        if name not in self.nodes:
+            return default
+        final = self.finals.get(name)
+        if final is None:
+            template, kw = self.nodes[name]
+            final = self.finals[name] = self.resolve(name).finalize(kw)
+        return final
+
+    def render(self, template, kw):
+        """
+        The final form of template with kw applied and all the stubs
+        replaced, including those in the kw of the stubs (like the
+        child listings of comments) however deeply they're nested, in a
+        single join.
+        """
+        segments = template.segments()
+        if segments is None:
+            # stubs in json templates are objects, replaced as found
+            return template.update(kw).update(self).finalize()
+        parts = []
+        self._splice(segments, None, kw, parts)
+        return u''.join(parts)
+
+    def _splice(self, segments, kw, page_kw, parts):
+        # variables are filled in by the kw of the template they are in,
+        # and then by the kw of the page.
+        parts.append(segments[0])
+        for i in xrange(1, len(segments), 2):
+            name = segments[i]
+            node = self.nodes.get(name)
+            if node is not None:
+                template, node_kw = node
+                self._splice(template.segments(), node_kw, page_kw, parts)
+                parts.append(segments[i + 1])
+                continue
+
+            value = kw.get(name, _missing) if kw else _missing
+            value_kw = page_kw
+            if value is _missing and page_kw:
+                # (which don't get filled in from themselves)
+                value = page_kw.get(name, _missing)
+                value_kw = None
+
+            if value is _missing:
+                parts.append(StringTemplate.start_delim)
+                parts.append(name)
+                parts.append(StringTemplate.end_delim)
+            elif value is None:
+                pass
+            elif StringTemplate.start_delim in value:
+                # stubs (and page kw) in kw values are filled in too
+                self._splice(StringTemplate.pattern2.split(value), None,
+                             value_kw, parts)
+            else:
+                parts.append(value)
+            parts.append(segments[i + 1])
 
 
 class CacheStub(object):
@@ -236,8 +398,10 @@ class Templated(object):
         on each newly rendered thing, it is possible that that
         rendering has in turn cause more cachable things to be
         fetched.  Thus the first template to be rendered runs a loop
-        and keeps rendering until there is nothing left to render.
-        Then it updates the master template until it doesn't change.
+        and keeps rendering until there is nothing left to render,
+        with one get_multi per level of nesting.  Then the templates
+        are spliced into the master template in a single join (see
+        _StubResolver).
 
         NOTE 2: anything passed in as a kw to render (and thus
         _render) will not be part of the cached version of the object,
@@ -268,92 +432,63 @@ class Templated(object):
 
         # if this is the primary template, let the caching games begin
         if primary:
-            # updates will be the (self-updated) list of all of
-            # the cached templates that have been cached or
-            # rendered.
-            updates = {}
-            # to_cache is just the keys of the cached templates
-            # that were not in the cache.
-            to_cache = set([])
+            # the rendered (or cached) template and kw args for every
+            # stub, and the cache keys of the ones that had to be rendered
+            nodes = {}
+            to_cache = {}
+            rounds = 0
             while c.render_tracker:
                 # copy and wipe the tracker.  It'll get repopulated if
                 # any of the subsequent render()s call cached objects.
                 current = c.render_tracker
                 c.render_tracker = {}
-    
+                rounds += 1
+
                 # do a multi-get.  NOTE: cache keys are the first item
                 # in the tuple that is the current dict's values.
                 # This dict cast will generate a new dict of cache_key
                 # to value
                 cached = self._read_cache(dict(current.values()))
-                # replacements will be a map of key -> rendered content
-                # for updateing the current set of updates
-                replacements = {}
 
-                new_updates = {}
                 # render items that didn't make it into the cached list
                 for key, (cache_key, others) in current.iteritems():
                     # unbundle the remaining args
                     item, (attr, style, kw) = others
                     if cache_key not in cached:
                         # this had to be rendered, so cache it later
-                        to_cache.add(cache_key)
-                        # render the item and apply the stored kw args
+                        to_cache[key] = cache_key
                         r = item.render_nocache(attr, style)
                     else:
                         r = cached[cache_key]
-                    # store the unevaluated templates in
-                    # cached for caching
-                    replacements[key] = r.finalize(kw)
-                    new_updates[key] = (cache_key, (r, kw))
-                        
-                # update the updates so that when we can do the
-                # replacement in one pass.
-                
-                # NOTE: keep kw, but don't update based on them.
-                # We might have to cache these later, and we want
-                # to have things like $child present.
-                for k in updates.keys():
-                    cache_key, (value, kw) = updates[k]
-                    value = value.update(replacements)
-                    updates[k] = cache_key, (value, kw)
-
-                updates.update(new_updates)
-    
-            # at this point, we haven't touched res, but updates now
-            # has the list of all the updates we could conceivably
-            # want to make, and to_cache is the list of cache keys
-            # that we didn't find in the cache.
+                    nodes[key] = (r, kw)
 
-            # cache content that was newly rendered
+            # at this point every stub has been fetched or rendered
+            resolver = _StubResolver(nodes)
+
+            # cache content that was newly rendered, with the stubs it
+            # contains replaced but not its kw args.  We might have to
+            # cache these later, and we want to have things like $child
+            # present.
             _to_cache = {}
-            for k, (v, kw) in updates.values():
-                if k in to_cache:
-                    _to_cache[k] = v
+            for key, cache_key in to_cache.iteritems():
+                _to_cache[cache_key] = resolver.resolve(key)
             self._write_cache(_to_cache)
-    
+
             # edge case: this may be the primary tempalte and cachable
             if isinstance(res, CacheStub):
-                res = updates[res.name][1][0]
-                
-            # now we can update the updates to make use of their kw args.
-            _updates = {}
-            for k, (foo, (v, kw)) in updates.iteritems():
-                _updates[k] = v.finalize(kw)
-            updates = _updates
-
-            # update the response to use these values
-            # replace till we can't replace any more. 
-            npasses = 0
-            while True:
-                npasses += 1
-                r = res
-                res = res.update(kwargs).update(updates)
-                semi_final = res.finalize()
-                if r.finalize() == res.finalize():
-                    res = semi_final
-                    break
-                
+                res = resolver.resolve(res.name)
+
+            res = resolver.render(res, kwargs)
+
+            if nodes:
+                counter = g.stats.get_counter('rendercache')
+                if counter:
+                    counter.increment('pages')
+                    counter.increment('stubs', delta=len(nodes))
+                    counter.increment('hit', delta=len(nodes) - len(to_cache))
+                    counter.increment('miss', delta=len(to_cache))
+                    counter.increment('rounds', delta=rounds)
+
             # wipe out the render tracker object
             c.render_tracker = None
         elif not isinstance(res, CacheStub):
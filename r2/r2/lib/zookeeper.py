@@ -80,7 +80,7 @@ class LiveConfig(object):
 
 class LiveList(object):
     """A mutable set shared by all apps and backed by ZooKeeper."""
-    def __init__(self, client, root, map_fn=None, reduce_fn=lambda L: L,
+    def __init__(self, client, root, map_fn=None, reduce_fn=list,
                  watch=True):
         self.client = client
         self.root = root
@@ -107,7 +107,9 @@ class LiveList(object):
         mapped = map(self.map_fn, unquoted)
 
         if reduce:
-            return list(self.reduce_fn(mapped))
+            # reduce_fn may build something other than a list (an index,
+            # say), so leave its result as it is
+            return self.reduce_fn(mapped)
         else:
             return list(mapped)
 
@@ -132,6 +134,11 @@ class LiveList(object):
             raise NotImplementedError()
         return iter(self.data)
 
+    def __contains__(self, item):
+        if not self.is_watching:
+            raise NotImplementedError()
+        return item in self.data
+
     def __len__(self):
         if not self.is_watching:
             raise NotImplementedError()
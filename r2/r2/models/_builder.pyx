@@ -25,6 +25,7 @@ from random import shuffle
 from builder import Builder, MAX_RECURSION, empty_listing
 from r2.lib.wrapped import Wrapped
 from r2.lib.comment_tree import link_comments_and_sort, tree_sort_fn, MAX_ITERATIONS
+from r2.lib.comment_frontier import CommentFrontier
 from r2.models.link import *
 from r2.lib.db import operators
 from r2.lib import utils
@@ -50,9 +51,8 @@ class _CommentBuilder(Builder):
     def get_items(self, num):
         from r2.lib.lock import TimeoutExpired
         cdef list cid
-        cdef dict cid_tree
-        cdef dict depth
-        cdef dict parents
+        # cid_tree, depth and parents are ArrayViews rather than dicts for
+        # trees stored with CommentTreeStorageV3
         cdef dict sorter
 
         r = link_comments_and_sort(self.link, self.sort.col)
@@ -90,8 +90,9 @@ class _CommentBuilder(Builder):
         if isinstance(self.comment, utils.iters):
             debug_dict["was_instance"] = "yes"
             for cm in self.comment:
-                # deleted comments will be removed from the cids list
-                if cm._id in cids:
+                # deleted comments will be removed from the cids list (and
+                # depth, which is cheaper to check)
+                if cm._id in depth:
                     dont_collapse.append(cm._id)
                     candidates.append(cm._id)
             # if nothing but deleted comments, the candidate list might be empty
@@ -143,16 +144,16 @@ class _CommentBuilder(Builder):
         candidates.sort(key = sorter.get, reverse = self.rev_sort)
 
         debug_dict["candidates_Before"] = repr(candidates)
-        while num_have < num and candidates:
-            to_add = candidates.pop(0)
-            if to_add not in cids:
+        frontier = CommentFrontier(sorter, self.rev_sort, candidates)
+        while num_have < num and frontier:
+            to_add = frontier.pop()
+            if to_add not in depth:
                 continue
             if (depth[to_add] - offset_depth) < self.max_depth + start_depth:
                 #add children
                 if cid_tree.has_key(to_add):
-                    candidates.extend([x for x in cid_tree[to_add]
-                                       if sorter.get(x) is not None])
-                    candidates.sort(key = sorter.get, reverse = self.rev_sort)
+                    frontier.extend([x for x in cid_tree[to_add]
+                                     if sorter.get(x) is not None])
                 items.append(to_add)
                 num_have += 1
             elif self.continue_this_thread:
@@ -167,6 +168,7 @@ class _CommentBuilder(Builder):
                     w = Wrapped(MoreRecursion(self.link, 0, p_id))
                     w.children.append(to_add)
                     extra[p_id] = w
+        candidates = frontier.remaining()
         debug_dict["candidates_after"] = repr(candidates)
 
         # items is a list of things we actually care about so load them
@@ -227,15 +229,11 @@ class _CommentBuilder(Builder):
             return final
 
         #put the remaining comments into the tree (the show more comments link)
+        #the remaining candidates' descendants are counted from num_children
+        #rather than by walking their subtrees
         cdef dict more_comments = {}
-        cdef int iteration_count = 0
         cdef int parentfinder_iteration_count
-        while candidates:
-            if iteration_count > MAX_ITERATIONS:
-                raise Exception("bad comment tree for link %s" %
-                                self.link._id36)
-
-            to_add = candidates.pop(0)
+        for to_add in candidates:
             direct_child = True
             #ignore top-level comments for now
             p_id = parents[to_add]
@@ -266,15 +264,10 @@ class _CommentBuilder(Builder):
                         parent.child = empty_listing(w_mc2)
                         parent.child.parent_name = parent._fullname
 
-            #add more children
-            if cid_tree.has_key(to_add):
-                candidates.extend(cid_tree[to_add])
-
             if direct_child:
                 mc2.children.append(to_add)
 
-            mc2.count += 1
-            iteration_count += 1
+            mc2.count += 1 + max(num_children.get(to_add, 0), 0)
 
         if isinstance(self.sort, operators.shuffled):
             shuffle(final)
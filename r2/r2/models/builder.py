@@ -42,8 +42,10 @@ from copy import deepcopy
 from r2.lib.utils import Storage
 
 from r2.models.wiki import WIKI_RECENT_DAYS
+from r2.models.query_cache import CachedQuery
 
 from collections import defaultdict
+from itertools import islice
 import time
 from admintools import compute_votes, admintools, ip_span
 
@@ -442,6 +444,19 @@ class IDBuilder(QueryBuilder):
                                   stale=self.stale)
 
     def init_query(self):
+        if (not self.reverse and g.chunked_listings
+                and hasattr(self.query, 'iter_after')):
+            # only read as much of the listing as the page ends up needing
+            self.names = self.query.iter_after(self.after)
+            return
+
+        if (not self.reverse and not self.after and self.num
+                and isinstance(self.query, CachedQuery)):
+            # sorted cached queries can read just the first page
+            limit = max(int(self.num * EXTRA_FACTOR), 1)
+            self.names = self.query.iter_first(limit)
+            return
+
         names = list(tup(self.query))
 
         after = self.after._fullname if self.after else None
@@ -479,10 +494,16 @@ class IDBuilder(QueryBuilder):
                     last_item = None
                 slice_size = max(int(num_need * EXTRA_FACTOR), 1)
         else:
-            slice_size = len(names)
+            slice_size = None
             done = True
 
-        self.names, new_names = names[slice_size:], names[:slice_size]
+        if hasattr(names, '__len__'):
+            if slice_size is None:
+                slice_size = len(names)
+            self.names, new_names = names[slice_size:], names[:slice_size]
+        else:
+            # an iterator from iter_after
+            new_names = list(islice(names, slice_size))
         new_items = self.thing_lookup(new_names)
         return done, new_items
 
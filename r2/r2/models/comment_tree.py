@@ -20,6 +20,10 @@
 # Inc. All Rights Reserved.
 ###############################################################################
 
+from array import array
+from bisect import bisect_left
+import struct
+
 from r2.lib.db import tdb_cassandra
 from r2.lib import utils
 from r2.models.last_modified import LastModified
@@ -32,6 +36,11 @@ from pycassa.system_manager import ASCII_TYPE, COUNTER_COLUMN_TYPE
 from pylons import g
 
 
+# the default for CommentTreeArrays lookups: raise KeyError when the comment
+# isn't there rather than returning a default
+_RAISE = object()
+
+
 class CommentTreeStorageBase(object):
     _maintain_num_children = True
 
@@ -370,6 +379,300 @@ class CommentTreeStorageV1(CommentTreeStorageBase):
                              tree.parents)
 
 
+class CommentTreeArrays(object):
+    """A comment tree packed into parallel typed arrays.
+
+    The comment IDs are kept sorted so a comment's position can be found by
+    bisection.  The parent, depth and num_children arrays are indexed by that
+    position, and the children of each comment are stored contiguously in a
+    single array (CSR style): the children of the comment at position i are
+    children[offsets[i + 1]:offsets[i + 2]], with slot 0 of offsets used for
+    the top-level comments.
+
+    The arrays serialize to a flat string that can be decoded without
+    building any per-comment Python objects.
+
+    """
+
+    ID_TYPECODE = 'l'
+    COUNT_TYPECODE = 'i'
+    FORMAT_VERSION = 1
+    # format version, id item size, count item size, number of comments,
+    # number of children
+    _header = struct.Struct('!BBBII')
+
+    def __init__(self, cids, parents, depth, num_children, offsets, children):
+        self.cids = cids
+        self.parents = parents
+        self.depth = depth
+        self.num_children = num_children
+        self.offsets = offsets
+        self.children = children
+
+    @classmethod
+    def from_tree(cls, cids, tree, depth, num_children, parents):
+        """Pack the dict-based representation of a comment tree."""
+        cids = array(cls.ID_TYPECODE, sorted(cids))
+        offsets = array(cls.COUNT_TYPECODE, [0])
+        children = array(cls.ID_TYPECODE)
+        for cid in [None] + cids.tolist():
+            children.extend(tree.get(cid, ()))
+            offsets.append(len(children))
+
+        return cls(
+            cids=cids,
+            parents=array(cls.ID_TYPECODE,
+                          [parents.get(cid) or 0 for cid in cids]),
+            depth=array(cls.COUNT_TYPECODE, [depth[cid] for cid in cids]),
+            num_children=array(cls.COUNT_TYPECODE,
+                               [num_children.get(cid, 0) for cid in cids]),
+            offsets=offsets,
+            children=children,
+        )
+
+    @classmethod
+    def _layout(cls, size, num_children):
+        """Return the (typecode, length) of each array, in storage order."""
+        return [(cls.ID_TYPECODE, size),
+                (cls.ID_TYPECODE, size),
+                (cls.COUNT_TYPECODE, size),
+                (cls.COUNT_TYPECODE, size),
+                (cls.COUNT_TYPECODE, size + 2),
+                (cls.ID_TYPECODE, num_children)]
+
+    def dumps(self):
+        header = self._header.pack(self.FORMAT_VERSION,
+                                   array(self.ID_TYPECODE).itemsize,
+                                   array(self.COUNT_TYPECODE).itemsize,
+                                   len(self.cids), len(self.children))
+        return ''.join([header,
+                        self.cids.tostring(),
+                        self.parents.tostring(),
+                        self.depth.tostring(),
+                        self.num_children.tostring(),
+                        self.offsets.tostring(),
+                        self.children.tostring()])
+
+    @classmethod
+    def loads(cls, s):
+        (version, id_size, count_size,
+         size, num_children) = cls._header.unpack_from(s)
+        if (version != cls.FORMAT_VERSION or
+                id_size != array(cls.ID_TYPECODE).itemsize or
+                count_size != array(cls.COUNT_TYPECODE).itemsize):
+            raise ValueError("incompatible comment tree encoding")
+
+        layout = cls._layout(size, num_children)
+        expected = cls._header.size + sum(array(typecode).itemsize * length
+                                          for typecode, length in layout)
+        if len(s) != expected:
+            raise ValueError("truncated comment tree encoding")
+
+        pos = cls._header.size
+        arrays = []
+        for typecode, length in layout:
+            a = array(typecode)
+            end = pos + length * a.itemsize
+            a.fromstring(s[pos:end])
+            arrays.append(a)
+            pos = end
+        return cls(*arrays)
+
+    def _index(self, cid):
+        i = bisect_left(self.cids, cid)
+        if i == len(self.cids) or self.cids[i] != cid:
+            return -1
+        return i
+
+    @staticmethod
+    def _missing(cid, default):
+        if default is _RAISE:
+            raise KeyError(cid)
+        return default
+
+    def position(self, cid):
+        """Return the index of cid in the arrays, or raise KeyError."""
+        i = self._index(cid)
+        if i < 0:
+            raise KeyError(cid)
+        return i
+
+    def get_parent(self, cid, default=_RAISE):
+        i = self._index(cid)
+        if i < 0:
+            return self._missing(cid, default)
+        return self.parents[i] or None
+
+    def get_depth(self, cid, default=_RAISE):
+        i = self._index(cid)
+        if i < 0:
+            return self._missing(cid, default)
+        return self.depth[i]
+
+    def get_num_children(self, cid, default=_RAISE):
+        i = self._index(cid)
+        if i < 0:
+            return self._missing(cid, default)
+        return self.num_children[i]
+
+    def get_children(self, cid, default=_RAISE):
+        """Return the list of children of cid.
+
+        Leaves are missing (KeyError, or default if one is given) to mirror
+        the dict-based tree, which only has keys for comments that have
+        children.
+
+        """
+        if cid is None:
+            i = 0
+        else:
+            i = self._index(cid) + 1
+            if not i:
+                return self._missing(cid, default)
+        start, end = self.offsets[i], self.offsets[i + 1]
+        if start == end:
+            return self._missing(cid, default)
+        return self.children[start:end].tolist()
+
+    def views(self):
+        """Return dict-like views of the tree for use as CommentTree attrs."""
+        return dict(cids=self.cids,
+                    tree=ArrayView(self.get_children),
+                    depth=ArrayView(self.get_depth),
+                    num_children=ArrayView(self.get_num_children),
+                    parents=ArrayView(self.get_parent))
+
+
+class ArrayView(object):
+    """A dict-like view of one attribute of a CommentTreeArrays.
+
+    Lookups are answered from the arrays. Assignments (the comment builder
+    adjusts the tree for permalink context) are kept in an overlay so the
+    arrays themselves are never modified.
+
+    lookup(key, default) returns default for missing keys and raises
+    KeyError if it isn't given one.
+
+    """
+
+    _absent = object()
+
+    def __init__(self, lookup, overrides=None):
+        self.lookup = lookup
+        self.overrides = overrides or {}
+
+    def __getitem__(self, key):
+        if key in self.overrides:
+            return self.overrides[key]
+        return self.lookup(key)
+
+    def __setitem__(self, key, value):
+        self.overrides[key] = value
+
+    def __contains__(self, key):
+        return (key in self.overrides or
+                self.lookup(key, self._absent) is not self._absent)
+
+    has_key = __contains__
+
+    def get(self, key, default=None):
+        if key in self.overrides:
+            return self.overrides[key]
+        return self.lookup(key, default)
+
+    def copy(self):
+        return ArrayView(self.lookup, self.overrides.copy())
+
+
+class CommentTreeStorageV3(CommentTreeStorageBase):
+    """Permacache storage of comment trees as packed arrays.
+
+    Like CommentTreeStorageV1 this keeps the whole tree under one permacache
+    key, but the value is a CommentTreeArrays string rather than pickled
+    dicts, which is far smaller and much cheaper to load for large threads.
+    Reads use the arrays directly; writes unpack the tree into dicts, update
+    it and repack it.
+
+    """
+
+    @staticmethod
+    def _comments_key(link_id):
+        return 'comments_arrays_' + str(link_id)
+
+    @staticmethod
+    def _lock_key(link_id):
+        return 'comment_lock_' + str(link_id)
+
+    @classmethod
+    def mutation_context(cls, link, timeout=None):
+        return g.make_lock("comment_tree", cls._lock_key(link._id),
+                           timeout=timeout)
+
+    @classmethod
+    def by_link(cls, link):
+        r = g.permacache.get(cls._comments_key(link._id))
+        if not r:
+            return None
+        try:
+            arrays = CommentTreeArrays.loads(r)
+        except (ValueError, struct.error):
+            g.log.error("comment_tree.py: bad packed tree for Link %s",
+                        link._id)
+            return None
+        return arrays.views()
+
+    @staticmethod
+    def _unpack(tree):
+        """Replace any array-backed attrs of tree with plain dicts/lists."""
+        if not isinstance(tree.depth, ArrayView):
+            return
+
+        cids = list(tree.cids)
+        tree_dict = {}
+        for cid in [None] + cids:
+            children = tree.tree.get(cid)
+            if children:
+                tree_dict[cid] = children
+        tree.tree = tree_dict
+        tree.depth = dict((cid, tree.depth[cid]) for cid in cids)
+        tree.num_children = dict((cid, tree.num_children[cid])
+                                 for cid in cids)
+        tree.parents = dict((cid, tree.parents[cid]) for cid in cids)
+        tree.cids = cids
+
+    @classmethod
+    def _write(cls, tree):
+        arrays = CommentTreeArrays.from_tree(tree.cids, tree.tree, tree.depth,
+                                             tree.num_children, tree.parents)
+        g.permacache.set(cls._comments_key(tree.link_id), arrays.dumps())
+
+    @classmethod
+    def add_comments(cls, tree, comments):
+        with cls.mutation_context(tree.link):
+            cls._unpack(tree)
+            CommentTreeStorageBase.add_comments(tree, comments)
+            cls._write(tree)
+
+    @classmethod
+    def delete_comment(cls, tree, comment):
+        with cls.mutation_context(tree.link):
+            cls._unpack(tree)
+            # only remove leaf comments from the tree
+            if comment._id not in tree.tree:
+                if comment._id in tree.cids:
+                    tree.cids.remove(comment._id)
+                for attr in (tree.depth, tree.num_children, tree.parents):
+                    attr.pop(comment._id, None)
+                cls._write(tree)
+
+    @classmethod
+    def upgrade(cls, tree, link):
+        with cls.mutation_context(link):
+            if not tree.parents:
+                tree.parents = tree.parent_dict_from_tree(tree.tree)
+            cls._write(tree)
+
+
 class CommentTree:
     """Storage for pre-computed relationships between a link's comments.
 
@@ -391,11 +694,15 @@ class CommentTree:
       - parents: dict of int to int; each entry in cids has a key in this dict,
           and the corresponding value is the ID of that comment's parent (or
           None in the case of top-level comments)
+
+    For CommentTreeStorageV3 links cids is a sorted array and the other
+    attrs are dict-like views (ArrayView) of a CommentTreeArrays.
     """
 
     IMPLEMENTATIONS = {
         1: CommentTreeStorageV1,
         2: CommentTreeStorageV2,
+        3: CommentTreeStorageV3,
     }
 
     DEFAULT_IMPLEMENTATION = 2
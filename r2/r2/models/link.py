@@ -29,7 +29,7 @@ from subreddit import Subreddit, DomainSR
 from printable import Printable
 from r2.config import cache, extensions
 from r2.lib.memoize import memoize
-from r2.lib.filters import _force_utf8
+from r2.lib.filters import _force_utf8, prefetch_markdown, prerender_markdown
 from r2.lib import utils
 from r2.lib.log import log_text
 from mako.filters import url_escape
@@ -595,6 +595,14 @@ class Link(Thing, Printable):
         if user_is_loggedin:
             incr_counts(wrapped)
 
+        # the listing's json has the selftext of every self post in it, so
+        # get all of them rendered at once
+        if c.render_style in extensions.API_TYPES:
+            target = "_top" if cname else None
+            prefetch_markdown((item.selftext, False, target)
+                              for item in wrapped
+                              if item.is_self and not item.expunged)
+
         # Run this last
         Printable.add_props(user, wrapped)
 
@@ -754,6 +762,7 @@ class Comment(Thing, Printable):
             name = 'selfreply'
 
         c._commit()
+        prerender_markdown(body)
 
         changed(link, True)  # link's number of comments changed
 
@@ -1060,6 +1069,17 @@ class Comment(Thing, Printable):
 
             item.lastedited = CachedVariable("lastedited")
 
+        # get every body on the page rendered at once, with the options the
+        # templates will render it with
+        if c.render_style in extensions.API_TYPES:
+            target = "_top" if cname else None
+            prefetch_markdown((item.body, False, target) for item in wrapped)
+        else:
+            newwindow = c.user.pref_newwindow
+            prefetch_markdown((item.body, item.nofollow,
+                               '_blank' if newwindow else item.target)
+                              for item in wrapped)
+
         # Run this last
         Printable.add_props(user, wrapped)
 
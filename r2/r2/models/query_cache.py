@@ -34,12 +34,14 @@ jobs.
 
 import json
 import random
+import struct
 import datetime
 import collections
 
 from pylons import g
 from pycassa.system_manager import ASCII_TYPE, UTF8_TYPE
 from pycassa.batch import Mutator
+from pycassa.cassandra.ttypes import NotFoundException
 
 from r2.models import Thing
 from r2.lib.db import tdb_cassandra
@@ -77,6 +79,32 @@ class ThingTupleComparator(object):
         return 0
 
 
+def _encode_sort_value(value, descending):
+    # map the double's bits onto an unsigned int that orders the same way
+    # (flip the sign bit of positives, all of the bits of negatives), then
+    # invert it for descending sorts. adding 0.0 turns -0.0 into 0.0.
+    bits, = struct.unpack(">Q", struct.pack(">d", float(value) + 0.0))
+    if bits & 0x8000000000000000:
+        bits ^= 0xffffffffffffffff
+    else:
+        bits |= 0x8000000000000000
+    if descending:
+        bits ^= 0xffffffffffffffff
+    return "%016x" % bits
+
+
+def _encode_sort_key(sort, values):
+    """Return a string that orders like ThingTupleComparator(sort) would.
+
+    Each of the (numeric) sort values is encoded as 16 hex digits, so
+    comparing the strings of two items compares their sort columns in turn,
+    honoring each column's asc or desc.
+
+    """
+    return "".join(_encode_sort_value(value, not isinstance(s, asc))
+                   for s, value in zip(sort, values))
+
+
 class _CachedQueryBase(object):
     def __init__(self, sort):
         self.sort = sort
@@ -95,12 +123,18 @@ class _CachedQueryBase(object):
             return
 
         self._fetch()
-        self._sort_data()
+        if not self._presorted:
+            self._sort_data()
         self._fetched = True
 
     def _fetch(self):
         raise NotImplementedError()
 
+    @property
+    def _presorted(self):
+        """Whether _fetch leaves the data in order already."""
+        return False
+
     def _sort_data(self):
         comparator = ThingTupleComparator(self.sort_cols)
         self.data.sort(cmp=comparator)
@@ -120,7 +154,8 @@ class CachedQuery(_CachedQueryBase):
     stores each item's ID and a minimal subset of its data as required for
     sorting.
 
-    Each time the listing is fetched, it is sorted. Because of this, we need to
+    Each time the listing is fetched, it is sorted (unless its model stores
+    the items in order, see _SortedQueryCache). Because of this, we need to
     ensure the listing does not grow too large.  On each insert, a "pruning"
     can occur (with a configurable probability) which will remove excess items
     from the end of the listing.
@@ -158,14 +193,49 @@ class CachedQuery(_CachedQueryBase):
     def _fetch(self):
         self._fetch_multi([self])
 
+    @property
+    def _presorted(self):
+        return self.model._sorted
+
+    def iter_first(self, limit):
+        """Yield the fullnames in the listing, reading only as much as needed.
+
+        For queries whose model stores them in order, only the first limit
+        items are read up front and the rest of the listing is read if
+        iteration goes past them.
+
+        """
+        if not self._fetched and self._presorted:
+            self._fetch_multi([self], limit=limit)
+            first = [t[0] for t in self.data]
+            for fullname in first:
+                yield fullname
+
+            # pick up after the last item yielded, wherever it is now
+            self.fetch(force=True)
+            rest = [t[0] for t in self.data[:MAX_CACHED_ITEMS]]
+            if first and first[-1] in rest:
+                rest = rest[rest.index(first[-1]) + 1:]
+            seen = set(first)
+            for fullname in rest:
+                if fullname not in seen:
+                    yield fullname
+        else:
+            for fullname in self:
+                yield fullname
+
     @classmethod
-    def _fetch_multi(self, queries):
+    def _fetch_multi(self, queries, limit=None):
         """Fetch the unsorted query results for multiple queries at once.
 
         In the case of precomputed queries, do an extra lookup first to
         determine which row key to find the latest precomputed values for the
         query in.
 
+        Queries whose model stores them in order come back sorted, and if
+        limit is given only their first limit items are read (this doesn't
+        mark them as fetched).
+
         """
 
         by_model = collections.defaultdict(list)
@@ -181,7 +251,10 @@ class CachedQuery(_CachedQueryBase):
                 else:
                     need_mangling.append(q.key)
             mangled = model.index_mangle_keys(need_mangling)
-            fetched = model.get(pure + mangled)
+            if model._sorted:
+                fetched = model.get(pure + mangled, column_count=limit)
+            else:
+                fetched = model.get(pure + mangled)
             cached_queries.update(fetched)
 
         for q in queries:
@@ -198,7 +271,10 @@ class CachedQuery(_CachedQueryBase):
             t = self._make_item_tuple(thing)
             values[t[0]] = tuple(t[1:])
 
-        self.model.insert(mutator, self.key, values)
+        if self.model._sorted:
+            self.model.insert(mutator, self.key, values, self.sort)
+        else:
+            self.model.insert(mutator, self.key, values)
 
     def _delete(self, mutator, things):
         if not things:
@@ -234,7 +310,8 @@ class CachedQuery(_CachedQueryBase):
 
         with Mutator(CONNECTION_POOL) as m:
             for q in queries:
-                q._sort_data()
+                if not q._presorted:
+                    q._sort_data()
                 q._prune(m)
 
     def __hash__(self):
@@ -479,6 +556,7 @@ class _BaseQueryCache(object):
     _use_db = False
     _type_prefix = None
     _cf_name = None
+    _sorted = False
 
     @classmethod
     def get(cls, keys):
@@ -556,6 +634,116 @@ class _BaseQueryCache(object):
                            timestamp=timestamps.get(col))
 
 
+class _SortedQueryCache(_BaseQueryCache):
+    """A query cache that keeps each cached query's items in order.
+
+    Rather than just the fullname, each item's column name is its sort values
+    encoded so that Cassandra's ordering of the columns is the order of the
+    listing (see _encode_sort_key) followed by the fullname to break ties.
+    The value is the whole thing tuple.  Rows come back already sorted, and
+    the start of a listing can be read without reading all of it.
+
+    Since an item's column name changes along with its sort values, each row
+    also has a column named "~<fullname>" for each item whose value is the
+    item's current column name.  These sort after all of the items.  Two
+    racing updates of the same item can leave an extra column for it behind;
+    reads of the whole row skip those, and reads of a slice keep the first.
+
+    """
+
+    _sorted = True
+
+    @classmethod
+    def get(cls, keys, column_count=None):
+        """Retrieve the items in a set of cached queries, in order.
+
+        Like _BaseQueryCache.get, but if column_count is given only the first
+        column_count items of each query are returned.
+
+        """
+        column_count = column_count or tdb_cassandra.max_column_count
+        rows = cls._cf.multiget(keys, include_timestamp=True,
+                                column_count=column_count)
+
+        res = {}
+        for row, columns in rows.iteritems():
+            current = dict((key[1:], value)
+                           for (key, (value, timestamp)) in columns.iteritems()
+                           if key.startswith("~"))
+            data = []
+            timestamps = {}
+
+            for (key, (value, timestamp)) in columns.iteritems():
+                if key.startswith("~"):
+                    break
+
+                value = json.loads(value)
+                fullname = value[0]
+                if (fullname in timestamps or
+                    current.get(fullname, key) != key):
+                    continue
+                data.append(tuple(value))
+                timestamps[fullname] = timestamp
+
+            res[row] = (data, timestamps)
+
+        return res
+
+    @classmethod
+    def _get_item_columns(cls, key, fullnames):
+        """Return the current column name of each of the given items.
+
+        This is a read on the write path of every insert and removal, so it
+        is timed.
+
+        """
+        timer = g.stats.get_timer("cache.%s.item_columns" % cls.__name__)
+        timer.start()
+        try:
+            columns = cls._cf.get(key, columns=["~" + f for f in fullnames])
+        except NotFoundException:
+            columns = {}
+        timer.stop()
+        return dict((name[1:], value) for name, value in columns.iteritems())
+
+    @classmethod
+    @tdb_cassandra.will_write
+    def insert(cls, mutator, key, columns, sort):
+        """Insert things, given as {fullname: sort values}, in order."""
+        current = cls._get_item_columns(key, columns.keys())
+
+        updates = {}
+        for fullname, values in columns.iteritems():
+            column = _encode_sort_key(sort, values) + fullname
+            old_column = current.get(fullname)
+            if old_column and old_column != column:
+                mutator.remove(cls._cf, key, columns=[old_column])
+            updates[column] = json.dumps((fullname,) + tuple(values))
+            updates["~" + fullname] = column
+        mutator.insert(cls._cf, key, updates)
+
+    @classmethod
+    @tdb_cassandra.will_write
+    def remove(cls, mutator, key, columns):
+        """Unconditionally remove things (by fullname) from the query."""
+        current = cls._get_item_columns(key, columns)
+        to_remove = current.values() + ["~" + f for f in columns]
+        mutator.remove(cls._cf, key, columns=to_remove)
+
+    @classmethod
+    @tdb_cassandra.will_write
+    def remove_if_unchanged(cls, mutator, key, columns, timestamps):
+        """Remove things (by fullname) from the query if unchanged."""
+        current = cls._get_item_columns(key, columns)
+        for fullname in columns:
+            timestamp = timestamps.get(fullname)
+            to_remove = ["~" + fullname]
+            if fullname in current:
+                to_remove.append(current[fullname])
+            mutator.remove(cls._cf, key, columns=to_remove,
+                           timestamp=timestamp)
+
+
 class UserQueryCache(_BaseQueryCache):
     """A query cache column family for user-keyed queries."""
     _use_db = True
@@ -564,3 +752,13 @@ class UserQueryCache(_BaseQueryCache):
 class SubredditQueryCache(_BaseQueryCache):
     """A query cache column family for subreddit-keyed queries."""
     _use_db = True
+
+
+class SortedUserQueryCache(_SortedQueryCache):
+    """A sorted query cache column family for user-keyed queries."""
+    _use_db = True
+
+
+class SortedSubredditQueryCache(_SortedQueryCache):
+    """A sorted query cache column family for subreddit-keyed queries."""
+    _use_db = True
@@ -22,6 +22,7 @@
 
 import json
 import collections
+import uuid
 
 from r2.lib.db.thing import MultiRelation, Relation
 from r2.lib.db import tdb_cassandra
@@ -73,6 +74,88 @@ class VotesByAccount(tdb_cassandra.DenormalizedRelation):
     def value_for(cls, thing1, thing2, opaque):
         return opaque._name
 
+    # each account's votes of a type are cached in a single key as a tuple
+    # of (stamp, LastModified timestamp, {thing2._id36 : vote name or None})
+    # for the things it has recently been shown. None records a lookup
+    # that found no vote, and anything created after the timestamp can't
+    # have been voted on, so neither needs Cassandra or LastModified again.
+    #
+    # every vote sets the account's _votes_modified_key to a new stamp,
+    # without reading anything, and an entry is only used while its stamp
+    # is the current one. that way an entry written back by a lookup that
+    # raced with a vote is thrown away rather than hiding the vote.
+    @classmethod
+    def _vote_cache_key(cls, thing1):
+        return "votes_%s_%s" % (cls._last_modified_name, thing1._id36)
+
+    @classmethod
+    def _votes_modified_key(cls, thing1):
+        return "votes_modified_%s_%s" % (cls._last_modified_name,
+                                         thing1._id36)
+
+    @classmethod
+    def vote_cache_keys(cls, thing1):
+        return [cls._vote_cache_key(thing1), cls._votes_modified_key(thing1)]
+
+    @classmethod
+    def cached_query(cls, thing1, thing2s, cached=None):
+        """Like fast_query, but answered from the account's vote cache.
+
+        `cached` is the result of a get_multi that included this
+        relation's vote_cache_keys, for callers that fetch them along with
+        other keys. Only the things missing from the cache are looked up
+        in Cassandra, and they're added to it afterwards.
+
+        """
+        key, modified_key = cls.vote_cache_keys(thing1)
+        if cached is None:
+            cached = g.cache.get_multi([key, modified_key])
+        entry = cached.get(key)
+        stamp = cached.get(modified_key)
+
+        if entry and entry[0] == stamp:
+            stamp, last_modified, votes = entry
+        else:
+            from r2.models.last_modified import LastModified
+            last_modified = LastModified.get(thing1._fullname,
+                                             cls._last_modified_name)
+            entry = None
+            votes = {}
+
+        ret = {}
+        missing = []
+        for thing2 in thing2s:
+            if thing2._id36 in votes:
+                name = votes[thing2._id36]
+                if name is not None:
+                    ret[(thing1, thing2)] = name
+            elif last_modified and thing2._date <= last_modified:
+                missing.append(thing2)
+
+        if missing:
+            found = cls._get_columns(thing1, missing)
+            if len(votes) + len(missing) > g.vote_cache_max_entries:
+                # start over with just this page rather than growing forever
+                votes = {thing2._id36: votes[thing2._id36]
+                         for thing2 in thing2s if thing2._id36 in votes}
+            for thing2 in missing:
+                name = found.get(thing2._id36)
+                votes[thing2._id36] = name
+                if name is not None:
+                    ret[(thing1, thing2)] = name
+
+        if missing or not entry:
+            g.cache.set(key, (stamp, last_modified, votes),
+                        time=g.vote_cache_ttl)
+
+        return ret
+
+    @classmethod
+    def touch_vote_cache(cls, thing1):
+        """Invalidate thing1's vote cache after it has voted."""
+        g.cache.set(cls._votes_modified_key(thing1), uuid.uuid1().hex,
+                    time=g.vote_cache_ttl)
+
 
 class LinkVotesByAccount(VotesByAccount):
     _use_db = True
@@ -232,19 +315,16 @@ class Vote(MultiRelation('vote',
         VotesByAccount.copy_from(v)
         timer.intermediate("cassavotes")
 
+        cls.cache_vote(sub, obj)
+        timer.intermediate("vote_cache")
+
         queries.changed(v._thing2, True)
         timer.intermediate("changed")
 
         return v
 
     @classmethod
-    def likes(cls, sub, objs):
-        if not sub or not objs:
-            return {}
-
-        from r2.models import Account
-        assert isinstance(sub, Account)
-
+    def _rels(cls, sub, objs):
         rels = {}
         for obj in objs:
             try:
@@ -255,12 +335,44 @@ class Vote(MultiRelation('vote',
                 continue
 
             rels.setdefault(types, []).append(obj)
+        return rels
+
+    @classmethod
+    def cache_vote(cls, sub, obj):
+        """Invalidate sub's vote cache for obj's type after a vote."""
+        try:
+            relcls = VotesByAccount.rel(sub.__class__, obj.__class__)
+        except TdbException:
+            return
+        relcls.touch_vote_cache(sub)
+
+    @classmethod
+    def likes_cache_keys(cls, sub, objs):
+        """The cache keys likes will need for these objs.
+
+        Pass the result of a get_multi of them to likes as `cached`.
+
+        """
+        if not sub or not objs:
+            return []
+        return [key for relcls in cls._rels(sub, objs)
+                for key in relcls.vote_cache_keys(sub)]
+
+    @classmethod
+    def likes(cls, sub, objs, cached=None):
+        if not sub or not objs:
+            return {}
+
+        from r2.models import Account
+        assert isinstance(sub, Account)
+
+        rels = cls._rels(sub, objs)
 
         dirs_by_name = {"1": True, "0": None, "-1": False}
 
         ret = {}
         for relcls, items in rels.iteritems():
-            votes = relcls.fast_query(sub, items)
+            votes = relcls.cached_query(sub, items, cached)
             for cross, name in votes.iteritems():
                 ret[cross] = dirs_by_name[name]
         return ret
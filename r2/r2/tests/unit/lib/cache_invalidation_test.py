@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+import os
+import socket
+import time
+import unittest
+
+from r2.lib import cache_invalidation
+from r2.lib.cache_invalidation import (
+    InMemoryInvalidationBus,
+    MemoryInvalidationHub,
+    UDPMulticastInvalidationBus,
+)
+
+
+class InMemoryInvalidationBusTest(unittest.TestCase):
+    def test_delivers_to_peers_only(self):
+        hub = MemoryInvalidationHub()
+        buses = [InMemoryInvalidationBus(hub) for i in xrange(3)]
+        received = [[] for bus in buses]
+        for bus, keys in zip(buses, received):
+            bus.subscribe(keys.extend)
+
+        buses[0].publish(['a', 'b'])
+        self.assertEquals(received, [[], ['a', 'b'], ['a', 'b']])
+
+
+class UDPMulticastInvalidationBusTest(unittest.TestCase):
+    def test_packets_are_bounded(self):
+        bus = UDPMulticastInvalidationBus('239.255.42.99', 4299)
+        bus.origin = 'origin'
+        keys = ['key_%d' % i for i in xrange(1000)]
+
+        packets = list(bus._packets(keys))
+        self.assertTrue(len(packets) > 1)
+
+        unpacked = []
+        for packet in packets:
+            self.assertTrue(len(packet) <= cache_invalidation.MAX_PACKET_SIZE)
+            origin, sep, body = packet.partition('\n')
+            self.assertEquals(origin, 'origin')
+            unpacked.extend(body.split('\n'))
+        self.assertEquals(unpacked, keys)
+
+    def test_listener_stops_on_socket_errors(self):
+        class FakeSocket(object):
+            def __init__(self, packets):
+                self.packets = packets
+                self.closed = False
+
+            def recv(self, size):
+                if not self.packets:
+                    raise socket.error("broken")
+                return self.packets.pop(0)
+
+            def close(self):
+                self.closed = True
+
+        bus = UDPMulticastInvalidationBus('239.255.42.99', 4299)
+        bus.origin = 'origin'
+        bus.pid = os.getpid()
+        received = []
+        def subscriber(keys):
+            received.extend(keys)
+            raise ValueError
+        bus.subscribe(subscriber)
+
+        # a failing subscriber doesn't stop the listener, a broken socket
+        # does
+        sock = FakeSocket(['peer\na', 'peer\nb'])
+        bus._listen(sock)
+        self.assertEquals(received, ['a', 'b'])
+        self.assertTrue(sock.closed)
+        self.assertEquals(bus.pid, None)
+
+        # and the group is joined again, but not straight away
+        joins = []
+        bus._join = lambda: joins.append(True)
+        bus.start()
+        self.assertEquals(joins, [])
+        bus.retry_at = time.time() - 1
+        bus.start()
+        self.assertEquals(joins, [True])
+        self.assertEquals(bus.pid, os.getpid())
+
+
+if __name__ == '__main__':
+    unittest.main()
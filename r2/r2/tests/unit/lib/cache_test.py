@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+import unittest
+
+from r2.lib.cache import (
+    LocalCache,
+    LocalTierCache,
+    LRUCache,
+    MemcacheChain,
+    StaleCacheChain,
+)
+from r2.lib.cache_invalidation import (
+    InMemoryInvalidationBus,
+    MemoryInvalidationHub,
+)
+
+
+class LRUCacheTest(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_entries=3)
+        for i in xrange(3):
+            cache.set('k%d' % i, i)
+        cache.get('k0')
+        cache.set('k3', 3)
+
+        self.assertEquals(len(cache), 3)
+        self.assertEquals(cache.get('k0'), 0)
+        self.assertEquals(cache.get('k1'), None)
+
+    def test_bounded_by_bytes(self):
+        cache = LRUCache(max_entries=100, max_bytes=200)
+        for i in xrange(10):
+            cache.set('k%d' % i, 'x' * 40)
+        self.assertTrue(cache.size <= 200)
+        self.assertEquals(cache.get('k9'), 'x' * 40)
+
+    def test_expiry(self):
+        cache = LRUCache(max_ttl=60)
+        cache.set('expired', 1, time=-1)
+        self.assertEquals(cache.get('expired'), None)
+
+    def test_returns_copies(self):
+        cache = LRUCache()
+        cache.set('key', [1])
+        cache.get('key').append(2)
+        self.assertEquals(cache.get('key'), [1])
+
+
+class LocalTierCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.remote = LocalCache()
+        self.cache = LocalTierCache(LRUCache(), self.remote, ['Local_'])
+
+    def test_only_prefixed_keys_are_local(self):
+        self.remote.set('Local_1', 'a')
+        self.remote.set('Other_1', 'b')
+        self.assertEquals(self.cache.get_multi(['Local_1', 'Other_1']),
+                          {'Local_1': 'a', 'Other_1': 'b'})
+
+        self.remote.set('Local_1', 'c')
+        self.remote.set('Other_1', 'd')
+        self.assertEquals(self.cache.get('Local_1'), 'a')
+        self.assertEquals(self.cache.get('Other_1'), 'd')
+
+    def test_writes_update_local_tier(self):
+        self.cache.set('Local_1', 'a')
+        self.cache.set('Local_1', 'b')
+        self.assertEquals(self.cache.get('Local_1'), 'b')
+
+        self.cache.delete('Local_1')
+        self.assertEquals(self.cache.get('Local_1'), None)
+
+    def test_other_writes_drop_local_copy(self):
+        writes = [
+            lambda: self.cache.prepend('Local_1', 'x'),
+            lambda: self.cache.replace('Local_1', '5'),
+            lambda: self.cache.decr('Local_1'),
+            lambda: self.cache.flush_all(),
+        ]
+        self.cache.set('Local_1', '6')
+        for write in writes:
+            self.cache.get('Local_1')
+            write()
+            self.assertEquals(self.cache.get('Local_1'),
+                              self.remote.get('Local_1'))
+
+    def test_allow_local(self):
+        self.remote.set('Local_1', 'a')
+        self.assertEquals(self.cache.get('Local_1'), 'a')
+        self.remote.set('Local_1', 'b')
+        self.assertEquals(self.cache.get('Local_1'), 'a')
+        self.assertEquals(self.cache.get('Local_1', allow_local=False), 'b')
+        self.remote.set('Local_1', 'c')
+        self.assertEquals(self.cache.get_multi(['Local_1'], allow_local=False),
+                          {'Local_1': 'c'})
+        # the latest copy replaces the stale one
+        self.assertEquals(self.cache.get('Local_1'), 'c')
+
+    def test_chains_skip_local_tier(self):
+        chains = [MemcacheChain((LocalCache(), self.cache)),
+                  StaleCacheChain(LocalCache(), LocalCache(), self.cache)]
+        for i, chain in enumerate(chains):
+            key = 'Local_%d' % i
+            self.remote.set(key, 'a')
+            self.cache.get(key)
+            self.remote.set(key, 'b')
+            self.assertEquals(chain.get(key, allow_local=False), 'b')
+            self.remote.set(key, 'c')
+            self.assertEquals(chain.get_multi([key], allow_local=False),
+                              {key: 'c'})
+
+    def test_peers_are_invalidated(self):
+        hub = MemoryInvalidationHub()
+        remote = LocalCache()
+        tiers = [LocalTierCache(LRUCache(), remote, ['Local_'],
+                                bus=InMemoryInvalidationBus(hub))
+                 for i in xrange(3)]
+
+        tiers[0].set('Local_1', 'a')
+        for tier in tiers:
+            self.assertEquals(tier.get('Local_1'), 'a')
+
+        tiers[1].set('Local_1', 'b')
+        for tier in tiers:
+            self.assertEquals(tier.get('Local_1'), 'b')
+
+        tiers[2].delete('Local_1')
+        for tier in tiers:
+            self.assertEquals(tier.get('Local_1'), None)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+import random
+import struct
+import unittest
+
+from r2.lib.db import _sorts, batch_sorts
+
+
+def same(a, b):
+    # compare the exact bits of floats, so that e.g. 0.0 and -0.0 differ
+    if isinstance(a, float) and isinstance(b, float):
+        return struct.pack('<d', a) == struct.pack('<d', b)
+    return type(a) == type(b) and a == b
+
+
+class BatchSortsTest(unittest.TestCase):
+    def setUp(self):
+        rand = random.Random(1)
+        self.ups, self.downs, self.dates = [], [], []
+
+        # all of confidence's precomputed range, and a bit beyond
+        for ups in xrange(0, 450, 3):
+            for downs in xrange(0, 120):
+                self.ups.append(ups)
+                self.downs.append(downs)
+                self.dates.append(rand.uniform(1.1e9, 1.5e9))
+
+        for i in xrange(20000):
+            self.ups.append(int(rand.expovariate(1e-3)))
+            self.downs.append(int(rand.expovariate(3e-3)))
+            self.dates.append(rand.uniform(1.1e9, 1.5e9))
+
+    def assertIdentical(self, batch, scalar, *args):
+        expected = [scalar(*a) for a in zip(*args)]
+        got = batch(*args)
+        self.assertEquals(len(got), len(expected))
+        for i, (g, e) in enumerate(zip(got, expected)):
+            if not same(g, e):
+                self.fail("%r != %r for %r" % (g, e, [a[i] for a in args]))
+
+    def test_score(self):
+        self.assertIdentical(batch_sorts.scores, _sorts.score,
+                             self.ups, self.downs)
+
+    def test_controversy(self):
+        self.assertIdentical(batch_sorts.controversies, _sorts.controversy,
+                             self.ups, self.downs)
+
+    def test_confidence(self):
+        self.assertIdentical(batch_sorts.confidences, _sorts.confidence,
+                             self.ups, self.downs)
+
+    def test_hot(self):
+        self.assertIdentical(batch_sorts.hots, _sorts._hot,
+                             self.ups, self.downs, self.dates)
+
+    def test_empty(self):
+        self.assertEquals(batch_sorts.hots([], [], []), [])
+        self.assertEquals(batch_sorts.confidences([], []), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
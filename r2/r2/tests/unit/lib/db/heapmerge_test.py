@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+import datetime
+import unittest
+
+from r2.lib.db import heapmerge
+from r2.lib.db.operators import asc, desc
+
+
+class Item(object):
+    def __init__(self, name, score, date):
+        self.name = name
+        self._score = score
+        self._date = date
+
+    def __repr__(self):
+        return "<Item %s>" % self.name
+
+
+class SortKeyTest(unittest.TestCase):
+    def test_mixed_sorts(self):
+        day = datetime.timedelta(days=1)
+        now = datetime.datetime(2013, 1, 1)
+        items = [Item("a", 1, now), Item("b", 2, now),
+                 Item("c", 2, now - day), Item("d", 1, now + day)]
+        key = heapmerge.make_sort_key([desc("_score"), asc("_date")])
+        self.assertEquals(["c", "b", "a", "d"],
+                          [i.name for i in sorted(items, key=key)])
+
+        key = heapmerge.make_sort_key([asc("_score"), desc("_date")])
+        self.assertEquals(["d", "a", "b", "c"],
+                          [i.name for i in sorted(items, key=key)])
+
+    def test_tuple_sort_key(self):
+        tuples = [("t3_1", 5, 2.0), ("t3_2", 5, 3.0), ("t3_3", 7, 1.0)]
+        key = heapmerge.make_tuple_sort_key([desc("_score"), desc("_date")])
+        self.assertEquals(["t3_3", "t3_2", "t3_1"],
+                          [t[0] for t in sorted(tuples, key=key)])
+
+
+class MergeTest(unittest.TestCase):
+    def test_merge(self):
+        key = heapmerge.make_tuple_sort_key([desc("_score")])
+        streams = [
+            [("a", 9), ("b", 4), ("c", 1)],
+            [],
+            [("d", 8), ("e", 4)],
+            [("f", 10)],
+        ]
+        merged = list(heapmerge.merge(streams, key))
+        self.assertEquals(["f", "a", "d", "b", "e", "c"],
+                          [t[0] for t in merged])
+
+    def test_merge_is_lazy(self):
+        def stream():
+            yield ("a", 2)
+            yield ("b", 1)
+            raise AssertionError("read too far")
+
+        key = heapmerge.make_tuple_sort_key([desc("_score")])
+        merged = heapmerge.merge([stream(), [("c", 3)]], key)
+        self.assertEquals(("c", 3), next(merged))
+        self.assertEquals(("a", 2), next(merged))
+
+    def test_no_sort(self):
+        merged = heapmerge.merge([[3, 2], [1]], lambda item: ())
+        self.assertEquals([3, 2, 1], list(merged))
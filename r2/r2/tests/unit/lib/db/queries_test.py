@@ -0,0 +1,441 @@
+#!/usr/bin/env python
+
+import cPickle as pickle
+import itertools
+import random
+import unittest
+
+from pylons import g
+
+from r2.lib.db import queries
+from r2.lib.db.thing import NotFound
+from r2.lib.db.operators import desc
+
+
+class FakeThing(object):
+    def __init__(self, fullname):
+        self._fullname = fullname
+
+    def __repr__(self):
+        return "<%s %s>" % (self.__class__.__name__, self._fullname)
+
+
+class FakeLink(FakeThing):
+    pass
+
+
+class FakeComment(FakeThing):
+    pass
+
+
+class FakeLoader(object):
+    """Stands in for Account._byID / Thing._by_fullname."""
+
+    def __init__(self, make):
+        self.make = make
+        self.calls = []
+        self.missing = set()
+
+    def __call__(self, ids, data=False):
+        if not isinstance(ids, list):
+            if ids in self.missing:
+                raise NotFound
+            return self.make(ids)
+
+        ids = set(ids)
+        self.calls.append(ids)
+        if ids & self.missing:
+            raise NotFound
+        return dict((i, self.make(i)) for i in ids)
+
+
+class FakeQuery(object):
+    def __init__(self, iden):
+        self.iden = iden
+        self.inserts = []
+
+    def can_insert(self):
+        return True
+
+    def insert(self, items):
+        self.inserts.append([item._fullname for item in items])
+
+
+class FakeMutator(object):
+    def __init__(self):
+        self.inserts = []
+        self.sends = 0
+
+    def insert(self, query, things):
+        self.inserts.append((query, [thing._fullname for thing in things]))
+
+    def send(self):
+        self.sends += 1
+
+
+class FakeAmqp(object):
+    def handle_items(self, qname, fn, limit, verbose):
+        self.handler = fn
+
+
+class FakeMessage(object):
+    def __init__(self, *vote):
+        self.body = pickle.dumps(vote)
+
+
+class FakePermacache(object):
+    def __init__(self):
+        self.data = {}
+        self.writes = []
+        self.expiring = {}
+
+    def get(self, key, default=None, **kw):
+        return self.data.get(key, default)
+
+    def get_multi(self, keys, **kw):
+        return dict((key, self.data[key]) for key in keys
+                    if key in self.data)
+
+    def set_multi(self, values, time=0):
+        if time:
+            self.expiring.update(values)
+        else:
+            self.writes.extend(values)
+        self.data.update(values)
+
+    def mutate(self, key, fn, default=None, willread=True):
+        value = fn(self.data.get(key, default) if willread else None)
+        self.writes.append(key)
+        self.data[key] = value
+        return value
+
+
+class ListingQuery(object):
+    _sort = [desc("_score"), desc("_date")]
+    _rules = []
+
+    def __init__(self, iden):
+        self.iden = iden
+
+    def _iden(self):
+        return self.iden
+
+
+class Item(object):
+    def __init__(self, fullname, score, date):
+        self._fullname = fullname
+        self._score = score
+        self._date = date
+
+
+class QueriesTestCase(unittest.TestCase):
+    def patch(self, name, value):
+        self.addCleanup(setattr, queries, name, getattr(queries, name))
+        setattr(queries, name, value)
+
+
+class QueryBatchTest(QueriesTestCase):
+    def setUp(self):
+        self.patch("CachedQueryMutator", FakeMutator)
+
+    def test_each_query_mutated_once(self):
+        hot, top = FakeQuery("hot"), FakeQuery("top")
+        hot.new_query = "new hot"
+        a, b = FakeLink("t3_a"), FakeLink("t3_b")
+
+        batch = queries.QueryBatch()
+        batch.add_queries([hot, top], insert_items=a)
+        batch.add_queries([hot], insert_items=[b, a])
+        batch.add_queries([top], insert_items=b)
+        batch.send()
+
+        self.assertEquals(hot.inserts, [["t3_a", "t3_b"]])
+        self.assertEquals(top.inserts, [["t3_a", "t3_b"]])
+        self.assertEquals(batch.mutator.inserts,
+                          [("new hot", ["t3_a", "t3_b"])])
+        self.assertEquals(batch.mutator.sends, 1)
+
+        # sending again doesn't repeat the mutations
+        batch.send()
+        self.assertEquals(hot.inserts, [["t3_a", "t3_b"]])
+
+
+class ProcessVotesTest(QueriesTestCase):
+    def setUp(self):
+        self.voters = FakeLoader(FakeThing)
+        self.votees = FakeLoader(lambda fullname:
+            FakeComment(fullname) if fullname.startswith("t1_")
+            else FakeLink(fullname))
+        self.handled = []
+        self.updated_comments = []
+        self.batches = []
+
+        def handle_vote(voter, votee, dir, ip, organic, cheater=False,
+                        foreground=False, timer=None, batch=None):
+            self.batches.append(batch)
+            self.handled.append((voter._fullname, votee._fullname, dir))
+
+        def update_comment_votes(comments):
+            self.updated_comments.append(
+                sorted(comment._fullname for comment in comments))
+
+        class FakeAccount(object):
+            _byID = self.voters
+
+        class FakeThingCls(object):
+            _by_fullname = self.votees
+
+        self.patch("Account", FakeAccount)
+        self.patch("Thing", FakeThingCls)
+        self.patch("Link", FakeLink)
+        self.patch("Comment", FakeComment)
+        self.patch("handle_vote", handle_vote)
+        self.patch("update_comment_votes", update_comment_votes)
+        self.patch("CachedQueryMutator", FakeMutator)
+        self.patch("amqp", FakeAmqp())
+
+        queries.process_votes("vote_comment_q", limit=100)
+        self.handler = queries.amqp.handler
+
+    def test_batch(self):
+        msgs = [
+            FakeMessage(1, "t3_a", True, "ip", False, False),
+            FakeMessage(2, "t1_b", False, "ip", False, False),
+            FakeMessage(1, "t3_a", None, "ip", False, False),
+            FakeMessage(1, "t1_b", True, "ip", False, False),
+            FakeMessage(1, "t3_a", False, "ip", False, False),
+        ]
+        self.handler(msgs, None)
+
+        # repeated votes collapse to the last one queued
+        self.assertEquals(sorted(self.handled),
+                          [(1, "t1_b", True),
+                           (1, "t3_a", False),
+                           (2, "t1_b", False)])
+
+        # voters and votees are loaded once for the whole batch
+        self.assertEquals(self.voters.calls, [set([1, 2])])
+        self.assertEquals(self.votees.calls, [set(["t3_a", "t1_b"])])
+
+        # with one QueryBatch, and the comments updated once
+        self.assertEquals(len(set(map(id, self.batches))), 1)
+        self.assertTrue(isinstance(self.batches[0], queries.QueryBatch))
+        self.assertEquals(self.updated_comments, [["t1_b"]])
+
+    def test_missing_things(self):
+        self.voters.missing.add(2)
+        self.votees.missing.add("t3_gone")
+        msgs = [
+            FakeMessage(1, "t3_a", True, "ip", False, False),
+            FakeMessage(2, "t1_b", False, "ip", False, False),
+            FakeMessage(1, "t3_gone", True, "ip", False, False),
+        ]
+        self.handler(msgs, None)
+
+        # the rest of the batch is still handled
+        self.assertEquals(self.handled, [(1, "t3_a", True)])
+        self.assertEquals(self.updated_comments, [])
+
+
+class ListingTestCase(QueriesTestCase):
+    def setUp(self):
+        self.permacache = FakePermacache()
+        self.patch("query_cache", self.permacache)
+        self.addCleanup(setattr, g, "chunked_listings",
+                        getattr(g, "chunked_listings", False))
+
+    def results(self, iden):
+        return queries.CachedResults(ListingQuery(iden),
+                                     queries.filter_identity)
+
+    def chunk_keys(self, iden):
+        return queries._chunk_keys(iden, self.permacache.data[iden])
+
+    def store(self, iden, tuples, chunked):
+        g.chunked_listings = chunked
+        tuples = sorted(tuples, key=lambda t: (-t[1], -t[2]))
+        self.results(iden)._replace(tuples)
+        return tuples
+
+
+class IterAfterTest(ListingTestCase):
+    def assertMatchesFullMerge(self, idens, after):
+        full = queries.MergedCachedResults([self.results(iden)
+                                            for iden in idens]).data
+        expected = list(queries._names_after(full, after))
+
+        if len(idens) == 1:
+            listing = self.results(idens[0])
+        else:
+            listing = queries.MergedCachedResults([self.results(iden)
+                                                   for iden in idens])
+        self.assertEquals(list(listing.iter_after(after)), expected)
+        return expected
+
+    def test_matches_full_merge(self):
+        rand = random.Random(0)
+        for trial in xrange(50):
+            idens = ["trial%d/%d" % (trial, i)
+                     for i in xrange(rand.randint(1, 4))]
+            stored = []
+            for i, iden in enumerate(idens):
+                # few distinct values, so there are ties across listings
+                tuples = [("t3_%s_%d" % (iden, n), rand.randint(0, 5),
+                           float(rand.randint(0, 5)))
+                          for n in xrange(rand.randint(0, 130))]
+                # mix chunked and unchunked storage
+                stored.extend(self.store(iden, tuples, rand.random() < .7))
+
+            self.assertMatchesFullMerge(idens, None)
+            for t in rand.sample(stored, min(len(stored), 5)):
+                self.assertMatchesFullMerge(idens, Item(*t))
+
+                # after's score has changed since it was stored
+                drifted = Item(t[0], t[1] + rand.choice([-2, 2]), t[2])
+                self.assertMatchesFullMerge(idens, drifted)
+
+    def test_ties_across_listings(self):
+        for chunked in (True, False):
+            self.store("a", [("t3_a%d" % i, 1, 1.0) for i in xrange(60)],
+                       chunked)
+            self.store("b", [("t3_b%d" % i, 1, 1.0) for i in xrange(60)],
+                       chunked)
+            expected = self.assertMatchesFullMerge(["a", "b"],
+                                                   Item("t3_a55", 1, 1.0))
+            self.assertEquals(expected[:5], ["t3_a56", "t3_a57", "t3_a58",
+                                             "t3_a59", "t3_b0"])
+
+    def test_after_not_in_listing(self):
+        for chunked in (True, False):
+            self.store("a", [("t3_a%d" % i, i, 1.0) for i in xrange(120)],
+                       chunked)
+            self.store("b", [("t3_b%d" % i, i, 2.0) for i in xrange(120)],
+                       chunked)
+            gone = Item("t3_gone", 60, 1.0)
+            self.assertEquals(self.assertMatchesFullMerge(["a", "b"], gone),
+                              [])
+
+    def test_reads_only_needed_chunks(self):
+        self.store("a", [("t3_a%d" % i, i, 1.0) for i in xrange(500)], True)
+        listing = self.results("a").iter_after(None)
+        self.assertEquals(list(itertools.islice(listing, 3)),
+                          ["t3_a499", "t3_a498", "t3_a497"])
+
+        reads = []
+        get_multi = self.permacache.get_multi
+        def counting_get_multi(keys, **kw):
+            keys = list(keys)
+            reads.extend(keys)
+            return get_multi(keys, **kw)
+        self.permacache.get_multi = counting_get_multi
+        list(itertools.islice(self.results("a").iter_after(None), 10))
+        self.assertEquals(reads, ["a", self.chunk_keys("a")[0]])
+
+
+class ChunkedWriteTest(ListingTestCase):
+    def stored(self, iden):
+        cr = self.results(iden)
+        cr.fetch()
+        return cr.data
+
+    def test_chunk_boundaries(self):
+        tuples = self.store("a", [("t3_%d" % i, i * 2, 1.0)
+                                  for i in xrange(120)], True)
+        head = self.permacache.data["a"]
+        self.assertEquals(head["count"], 120)
+        self.assertEquals(head["bounds"], [tuples[49], tuples[99],
+                                           tuples[119]])
+        keys = self.chunk_keys("a")
+        self.assertEquals([len(self.permacache.data[key]) for key in keys],
+                          [50, 50, 20])
+
+        # inserting at the end only writes a new last chunk, and the one it
+        # replaces is left to expire
+        del self.permacache.writes[:]
+        self.results("a").insert(Item("t3_last", -1, 1.0))
+        new_keys = self.chunk_keys("a")
+        self.assertEquals(new_keys[:2], keys[:2])
+        self.assertNotEquals(new_keys[2], keys[2])
+        self.assertEquals(sorted(self.permacache.writes),
+                          sorted(["a", new_keys[2]]))
+        self.assertEquals(self.permacache.expiring.keys(), [keys[2]])
+        self.assertEquals(self.permacache.data["a"]["bounds"][-1][0],
+                          "t3_last")
+
+        # inserting at the start moves an item across every boundary
+        keys = new_keys
+        del self.permacache.writes[:]
+        self.permacache.expiring.clear()
+        self.results("a").insert(Item("t3_first", 1000, 1.0))
+        new_keys = self.chunk_keys("a")
+        self.assertFalse(set(keys) & set(new_keys))
+        self.assertEquals(sorted(self.permacache.writes),
+                          sorted(["a"] + new_keys))
+        self.assertEquals(sorted(self.permacache.expiring), sorted(keys))
+        expected = ([("t3_first", 1000, 1.0)] + tuples +
+                    [("t3_last", -1, 1.0)])
+        self.assertEquals(self.stored("a"), expected)
+        self.assertEquals(self.permacache.data["a"]["bounds"],
+                          [expected[49], expected[99], expected[121]])
+
+        # shrinking below a boundary drops the chunk from the head
+        self.results("a").delete([Item(t[0], t[1], t[2])
+                                  for t in expected[:30]])
+        self.assertEquals(self.permacache.data["a"]["count"], 92)
+        self.assertEquals(len(self.permacache.data["a"]["bounds"]), 2)
+        self.assertEquals(self.stored("a"), expected[30:])
+
+    def test_switching_storage(self):
+        tuples = self.store("a", [("t3_%d" % i, i, 1.0)
+                                  for i in xrange(70)], False)
+        self.assertEquals(self.permacache.data["a"], tuples)
+
+        g.chunked_listings = True
+        self.results("a").insert(Item("t3_new", 100, 1.0))
+        self.assertTrue(queries._is_chunked(self.permacache.data["a"]))
+        self.assertEquals(self.stored("a"), [("t3_new", 100, 1.0)] + tuples)
+
+        g.chunked_listings = False
+        self.results("a").delete(Item("t3_new", 100, 1.0))
+        self.assertEquals(self.permacache.data["a"], tuples)
+
+    def test_replace_multi(self):
+        g.chunked_listings = True
+        a = [("t3_a%d" % i, 100 - i, 1.0) for i in xrange(60)]
+        b = [("t3_b%d" % i, 100 - i, 1.0) for i in xrange(10)]
+        queries.CachedResults._replace_multi([(self.results("a"), a),
+                                              (self.results("b"), b)])
+        # heads are written after the chunks they point at
+        heads = [i for i, key in enumerate(self.permacache.writes)
+                 if "/" not in key]
+        self.assertEquals(heads, [3, 4])
+        self.assertEquals(self.stored("a"), a)
+        self.assertEquals(self.stored("b"), b)
+
+        # replacing again writes new chunks only where they changed
+        keys = self.chunk_keys("a") + self.chunk_keys("b")
+        b2 = b + [("t3_b10", 1, 1.0)]
+        queries.CachedResults._replace_multi([(self.results("a"), a),
+                                              (self.results("b"), b2)])
+        self.assertEquals(self.chunk_keys("a"), keys[:2])
+        self.assertNotEquals(self.chunk_keys("b"), keys[2:])
+        self.assertEquals(self.permacache.expiring.keys(), keys[2:])
+        self.assertEquals(self.stored("b"), b2)
+
+    def test_reader_with_old_head(self):
+        tuples = self.store("a", [("t3_%d" % i, i, 1.0)
+                                  for i in xrange(120)], True)
+        reader = self.results("a")
+        queries.CachedResults._fetch_heads([reader])
+        cursor = queries._ChunkCursor(reader)
+
+        # the listing changes between the reader getting the head and
+        # getting the chunks it points at
+        self.results("a").insert(Item("t3_new", 1000, 1.0))
+        self.assertEquals(list(cursor.items()), tuples)
+        self.assertEquals(list(self.results("a").iter_after(None)),
+                          ["t3_new"] + [t[0] for t in tuples])
+
+
+if __name__ == '__main__':
+    unittest.main()
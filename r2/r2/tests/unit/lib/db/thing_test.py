@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+import unittest
+
+from r2.lib.cache import LocalCache, LocalTierCache, LRUCache, MemcacheChain
+from r2.lib.db import thing
+
+
+class FakeThing(object):
+    _id = 1
+
+    def __init__(self, version):
+        self.version = version
+
+    def _cache_key(self):
+        return "Subreddit_1"
+
+    _other_self = thing.DataThing._other_self.im_func
+
+
+class OtherSelfTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = thing.cache
+        self.remote = LocalCache()
+        self.tier = LocalTierCache(LRUCache(), self.remote, ["Subreddit_"])
+
+    def tearDown(self):
+        thing.cache = self.saved
+
+    def new_request(self):
+        thing.cache = MemcacheChain((LocalCache(), self.tier))
+
+    def test_skips_stale_local_tier(self):
+        self.remote.set("Subreddit_1", FakeThing(1))
+        self.new_request()
+        self.assertEquals(thing.cache.get("Subreddit_1").version, 1)
+
+        # another process commits, leaving this one's local tier stale
+        self.remote.set("Subreddit_1", FakeThing(2))
+        self.new_request()
+        self.assertEquals(thing.cache.get("Subreddit_1").version, 1)
+        self.assertEquals(FakeThing(3)._other_self().version, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+
+import random
+import time
+import unittest
+
+from pylons import g
+
+import r2.models
+from r2.lib import frontpage
+from r2.lib._normalized_hot import get_hot
+from r2.lib.db import queries
+from r2.lib.db.operators import desc
+
+
+DAY = 60 * 60 * 24
+
+
+class FakeCache(dict):
+    def __init__(self):
+        self.adds = []
+
+    def get(self, key, default=None):
+        return dict.get(self, key, default)
+
+    def get_multi(self, keys, prefix=''):
+        return dict((key, self[prefix + str(key)]) for key in keys
+                    if prefix + str(key) in self)
+
+    def set(self, key, val, time=0):
+        self[key] = val
+
+    def add(self, key, val, time=0):
+        if key in self:
+            return False
+        self[key] = val
+        return True
+
+    def add_multi(self, values, prefix='', time=0):
+        for key, val in values.iteritems():
+            self.adds.append(key)
+            self.add(prefix + str(key), val)
+
+    def delete(self, key):
+        self.pop(key, None)
+
+
+class FakeCounter(object):
+    def __init__(self):
+        self.counts = {}
+
+    def increment(self, name, delta=1):
+        self.counts[name] = self.counts.get(name, 0) + delta
+
+
+class FakeStats(object):
+    def __init__(self):
+        self.counter = FakeCounter()
+
+    def get_counter(self, name):
+        return self.counter if name == 'frontpage' else None
+
+
+class ListingQuery(object):
+    _sort = [desc("_hot"), desc("_date")]
+    _rules = []
+
+    def __init__(self, iden):
+        self.iden = iden
+
+    def _iden(self):
+        return self.iden
+
+
+class FakeSubreddit(object):
+    def __init__(self, _id, tuples):
+        self._id = _id
+        self.tuples = tuples
+
+    def get_links(self, sort, time):
+        results = queries.CachedResults(ListingQuery('sr%d' % self._id),
+                                        queries.filter_identity)
+        results.data = self.tuples
+        results._fetched = True
+        return results
+
+
+class FrontPageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.saved = (g.cache, g.lock_cache, g.stats, g.page_cache_time,
+                      g.HOT_PAGE_AGE, frontpage.max_links,
+                      r2.models.Subreddit, queries.get_links)
+        g.cache = FakeCache()
+        g.lock_cache = FakeCache()
+        g.stats = FakeStats()
+        g.page_cache_time = 90
+        g.HOT_PAGE_AGE = 1000
+        self.srs = {}
+
+        class Subreddit(object):
+            @staticmethod
+            def _byID(ids, return_dict=True):
+                return [self.srs[_id] for _id in ids]
+
+        r2.models.Subreddit = Subreddit
+        queries.get_links = lambda sr, sort, time: sr.get_links(sort, time)
+
+    def tearDown(self):
+        (g.cache, g.lock_cache, g.stats, g.page_cache_time, g.HOT_PAGE_AGE,
+         frontpage.max_links, r2.models.Subreddit,
+         queries.get_links) = self.saved
+
+    @property
+    def counts(self):
+        return g.stats.counter.counts
+
+    def add_sr(self, _id, tuples):
+        # hot listings are sorted hottest first
+        tuples = sorted(tuples, key=lambda t: (-t[1], -t[2]))
+        self.srs[_id] = FakeSubreddit(_id, tuples)
+        return tuples
+
+    def old_hot(self, sr_ids, obey_age_limit=True):
+        srs = [self.srs[sr_id] for sr_id in sr_ids]
+        return get_hot(srs, True, obey_age_limit)[:frontpage.max_links]
+
+
+class MaterializeTest(FrontPageTestCase):
+    def test_matches_get_hot(self):
+        rand = random.Random(0)
+        now = time.time()
+        for trial in xrange(20):
+            g.cache.clear()
+            frontpage.max_links = rand.choice([5, 50, 1000])
+            sr_ids = range(trial * 10, trial * 10 + rand.randint(1, 8))
+            for sr_id in sr_ids:
+                # few distinct scores, so links tie on ehot and hot, and
+                # ages on both sides of the age limit
+                self.add_sr(sr_id, [
+                    ("t3_%d_%d" % (sr_id, n), float(rand.randint(0, 6)),
+                     now - rand.choice([1, 500, 2000]) * DAY)
+                    for n in xrange(rand.randint(0, 200))])
+
+            for obey_age_limit in (True, False):
+                self.assertEquals(
+                    frontpage.get_front_page(sr_ids, obey_age_limit),
+                    self.old_hot(sr_ids, obey_age_limit))
+
+    def test_ties_on_ehot(self):
+        now = time.time()
+        self.add_sr(1, [("t3_a", 10., now), ("t3_b", 5., now)])
+        self.add_sr(2, [("t3_c", 20., now), ("t3_d", 10., now)])
+        self.add_sr(3, [("t3_e", 20., now), ("t3_f", 10., now)])
+
+        # the top links all have an ehot of 1, ordered by hot then by
+        # fullname, and b, d and f all have an ehot of .5
+        expected = ["t3_e", "t3_c", "t3_a", "t3_f", "t3_d", "t3_b"]
+        self.assertEquals(self.old_hot([1, 2, 3]), expected)
+        self.assertEquals(frontpage.get_front_page([1, 2, 3]), expected)
+
+    def test_age_limit(self):
+        now = time.time()
+        self.add_sr(1, [("t3_old", 100., now - 2000 * DAY),
+                        ("t3_new", 50., now)])
+        self.assertEquals(frontpage.get_front_page([1]), ["t3_new"])
+        self.assertEquals(frontpage.get_front_page([1], False),
+                          ["t3_old", "t3_new"])
+        self.assertEquals(self.old_hot([1]), ["t3_new"])
+
+    def test_max_links(self):
+        frontpage.max_links = 3
+        now = time.time()
+        self.add_sr(1, [("t3_%d" % i, float(i), now) for i in xrange(10)])
+        self.assertEquals(frontpage.get_front_page([1]),
+                          ["t3_9", "t3_8", "t3_7"])
+
+    def test_rebuilds_missing_streams(self):
+        now = time.time()
+        self.add_sr(1, [("t3_a", 10., now)])
+        self.add_sr(2, [("t3_b", 20., now)])
+        self.assertEquals(frontpage.get_front_page([1, 2]), ["t3_b", "t3_a"])
+        self.assertEquals(sorted(g.cache.adds), [1, 2])
+
+        # a stream written while the listings are read is more recent than
+        # the one built from them, and the page is redone
+        g.cache.clear()
+        get_links = self.srs[2].get_links
+        def racing_get_links(sort, time):
+            frontpage.update_sr_links(2, [("t3_c", 30., now)])
+            return get_links(sort, time)
+        self.srs[2].get_links = racing_get_links
+
+        self.assertEquals(frontpage.get_front_page([1, 2]), ["t3_b", "t3_a"])
+        self.assertEquals(g.cache[frontpage.SR_LINKS_PREFIX + '2'][0][2],
+                          "t3_c")
+        self.assertEquals(frontpage.get_front_page([1, 2]), ["t3_c", "t3_a"])
+        self.assertEquals(self.counts['sr_computed'], 4)
+        self.assertEquals(self.counts['sr_reused'], 2)
+
+    def test_shares_streams(self):
+        now = time.time()
+        for sr_id in (1, 2, 3):
+            self.add_sr(sr_id, [("t3_%d" % sr_id, float(sr_id), now)])
+
+        frontpage.get_front_page([1, 2])
+        frontpage.get_front_page([1, 2])
+        frontpage.get_front_page([2, 3])
+        self.assertEquals(self.counts, {'read': 3, 'materialize': 2,
+                                              'sr_computed': 3,
+                                              'sr_reused': 1})
+
+
+class RefreshTest(FrontPageTestCase):
+    def setUp(self):
+        FrontPageTestCase.setUp(self)
+        self.now = time.time()
+        self.add_sr(1, [("t3_a", 10., self.now)])
+        self.add_sr(2, [("t3_b", 20., self.now)])
+        self.assertEquals(frontpage.get_front_page([1, 2]), ["t3_b", "t3_a"])
+
+    def test_refreshed_when_a_stream_changes(self):
+        self.assertEquals(frontpage.get_front_page([1, 2]), ["t3_b", "t3_a"])
+        self.assertEquals(self.counts['materialize'], 1)
+
+        frontpage.update_sr_links(1, [("t3_c", 30., self.now),
+                                      ("t3_a", 10., self.now)])
+        self.assertEquals(frontpage.get_front_page([1, 2]),
+                          ["t3_c", "t3_b", "t3_a"])
+        self.assertEquals(self.counts['materialize'], 2)
+
+        # sets not including the subreddit aren't affected
+        frontpage.get_front_page([2])
+        frontpage.update_sr_links(1, [("t3_a", 10., self.now)])
+        frontpage.get_front_page([2])
+        self.assertEquals(self.counts['materialize'], 3)
+
+    def test_refreshed_when_old(self):
+        key = frontpage._front_page_key([1, 2], True)
+        versions, materialized, fullnames = g.cache[key]
+        g.cache[key] = (versions, materialized - g.page_cache_time, [])
+        self.assertEquals(frontpage.get_front_page([1, 2]), ["t3_b", "t3_a"])
+
+    def test_stale_while_refreshing(self):
+        frontpage.update_sr_links(1, [("t3_c", 30., self.now)])
+        key = frontpage._front_page_key([1, 2], True)
+        g.lock_cache.add('frontpage_lease(%s)' % key, 1)
+
+        self.assertEquals(frontpage.get_front_page([1, 2]), ["t3_b", "t3_a"])
+        self.assertEquals(self.counts['stale'], 1)
+
+        g.lock_cache.clear()
+        self.assertEquals(frontpage.get_front_page([1, 2]), ["t3_c", "t3_b"])
+        self.assertFalse(g.lock_cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
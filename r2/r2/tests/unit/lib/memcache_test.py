@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+import socket
+import unittest
+
+from r2.lib.contrib import memcache
+
+
+class FakeHost(object):
+    def __init__(self):
+        self.buffer = ''
+
+
+class ResponseParsingTest(unittest.TestCase):
+    def setUp(self):
+        self.client = memcache.Client([])
+
+    def test_get_response_across_reads(self):
+        server = FakeHost()
+        retvals = {}
+        response = memcache._GetResponse(self.client, server,
+                                         {'pk1': 'k1', 'pk2': 'k2'}, retvals)
+
+        data = 'VALUE pk1 0 3\r\nabc\r\nVALUE pk2 2 2\r\n42\r\nEND\r\n'
+        for i, c in enumerate(data):
+            server.buffer += c
+            done = response.feed()
+            self.assertEquals(done, i == len(data) - 1)
+
+        self.assertEquals(retvals, {'k1': 'abc', 'k2': 42})
+        self.assertEquals(server.buffer, '')
+
+    def test_store_response(self):
+        server = FakeHost()
+        notstored = []
+        response = memcache._StoreResponse(server, ['pk1', 'pk2', 'pk3'],
+                                           {'pk1': 'k1', 'pk2': 'k2',
+                                            'pk3': 'k3'},
+                                           notstored)
+
+        server.buffer = 'STORED\r\nNOT_STORED\r\n'
+        self.assertFalse(response.feed())
+        response.abandon()
+        self.assertEquals(notstored, ['k2', 'k3'])
+
+
+class HostHealthTest(unittest.TestCase):
+    def test_backoff(self):
+        host = memcache._Host('127.0.0.1:11211')
+        host.mark_dead('first')
+        first = host.deaduntil
+        host.mark_dead('second')
+        self.assertEquals(host.failures, 2)
+        self.assertEquals(host.last_error, 'second')
+        self.assertTrue(host.deaduntil > first)
+
+        host.mark_alive()
+        self.assertEquals(host.failures, 0)
+        self.assertFalse(host._check_dead())
+
+    def test_connect_resets_failures(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        try:
+            host = memcache._Host('127.0.0.1:%d' % listener.getsockname()[1])
+            host.mark_dead('unrelated error')
+            host.deaduntil = 0
+            self.assertTrue(host.connect())
+            self.assertEquals(host.failures, 0)
+            host.close_socket()
+        finally:
+            listener.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+import random
+import unittest
+from collections import defaultdict
+
+from r2.lib.mr_tools import mr_max_per_key_parallel
+
+
+def process(lines):
+    for line in lines:
+        key, value, name = line.strip('\n').split('\t')
+        yield key, (int(value), name)
+
+
+class MaxPerKeyParallelTest(unittest.TestCase):
+    def test_max_per_key(self):
+        rand = random.Random(0)
+        lines = ['k%d\t%d\tn%d\n' % (rand.randint(0, 20),
+                                     rand.randint(0, 1000), i)
+                 for i in xrange(5000)]
+
+        expected = defaultdict(list)
+        for key, item in process(lines):
+            expected[key].append(item)
+        for key, items in expected.items():
+            expected[key] = sorted(items, reverse=True)[:10]
+
+        batches = []
+        mr_max_per_key_parallel(process, batches.append, num=10,
+                                fd=iter(lines), workers=3, chunk_size=100,
+                                post_size=4)
+
+        got = {}
+        for batch in batches:
+            self.assertTrue(len(batch) <= 4)
+            got.update(batch)
+        self.assertEquals(got, dict(expected))
+
+    def test_empty(self):
+        batches = []
+        mr_max_per_key_parallel(process, batches.append, fd=iter([]),
+                                workers=2)
+        self.assertEquals(batches, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+import unittest
+
+from r2.lib import pagecache
+
+
+class FakeResponse(object):
+    def __init__(self, body, content_type, headers=()):
+        self.body = body
+        self.status_int = 200
+        self.headerlist = [('Content-Type', content_type),
+                           ('Content-Length', str(len(body)))]
+        self.headerlist.extend(headers)
+
+
+class PageCacheTest(unittest.TestCase):
+    def test_compresses_html(self):
+        body = '<html>%s</html>' % ('hello ' * 100)
+        response = FakeResponse(body, 'text/html; charset=UTF-8',
+                                [('Vary', 'Cookie')])
+        page, stored = pagecache.make_page(response, cookies={})
+
+        self.assertTrue(page.gzipped)
+        self.assertTrue(len(stored) < len(body))
+        self.assertEquals(body, pagecache.gzip_decompress(stored))
+        headers = dict(page.headerlist)
+        self.assertEquals(page.etag, headers['ETag'])
+        self.assertEquals('cookie, accept-encoding', headers['Vary'])
+        self.assertTrue('Content-Length' not in headers)
+
+    def test_leaves_other_types_alone(self):
+        response = FakeResponse('\x89PNG', 'image/png')
+        page, stored = pagecache.make_page(response, cookies={})
+        self.assertFalse(page.gzipped)
+        self.assertEquals('\x89PNG', stored)
+
+    def test_identical_bodies_share_storage(self):
+        a, _ = pagecache.make_page(FakeResponse('same', 'text/html'), {})
+        b, _ = pagecache.make_page(FakeResponse('same', 'text/plain'), {})
+        c, _ = pagecache.make_page(FakeResponse('other', 'text/html'), {})
+        self.assertEquals(a.body_key, b.body_key)
+        self.assertNotEquals(a.body_key, c.body_key)
+
+        # but not when one copy is stored gzipped and the other isn't
+        d, _ = pagecache.make_page(FakeResponse('same', 'image/png'), {})
+        self.assertFalse(d.gzipped)
+        self.assertNotEquals(a.body_key, d.body_key)
+
+    def test_not_modified(self):
+        page, _ = pagecache.make_page(FakeResponse('body', 'text/html'), {})
+        self.assertTrue(page.not_modified(page.etag))
+        self.assertTrue(page.not_modified('"abc", %s' % page.etag))
+        self.assertTrue(page.not_modified('*'))
+        self.assertFalse(page.not_modified('"abc"'))
+        self.assertFalse(page.not_modified(None))
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+import unittest
+
+from r2.lib import stats
+from r2.lib.publisher import BatchPublisher
+
+
+class FakeChannel(object):
+    def __init__(self, broker):
+        self.broker = broker
+        self.transactional = False
+        self.pending = []
+
+    def tx_select(self):
+        self.transactional = True
+
+    def basic_publish(self, message, exchange, routing_key):
+        if not self.transactional:
+            raise AssertionError("publishing outside of a transaction")
+        self.pending.append((exchange, routing_key, message))
+
+    def tx_commit(self):
+        if self.broker.failures:
+            self.broker.failures -= 1
+            self.pending = []
+            raise IOError("broken pipe")
+        self.broker.batches.append(self.pending)
+        self.pending = []
+
+
+class FakeBroker(object):
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.batches = []
+        self.channel = None
+        self.connections = 0
+
+    def get_channel(self, reconnect=False):
+        if reconnect or not self.channel:
+            self.connections += 1
+            self.channel = FakeChannel(self)
+        return self.channel
+
+    @property
+    def messages(self):
+        return [m for batch in self.batches for m in batch]
+
+
+def make_message(body, message_id, delivery_mode):
+    return body
+
+
+class BatchPublisherTest(unittest.TestCase):
+    def publisher(self, broker, **kw):
+        self.stats = stats.Stats(None, 1.0)
+        return BatchPublisher(broker.get_channel, make_message, 'exchange',
+                              stats=self.stats, **kw)
+
+    def counts(self):
+        return dict(self.stats.client.counting_stats.flush())
+
+    def test_batches(self):
+        broker = FakeBroker()
+        publisher = self.publisher(broker, batch_size=100)
+        for i in xrange(250):
+            self.assertTrue(publisher.add('rk', i))
+
+        self.assertEquals(publisher.publish_pending(block=False), 100)
+        self.assertEquals(publisher.publish_pending(block=False), 100)
+        self.assertEquals(publisher.publish_pending(block=False), 50)
+        self.assertEquals(publisher.publish_pending(block=False), 0)
+        self.assertEquals([len(batch) for batch in broker.batches],
+                          [100, 100, 50])
+        self.assertEquals(broker.messages,
+                          [('exchange', 'rk', i) for i in xrange(250)])
+        self.assertEquals(self.counts()['amqp_publisher.published'], '250|c')
+        self.assertEquals(dict(self.stats.client.gauge_stats.flush()),
+                          {'amqp_publisher.queue_depth': '0|g'})
+
+    def test_drop_when_full(self):
+        broker = FakeBroker()
+        publisher = self.publisher(broker, max_size=2)
+        self.assertTrue(publisher.add('rk', 1))
+        self.assertTrue(publisher.add('rk', 2))
+        self.assertFalse(publisher.add('rk', 3))
+        self.assertEquals(self.counts()['amqp_publisher.dropped'], '1|c')
+
+        publisher.publish_pending(block=False)
+        self.assertTrue(publisher.add('rk', 4))
+
+    def test_block_when_full(self):
+        broker = FakeBroker()
+        publisher = self.publisher(broker, max_size=1, block=True,
+                                   block_timeout=0.01)
+        self.assertTrue(publisher.add('rk', 1))
+        self.assertFalse(publisher.add('rk', 2))
+
+    def test_retry_on_new_channel(self):
+        broker = FakeBroker(failures=1)
+        publisher = self.publisher(broker)
+        publisher.add('rk', 1)
+        publisher.add('rk', 2)
+        self.assertEquals(publisher.publish_pending(block=False), 2)
+        self.assertEquals(broker.connections, 2)
+        self.assertEquals(broker.messages,
+                          [('exchange', 'rk', 1), ('exchange', 'rk', 2)])
+        self.assertEquals(self.counts()['amqp_publisher.publish_failed'],
+                          '1|c')
+
+    def test_give_up(self):
+        broker = FakeBroker(failures=3)
+        publisher = self.publisher(broker, max_attempts=3)
+        publisher.add('rk', 1)
+        self.assertEquals(publisher.publish_pending(block=False), 0)
+        self.assertEquals(broker.messages, [])
+        self.assertEquals(self.counts()['amqp_publisher.dropped'], '1|c')
+        publisher.join()
+
+    def test_thread(self):
+        broker = FakeBroker()
+        publisher = self.publisher(broker)
+        publisher.start()
+        for i in xrange(500):
+            publisher.add('rk', i)
+        publisher.join()
+        self.assertEquals(broker.messages,
+                          [('exchange', 'rk', i) for i in xrange(500)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+import unittest
+
+from r2.lib import ratelimit
+
+
+class AgentMatcherTest(unittest.TestCase):
+    def test_finds_every_agent(self):
+        agents = ('abc', 'b', 'bcd', 'ab', '', 'zzz', 'cd')
+        matcher = ratelimit.AgentMatcher(agents)
+        self.assertEquals(['abc', 'b', 'bcd', 'ab', 'cd'],
+                          matcher.match('xabcdx'))
+        self.assertEquals(['b'], matcher.match('bb'))
+        self.assertEquals([], matcher.match('xyz'))
+
+    def test_escapes_patterns(self):
+        matcher = ratelimit.AgentMatcher(('a.b', '(x)'))
+        self.assertEquals([], matcher.match('axb'))
+        self.assertEquals(['a.b', '(x)'], matcher.match('(x) a.b'))
+
+    def test_no_agents(self):
+        self.assertEquals([], ratelimit.AgentMatcher(('',)).match('abc'))
+
+    def test_rebuilt_when_agents_change(self):
+        agents = ('a',)
+        matcher = ratelimit.get_agent_matcher(agents)
+        self.assertTrue(matcher is ratelimit.get_agent_matcher(agents))
+        self.assertEquals(['b'], ratelimit.get_agent_matcher(('b',)).match('b'))
+
+
+class LocalRateLimiterTest(unittest.TestCase):
+    def test_refills(self):
+        limiter = ratelimit.LocalRateLimiter(rate=1, capacity=2)
+        self.assertTrue(limiter.allow('a', now=100))
+        self.assertTrue(limiter.allow('a', now=100))
+        self.assertFalse(limiter.allow('a', now=100))
+        self.assertTrue(limiter.allow('b', now=100))
+        self.assertFalse(limiter.allow('a', now=100.5))
+        self.assertTrue(limiter.allow('a', now=101.5))
+
+
+class RateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.limiter = ratelimit.RateLimiter(ratelimit.LocalBackend())
+
+    def record(self, now, *limits):
+        return self.limiter.record(list(limits), now=now)
+
+    def test_counts_in_window(self):
+        limit = ratelimit.Limit('a', limit=2, period=10)
+        self.assertEquals([1, 2, 3],
+                          [self.record(100, limit)[0].used for i in xrange(3)])
+        usage = self.record(105, limit)[0]
+        self.assertTrue(usage.exceeded)
+        self.assertEquals(0, usage.remaining)
+        self.assertEquals(5, usage.reset)
+
+    def test_slides(self):
+        limit = ratelimit.Limit('a', limit=10, period=10)
+        for i in xrange(10):
+            self.record(100, limit)
+        # halfway through the next window half of those still count
+        self.assertEquals(6, self.record(115, limit)[0].used)
+        # and none of them once it's over, only the one at 115
+        self.assertEquals(2, self.record(120, limit)[0].used)
+
+    def test_limits_are_independent(self):
+        a = ratelimit.Limit('a', limit=1, period=10)
+        b = ratelimit.Limit('b', limit=1, period=60)
+        self.record(100, a)
+        usages = self.record(100, a, b)
+        self.assertEquals([True, False], [u.exceeded for u in usages])
+        self.assertEquals('1', usages[1].headers()['X-Ratelimit-Used'])
+
+    def test_concurrent_first_requests(self):
+        limit = ratelimit.Limit('a', limit=10, period=10)
+        backend = self.limiter.backend
+        get_multi = backend.get_multi
+        # both requests read the counters before either has written
+        backend.get_multi = lambda keys: {}
+        self.record(100, limit)
+        self.record(100, limit)
+        backend.get_multi = get_multi
+        self.assertEquals(3, self.record(100, limit)[0].used)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+import threading
+import time
+import unittest
+
+from r2.lib import singleflight
+
+
+class DictCache(dict):
+    def get(self, key, default=None, stale=None, allow_local=True):
+        return dict.get(self, key, default)
+
+    def set(self, key, val, time=0):
+        self[key] = val
+
+    def add(self, key, val, time=0):
+        if key in self:
+            return None
+        self[key] = val
+        return True
+
+    def delete(self, key):
+        self.pop(key, None)
+
+
+def run_threads(n, target):
+    threads = [threading.Thread(target=target) for i in xrange(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+class SingleFlightTest(unittest.TestCase):
+    def test_concurrent_calls_collapse(self):
+        flights = singleflight.SingleFlight()
+        calls = []
+        results = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.1)
+            return 42
+
+        run_threads(5, lambda: results.append(flights.do('key', compute)))
+        self.assertEquals(1, len(calls))
+        self.assertEquals([42] * 5, [value for value, shared in results])
+        self.assertEquals(4, sum(1 for value, shared in results if shared))
+
+    def test_recursive_call(self):
+        flights = singleflight.SingleFlight()
+        inner = lambda: flights.do('key', lambda: 1)[0] + 1
+        self.assertEquals((2, False), flights.do('key', inner))
+
+    def test_do_multi_shares_overlapping_keys(self):
+        flights = singleflight.SingleFlight()
+        started = threading.Event()
+
+        def slow_miss(keys):
+            started.set()
+            time.sleep(0.1)
+            return dict((k, k * 2) for k in keys)
+
+        first = []
+        t = threading.Thread(target=lambda: first.append(
+            flights.do_multi([1, 2, 3], slow_miss)))
+        t.start()
+        started.wait()
+        computed, shared = flights.do_multi([2, 3, 4], slow_miss)
+        t.join()
+
+        self.assertEquals({4: 8}, computed)
+        self.assertEquals({2: 4, 3: 6}, shared)
+        self.assertEquals(({1: 2, 2: 4, 3: 6}, {}), first[0])
+
+
+class GetOrComputeTest(unittest.TestCase):
+    def test_serves_stale_while_refreshing(self):
+        cache, leases = DictCache(), DictCache()
+        get = lambda compute: singleflight.get_or_compute(
+            cache, 'key', compute, time=60, lease_cache=leases,
+            soft_expire=True)
+
+        self.assertEquals(1, get(lambda: 1))
+        self.assertEquals(1, get(lambda: 2))
+
+        # expired, but another process holds the lease
+        cache['key'].expires = 0
+        leases.add('singleflight_lease(key)', 'elsewhere')
+        self.assertEquals(1, get(lambda: 2))
+
+        # expired and nobody is refreshing it
+        leases.clear()
+        self.assertEquals(2, get(lambda: 2))
+        self.assertFalse(leases)
+
+    def test_plain_values_without_soft_expire(self):
+        cache = DictCache()
+        self.assertEquals(1, singleflight.get_or_compute(
+            cache, 'key', lambda: 1, time=60, lease_cache=DictCache()))
+        self.assertEquals(1, cache['key'])
+
+        # soft expiring values are still read
+        cache['key'] = singleflight.SoftExpiring(2, time.time() + 60)
+        self.assertEquals(2, singleflight.get_or_compute(
+            cache, 'key', lambda: 3, time=60))
+
+    def test_cold_miss_waits_once(self):
+        cache, leases = DictCache(), DictCache()
+        leases.add('singleflight_lease(key)', 'elsewhere')
+        get = lambda compute: singleflight.get_or_compute(
+            cache, 'key', compute, time=60, lease_cache=leases, wait=0.01)
+
+        # the lease holder never stores it, so it's computed without
+        # the lease instead of waiting out lease_time
+        start = time.time()
+        self.assertEquals(1, get(lambda: 1))
+        self.assertTrue(time.time() - start < 1)
+        self.assertEquals(1, cache['key'])
+
+        # and a value stored by the lease holder meanwhile is used
+        cache.clear()
+        sleep = time.sleep
+        def store_while_waiting(seconds):
+            cache['key'] = 2
+        time.sleep = store_while_waiting
+        try:
+            self.assertEquals(2, get(lambda: 3))
+        finally:
+            time.sleep = sleep
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -35,6 +35,21 @@ class CountingStatBufferTest(unittest.TestCase):
                  ('3', '6|c')]),
             set(csb.flush()))
 
+class GaugeStatBufferTest(unittest.TestCase):
+    def test_gsb(self):
+        gsb = stats.GaugeStatBuffer()
+        self.assertEquals([], list(gsb.flush()))
+
+        for i in xrange(1, 4):
+            for j in xrange(i):
+                gsb.record(str(i), j + 1)
+        self.assertEquals(
+            set([('1', '1|g'),
+                 ('2', '2|g'),
+                 ('3', '3|g')]),
+            set(gsb.flush()))
+        self.assertEquals([], list(gsb.flush()))
+
 class FakeUdpSocket:
     def __init__(self, *ignored_args):
         self.host = None
@@ -95,9 +110,10 @@ class StatsdClientTest(unittest.TestCase):
         client = StatsdClientUnderTest('host:1000')
         client.timing_stats.record('t', 1)
         client.counting_stats.record('c', 1)
+        client.gauge_stats.record('g', 2)
         client.flush()
         self.assertEquals(
-            ['c:1|c\nt:1000.0|ms\nt:1|c'],
+            ['c:1|c\ng:2|g\nt:1000.0|ms\nt:1|c'],
             client.conn.sock.datagrams)
 
 class CounterAndTimerTest(unittest.TestCase):
@@ -127,6 +143,16 @@ class CounterAndTimerTest(unittest.TestCase):
             set(c.client.counting_stats.flush()))
         self.assertEquals(set(), set(c.client.counting_stats.flush()))
 
+    def test_gauge(self):
+        g = stats.Gauge(self.client(), 'g')
+        g.set(3, 'a')
+        g.set(1)
+        g.set(2)
+        self.assertEquals(
+            set([('g.a', '3|g'),
+                 ('g', '2|g')]),
+            set(g.client.gauge_stats.flush()))
+
     def test_timer(self):
         t = stats.Timer(self.client(), 't')
         t._time = iter(i / 10.0 for i in xrange(10)).next
@@ -4,6 +4,7 @@ import collections
 import unittest
 
 from r2.lib import utils
+from r2.lib.contrib import ipaddress
 
 
 class UtilsTest(unittest.TestCase):
@@ -63,3 +64,124 @@ class TestCanonicalizeEmail(unittest.TestCase):
         # to be byte strings with non-ascii in 'em.
         canonical = utils.canonicalize_email("\xe2\x9c\x93@example.com")
         self.assertEquals(canonical, "\xe2\x9c\x93@example.com")
+
+
+class FakeQuery(object):
+    """Enough of a Query for fetch_things2: results are sorted ints and
+    _after adds a rule that skips past the given one."""
+    def __init__(self, items):
+        self.items = items
+        self._sort = ['_id']
+        self._rules = []
+        self._limit = None
+        self.runs = 0
+
+    def _after(self, item):
+        self._rules.append(item)
+
+    def __iter__(self):
+        self.runs += 1
+        after = max(self._rules) if self._rules else None
+        items = [i for i in self.items if after is None or i > after]
+        return iter(items[:self._limit])
+
+
+class FetchThings2Test(unittest.TestCase):
+    def test_chunks(self):
+        q = FakeQuery(range(25))
+        chunks = list(utils.fetch_things2(q, chunk_size=10, chunks=True))
+        self.assertEquals(chunks, [range(10), range(10, 20), range(20, 25)])
+        self.assertEquals(q.runs, 3)
+
+    def test_exact_chunks(self):
+        q = FakeQuery(range(20))
+        self.assertEquals(list(utils.fetch_things2(q, chunk_size=10)),
+                          range(20))
+        # the last chunk was full, so it takes an empty one to finish
+        self.assertEquals(q.runs, 3)
+
+    def test_batch_fn(self):
+        q = FakeQuery(range(5))
+        items = utils.fetch_things2(q, chunk_size=2,
+                                    batch_fn=lambda x: [i * 10 for i in x])
+        self.assertEquals(list(items), [0, 10, 20, 30, 40])
+
+    def test_prefetch(self):
+        q = FakeQuery(range(1000))
+        items = utils.fetch_things2(q, chunk_size=7, prefetch_chunks=True)
+        self.assertEquals(list(items), range(1000))
+
+    def test_progress(self):
+        q = FakeQuery(range(25))
+        progress = []
+        def progress_fn(count, rate):
+            progress.append(count)
+
+        list(utils.fetch_things2(q, chunk_size=10, progress_fn=progress_fn))
+        self.assertEquals(progress, [10, 20, 25])
+
+
+class PrefetchTest(unittest.TestCase):
+    def test_order(self):
+        self.assertEquals(list(utils.prefetch(xrange(100), size=3)),
+                          range(100))
+
+    def test_error(self):
+        def fails():
+            yield 1
+            raise ValueError
+
+        it = utils.prefetch(fails())
+        self.assertEquals(it.next(), 1)
+        self.assertRaises(ValueError, it.next)
+
+    def test_stop_early(self):
+        it = utils.prefetch(xrange(100))
+        self.assertEquals(it.next(), 0)
+        it.close()
+
+
+class NetworkIndexTest(unittest.TestCase):
+    def index(self, *networks):
+        return utils.NetworkIndex(ipaddress.ip_network(unicode(n))
+                                  for n in networks)
+
+    def test_empty(self):
+        index = self.index()
+        self.assertFalse('1.2.3.4' in index)
+        self.assertFalse('::1' in index)
+        self.assertEquals(list(index), [])
+
+    def test_contains(self):
+        index = self.index('10.0.0.0/8', '192.168.1.0/24', '1.2.3.4')
+        for address in ('10.0.0.0', '10.255.255.255', '192.168.1.77',
+                        '1.2.3.4'):
+            self.assertTrue(address in index, address)
+        for address in ('9.255.255.255', '11.0.0.0', '192.168.2.0',
+                        '1.2.3.3', '1.2.3.5', '0.0.0.0'):
+            self.assertFalse(address in index, address)
+
+    def test_ipv6(self):
+        index = self.index('10.0.0.0/8')
+        self.assertFalse('::1' in index)
+        # ipv4-mapped addresses are ipv6 addresses, as with ipaddress
+        self.assertFalse('::ffff:10.1.2.3' in index)
+
+    def test_merges(self):
+        index = self.index('10.0.0.0/9', '10.128.0.0/9', '10.1.0.0/16',
+                           '11.0.0.0/8', '13.0.0.0/8')
+        self.assertEquals([str(n) for n in index],
+                          ['10.0.0.0/7', '13.0.0.0/8'])
+        self.assertTrue('11.1.2.3' in index)
+        self.assertFalse('12.0.0.0' in index)
+
+        # 11/8 and 12/8 can't collapse into one network but are contiguous
+        index = self.index('11.0.0.0/8', '12.0.0.0/8')
+        self.assertEquals(len(index), 2)
+        self.assertTrue('11.255.255.255' in index)
+        self.assertTrue('12.0.0.0' in index)
+
+    def test_invalid(self):
+        index = self.index('10.0.0.0/8')
+        for address in ('10', '10.0.0', 'example.com', '10.0.0.256', ''):
+            self.assertRaises(ValueError, index.__contains__, address)
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+import pickle
+import unittest
+
+from r2.lib.wrapped import StringTemplate, _StubResolver
+
+
+class StringTemplateTest(unittest.TestCase):
+    def test_update_keeps_variables(self):
+        t = StringTemplate(u'a<$>x</$>b<$>y</$>c')
+        t = t.update(dict(x = u'<$>z</$>!'))
+        self.assertEquals(t.template, u'a<$>z</$>!b<$>y</$>c')
+        self.assertEquals(t.finalize(dict(y = u'Y', z = u'Z')), u'aZ!bYc')
+
+    def test_none_is_empty(self):
+        t = StringTemplate(u'a<$>x</$>b')
+        self.assertEquals(t.finalize(dict(x = None)), u'ab')
+        self.assertEquals(t.update(dict(x = None)).template, u'ab')
+
+    def test_pickle(self):
+        t = StringTemplate(u'a<$>x</$>').update(dict(y = u'b'))
+        t.segments()
+        state = pickle.loads(pickle.dumps(t, 2)).__dict__
+        self.assertEquals(state, dict(template = u'a<$>x</$>'))
+
+
+class StubResolverTest(unittest.TestCase):
+    def test_render(self):
+        nodes = dict(
+            h1 = (StringTemplate(u'[1 <$>h2</$> <$>kids</$>]'),
+                  dict(kids = u'<$>h3</$>')),
+            h2 = (StringTemplate(u'[2 <$>score</$>]'), dict(score = u'5')),
+            h3 = (StringTemplate(u'[3 <$>kids</$><$>foot</$>]'),
+                  dict(kids = None)),
+        )
+        resolver = _StubResolver(nodes)
+        page = StringTemplate(u'<$>h1</$><$>foot</$><$>other</$>')
+        self.assertEquals(resolver.render(page, dict(foot = u'.')),
+                          u'[1 [2 5] [3 .]].<$>other</$>')
+        self.assertEquals(resolver.resolve('h1').template,
+                          u'[1 [2 5] <$>kids</$>]')
+
+
+if __name__ == '__main__':
+    unittest.main()
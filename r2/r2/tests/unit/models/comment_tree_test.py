@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+import unittest
+
+from pylons import g
+
+from r2.lib.cache import LocalCache
+from r2.models.comment_tree import (
+    ArrayView,
+    CommentTree,
+    CommentTreeArrays,
+    CommentTreeStorageV3,
+)
+
+
+class FakeLink(object):
+    _id = 1
+    comment_tree_version = 3
+
+
+class FakeComment(object):
+    def __init__(self, _id, parent_id=None):
+        self._id = _id
+        self.parent_id = parent_id
+
+
+class NoOpLock(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class CommentTreeArraysTest(unittest.TestCase):
+    def setUp(self):
+        # 1 -> 2 -> 3, 1 -> 5 and a second top-level comment 4
+        self.arrays = CommentTreeArrays.from_tree(
+            cids=[4, 1, 3, 2, 5],
+            tree={None: [1, 4], 1: [2, 5], 2: [3]},
+            depth={1: 0, 2: 1, 3: 2, 4: 0, 5: 1},
+            num_children={1: 3, 2: 1, 3: 0, 4: 0, 5: 0},
+            parents={1: None, 2: 1, 3: 2, 4: None, 5: 1},
+        )
+
+    def test_round_trip(self):
+        arrays = CommentTreeArrays.loads(self.arrays.dumps())
+        self.assertEquals(arrays.cids.tolist(), [1, 2, 3, 4, 5])
+        self.assertEquals([arrays.get_parent(cid) for cid in arrays.cids],
+                          [None, 1, 2, None, 1])
+        self.assertEquals([arrays.get_depth(cid) for cid in arrays.cids],
+                          [0, 1, 2, 0, 1])
+        self.assertEquals([arrays.get_num_children(cid)
+                           for cid in arrays.cids],
+                          [3, 1, 0, 0, 0])
+        self.assertEquals(arrays.get_children(None), [1, 4])
+        self.assertEquals(arrays.get_children(1), [2, 5])
+        self.assertEquals(arrays.get_children(2), [3])
+        self.assertRaises(KeyError, arrays.get_children, 3)
+        self.assertRaises(KeyError, arrays.get_depth, 6)
+
+    def test_bad_encoding(self):
+        s = self.arrays.dumps()
+        self.assertRaises(ValueError, CommentTreeArrays.loads, s[:-1])
+
+    def test_views(self):
+        views = self.arrays.views()
+        tree, depth = views["tree"], views["depth"]
+        self.assertTrue(2 in tree)
+        self.assertFalse(3 in tree)
+        self.assertFalse(6 in depth)
+        self.assertEquals(tree.get(3), None)
+        self.assertEquals(tree.get(3, ()), ())
+        self.assertEquals(depth.get(3), 2)
+        self.assertRaises(KeyError, lambda: tree[3])
+
+        copy = tree.copy()
+        copy[3] = [6]
+        self.assertEquals(copy[3], [6])
+        self.assertTrue(3 in copy)
+        self.assertFalse(3 in tree)
+
+
+class CommentTreeStorageV3Test(unittest.TestCase):
+    def setUp(self):
+        self.saved = g.permacache, g.make_lock
+        g.permacache = LocalCache()
+        g.make_lock = lambda *a, **kw: NoOpLock()
+        self.link = FakeLink()
+
+    def tearDown(self):
+        g.permacache, g.make_lock = self.saved
+
+    def load(self):
+        data = CommentTreeStorageV3.by_link(self.link)
+        self.assertTrue(isinstance(data["tree"], ArrayView))
+        return CommentTree(self.link, **data)
+
+    def assertTree(self, tree, parents, children):
+        self.assertEquals(list(tree.cids), sorted(parents))
+        self.assertEquals(dict((cid, tree.parents[cid]) for cid in tree.cids),
+                          parents)
+        for cid in [None] + list(tree.cids):
+            self.assertEquals(tree.tree.get(cid), children.get(cid))
+
+    def test_add_and_delete(self):
+        tree = CommentTree(self.link, cids=[], tree={}, depth={},
+                           num_children={}, parents={})
+        CommentTreeStorageV3.add_comments(tree, [
+            FakeComment(1), FakeComment(2, 1), FakeComment(3, 2)])
+
+        tree = self.load()
+        self.assertTree(tree, {1: None, 2: 1, 3: 2}, {None: [1], 1: [2],
+                                                      2: [3]})
+        self.assertEquals([tree.depth[cid] for cid in tree.cids], [0, 1, 2])
+        self.assertEquals([tree.num_children[cid] for cid in tree.cids],
+                          [2, 1, 0])
+
+        # adding to a tree read from the arrays
+        CommentTreeStorageV3.add_comments(tree, [FakeComment(4),
+                                                 FakeComment(5, 1)])
+        tree = self.load()
+        self.assertTree(tree, {1: None, 2: 1, 3: 2, 4: None, 5: 1},
+                        {None: [1, 4], 1: [2, 5], 2: [3]})
+        self.assertEquals(tree.depth[5], 1)
+        self.assertEquals(tree.num_children[1], 3)
+
+        # only leaves are removed
+        CommentTreeStorageV3.delete_comment(tree, FakeComment(2, 1))
+        CommentTreeStorageV3.delete_comment(tree, FakeComment(4))
+        tree = self.load()
+        self.assertEquals(list(tree.cids), [1, 2, 3, 5])
+        self.assertFalse(4 in tree.depth)
+        self.assertEquals(tree.parents[2], 1)
+        self.assertEquals(tree.tree.get(2), [3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+import random
+import unittest
+
+from r2.lib.db.operators import asc, desc
+from r2.models.query_cache import (
+    CachedQuery,
+    ThingTupleComparator,
+    _encode_sort_key,
+)
+
+
+class SortKeyEncodingTest(unittest.TestCase):
+    def assertOrdersLikeComparator(self, sort, tuples):
+        by_key = sorted(tuples,
+                        key=lambda t: _encode_sort_key(sort, t[1:]) + t[0])
+        # ties are broken by fullname in the encoded order
+        by_cmp = sorted(sorted(tuples), cmp=ThingTupleComparator(sort))
+        self.assertEquals(by_key, by_cmp)
+
+    def test_mixed_directions(self):
+        rand = random.Random(0)
+        values = [-1e12, -3.5, -1, -0.0, 0, 0.0, 1, 2.25, 1e9, 1371234567.89]
+        tuples = [("t3_%d" % i,
+                   rand.choice(values + [rand.uniform(-100, 100)]),
+                   rand.choice(values))
+                  for i in xrange(2000)]
+
+        for sort in ([desc("_date")], [asc("_date")],
+                     [desc("_score"), asc("_date")],
+                     [asc("_score"), desc("_date")]):
+            self.assertOrdersLikeComparator(sort, tuples)
+
+    def test_fixed_width(self):
+        self.assertEquals(len(_encode_sort_key([desc("a"), asc("b")],
+                                               (1, -2.5))), 32)
+
+
+class FakeSortedModel(object):
+    _sorted = True
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.reads = []
+
+    def index_mangle_keys(self, keys):
+        return keys
+
+    def get(self, keys, column_count=None):
+        self.reads.append(column_count)
+        return dict((key, (self.rows[key][:column_count], {}))
+                    for key in keys if key in self.rows)
+
+
+class IterFirstTest(unittest.TestCase):
+    def setUp(self):
+        self.tuples = [("t3_%d" % i, 100. - i) for i in xrange(20)]
+        self.model = FakeSortedModel({"q": self.tuples})
+        self.query = CachedQuery(self.model, "q", [desc("_date")],
+                                 lambda x: x, False)
+
+    def test_reads_first_page(self):
+        names = self.query.iter_first(5)
+        self.assertEquals([names.next() for i in xrange(5)],
+                          [t[0] for t in self.tuples[:5]])
+        self.assertEquals(self.model.reads, [5])
+
+    def test_reads_rest_when_needed(self):
+        self.assertEquals(list(self.query.iter_first(5)),
+                          [t[0] for t in self.tuples])
+        self.assertEquals(self.model.reads, [5, None])
+
+        # the first page was stale by the time the rest was read
+        self.query._fetched = False
+        self.model.reads = []
+        names = self.query.iter_first(5)
+        first = [names.next() for i in xrange(5)]
+        self.model.rows["q"] = [("t3_new", 200.)] + self.tuples
+        self.assertEquals(first + list(names),
+                          [t[0] for t in self.tuples])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+import datetime
+import unittest
+
+import pytz
+from pylons import g
+
+from r2.lib.cache import LocalCache
+from r2.models.last_modified import LastModified
+from r2.models.vote import LinkVotesByAccount
+
+
+class FakeThing(object):
+    def __init__(self, id36, date):
+        self._id36 = id36
+        self._fullname = "t_" + id36
+        self._date = date
+
+
+def date(hour):
+    return datetime.datetime(2013, 1, 1, hour, tzinfo=pytz.utc)
+
+
+class VoteCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = (g.cache, g.vote_cache_ttl, g.vote_cache_max_entries,
+                      LastModified.__dict__["get"],
+                      LinkVotesByAccount.__dict__.get("_get_columns"))
+        g.cache = LocalCache()
+        g.vote_cache_ttl = 60
+        g.vote_cache_max_entries = 100
+
+        self.last_modified = date(12)
+        self.votes = {"a": "1", "b": "-1", "c": "0"}
+        self.lookups = []
+        self.last_modified_lookups = 0
+
+        def get(cls, fullname, name):
+            self.last_modified_lookups += 1
+            return self.last_modified
+
+        def get_columns(cls, thing1, thing2s):
+            self.lookups.append(sorted(t._id36 for t in thing2s))
+            return dict((t._id36, self.votes[t._id36]) for t in thing2s
+                        if t._id36 in self.votes)
+
+        LastModified.get = classmethod(get)
+        LinkVotesByAccount._get_columns = classmethod(get_columns)
+
+        self.user = FakeThing("u", date(0))
+        self.things = [FakeThing(id36, date(1))
+                       for id36 in ("a", "b", "c", "d")]
+
+    def tearDown(self):
+        (g.cache, g.vote_cache_ttl, g.vote_cache_max_entries,
+         LastModified.get, get_columns) = self.saved
+        if get_columns:
+            LinkVotesByAccount._get_columns = get_columns
+        else:
+            del LinkVotesByAccount._get_columns
+
+    def query(self, things):
+        res = LinkVotesByAccount.cached_query(self.user, things)
+        return dict((thing2._id36, name)
+                    for (thing1, thing2), name in res.iteritems())
+
+    def test_cached(self):
+        expected = {"a": "1", "b": "-1", "c": "0"}
+        self.assertEquals(self.query(self.things), expected)
+        self.assertEquals(self.query(self.things), expected)
+        self.assertEquals(self.lookups, [["a", "b", "c", "d"]])
+        self.assertEquals(self.last_modified_lookups, 1)
+
+        more = self.things + [FakeThing("e", date(2))]
+        self.assertEquals(self.query(more), expected)
+        self.assertEquals(self.lookups[1:], [["e"]])
+
+    def test_newer_than_last_vote(self):
+        new = [FakeThing("a", date(13)), FakeThing("e", date(14))]
+        self.assertEquals(self.query(new), {})
+        self.assertEquals(self.lookups, [])
+
+        # even an account that never voted is only looked up once
+        self.last_modified = None
+        self.user = FakeThing("v", date(0))
+        self.assertEquals(self.query(self.things), {})
+        self.assertEquals(self.query(self.things), {})
+        self.assertEquals(self.lookups, [])
+        self.assertEquals(self.last_modified_lookups, 2)
+
+    def test_invalidated_by_votes(self):
+        expected = {"a": "1", "b": "-1", "c": "0"}
+        self.query(self.things)
+        LinkVotesByAccount.touch_vote_cache(self.user)
+        self.votes["d"] = "1"
+        self.last_modified = date(13)
+
+        expected["d"] = "1"
+        self.assertEquals(self.query(self.things), expected)
+        self.assertEquals(self.query(self.things), expected)
+        self.assertEquals(len(self.lookups), 2)
+        self.assertEquals(self.last_modified_lookups, 2)
+
+    def test_racing_vote(self):
+        get_columns = LinkVotesByAccount._get_columns
+
+        def vote_while_looking_up(thing1, thing2s):
+            # the vote lands after Cassandra was read, but before the
+            # lookup's result is written back to the cache
+            res = get_columns(thing1, thing2s)
+            self.votes["d"] = "1"
+            LinkVotesByAccount.touch_vote_cache(self.user)
+            return res
+
+        LinkVotesByAccount._get_columns = staticmethod(vote_while_looking_up)
+        self.assertEquals(self.query(self.things),
+                          {"a": "1", "b": "-1", "c": "0"})
+        LinkVotesByAccount._get_columns = get_columns
+        self.assertEquals(self.query(self.things),
+                          {"a": "1", "b": "-1", "c": "0", "d": "1"})
+
+    def test_max_entries(self):
+        g.vote_cache_max_entries = 4
+        self.query(self.things)
+        page = [self.things[0], FakeThing("e", date(2))]
+        self.query(page)
+        stamp, last_modified, votes = g.cache.get(
+            LinkVotesByAccount._vote_cache_key(self.user))
+        self.assertEquals(votes, {"a": "1", "e": None})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# The contents of this file are subject to the Common Public Attribution
+# License Version 1.0. (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://code.reddit.com/LICENSE. The License is based on the Mozilla Public
+# License Version 1.1, but Sections 14 and 15 have been added to cover use of
+# software over a computer network and provide for limited attribution for the
+# Original Developer. In addition, Exhibit A has been modified to be consistent
+# with Exhibit B.
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License for
+# the specific language governing rights and limitations under the License.
+#
+# The Original Code is reddit.
+#
+# The Original Developer is the Initial Developer.  The Initial Developer of
+# the Original Code is reddit Inc.
+#
+# All portions of the code written by reddit are Copyright (c) 2006-2012 reddit
+# Inc. All Rights Reserved.
+###############################################################################
+"""Measure how stale peers' local caches get with the invalidation bus.
+
+Starts several worker processes, each holding a local LRUCache subscribed to
+a UDPMulticastInvalidationBus, then repeatedly publishes invalidations from
+this process and reports how long it took each worker to drop the key and
+how many invalidations never arrived.
+
+Usage: python cache_invalidation.py [workers] [rounds] [group:port]
+
+"""
+
+import multiprocessing
+import sys
+import time
+
+from r2.lib.cache import LRUCache
+from r2.lib.cache_invalidation import UDPMulticastInvalidationBus
+
+
+KEY = 'Subreddit_1'
+
+
+def worker(group, port, ready, results):
+    cache = LRUCache(max_ttl=3600)
+    cache.set(KEY, 'value')
+
+    def dropped(keys):
+        now = time.time()
+        cache.delete_multi(keys)
+        for key in keys:
+            if key != KEY:
+                # the key carries the time it was published at
+                results.put(now - float(key))
+        cache.set(KEY, 'value')
+
+    bus = UDPMulticastInvalidationBus(group, port)
+    bus.subscribe(dropped)
+    bus.start()
+    ready.put(True)
+    while True:
+        time.sleep(1)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    num_workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    addr = sys.argv[3] if len(sys.argv) > 3 else '239.255.42.99:4299'
+    group, port = addr.split(':')
+    port = int(port)
+
+    ready = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=worker,
+                                       args=(group, port, ready, results))
+               for i in xrange(num_workers)]
+    for p in workers:
+        p.daemon = True
+        p.start()
+    for p in workers:
+        ready.get()
+
+    bus = UDPMulticastInvalidationBus(group, port)
+    for i in xrange(rounds):
+        bus.publish([KEY, repr(time.time())])
+        time.sleep(0.001)
+
+    delays = []
+    deadline = time.time() + 2
+    expected = num_workers * rounds
+    while len(delays) < expected and time.time() < deadline:
+        try:
+            delays.append(results.get(timeout=0.1))
+        except Exception:
+            pass
+
+    print "%d workers, %d invalidations" % (num_workers, rounds)
+    if delays:
+        print "delay p50 %.3fms p99 %.3fms max %.3fms" % (
+            percentile(delays, 0.5) * 1000,
+            percentile(delays, 0.99) * 1000,
+            max(delays) * 1000)
+    print "lost %d of %d" % (expected - len(delays), expected)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# The contents of this file are subject to the Common Public Attribution
+# License Version 1.0. (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://code.reddit.com/LICENSE. The License is based on the Mozilla Public
+# License Version 1.1, but Sections 14 and 15 have been added to cover use of
+# software over a computer network and provide for limited attribution for the
+# Original Developer. In addition, Exhibit A has been modified to be consistent
+# with Exhibit B.
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License for
+# the specific language governing rights and limitations under the License.
+#
+# The Original Code is reddit.
+#
+# The Original Developer is the Initial Developer.  The Initial Developer of
+# the Original Code is reddit Inc.
+#
+# All portions of the code written by reddit are Copyright (c) 2006-2012 reddit
+# Inc. All Rights Reserved.
+###############################################################################
+"""Benchmark picking the comments to show from a large comment tree.
+
+Builds a synthetic tree and compares selecting the best N comments by
+re-sorting the candidate list on every expansion (the old comment builder
+behaviour) against the heap-based CommentFrontier.
+
+Usage: python comment_frontier.py [tree size] [page size]
+
+"""
+
+import random
+import sys
+import time
+
+from r2.lib.comment_frontier import CommentFrontier
+
+
+def make_tree(size, max_depth=10):
+    tree = {None: []}
+    depth = {}
+    sorter = {}
+    cids = []
+    for cid in xrange(1, size + 1):
+        # favour replying to recent comments to get deep threads
+        if cids and random.random() < 0.8:
+            parent = random.choice(cids[-200:])
+            if depth[parent] >= max_depth:
+                parent = None
+        else:
+            parent = None
+        tree.setdefault(parent, []).append(cid)
+        depth[cid] = depth[parent] + 1 if parent else 0
+        sorter[cid] = random.random()
+        cids.append(cid)
+    return tree, sorter
+
+
+def select_by_sorting(tree, sorter, num):
+    candidates = list(tree[None])
+    candidates.sort(key=sorter.get, reverse=True)
+    items = []
+    while len(items) < num and candidates:
+        to_add = candidates.pop(0)
+        if to_add in tree:
+            candidates.extend(tree[to_add])
+            candidates.sort(key=sorter.get, reverse=True)
+        items.append(to_add)
+    return items, candidates
+
+
+def select_by_frontier(tree, sorter, num):
+    frontier = CommentFrontier(sorter, True, tree[None])
+    items = []
+    while len(items) < num and frontier:
+        to_add = frontier.pop()
+        if to_add in tree:
+            frontier.extend(tree[to_add])
+        items.append(to_add)
+    return items, frontier.remaining()
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    num = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    tree, sorter = make_tree(size)
+    print "%d comments, %d top level, page of %d" % (size, len(tree[None]),
+                                                     num)
+
+    results = []
+    for name, fn in (("sort per expansion", select_by_sorting),
+                     ("frontier heap", select_by_frontier)):
+        start = time.time()
+        result = fn(tree, sorter, num)
+        elapsed = time.time() - start
+        results.append(result)
+        print "%20s: %8.2fms" % (name, elapsed * 1000)
+
+    assert results[0] == results[1]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# The contents of this file are subject to the Common Public Attribution
+# License Version 1.0. (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://code.reddit.com/LICENSE. The License is based on the Mozilla Public
+# License Version 1.1, but Sections 14 and 15 have been added to cover use of
+# software over a computer network and provide for limited attribution for the
+# Original Developer. In addition, Exhibit A has been modified to be consistent
+# with Exhibit B.
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License for
+# the specific language governing rights and limitations under the License.
+#
+# The Original Code is reddit.
+#
+# The Original Developer is the Initial Developer.  The Initial Developer of
+# the Original Code is reddit Inc.
+#
+# All portions of the code written by reddit are Copyright (c) 2006-2012 reddit
+# Inc. All Rights Reserved.
+###############################################################################
+"""Benchmark rendering the markdown of a large comment page.
+
+Makes up a page of comments and renders every body on it the way the
+templates do, with safemarkdown:
+
+  snudown   every body rendered with snudown, as before the cache
+  cold      nothing cached: prefetch_markdown renders the page and stores it
+  memcache  the page is in memcache but not the process-local LRU
+  local     the page is in the process-local LRU
+  unbatched the page is in memcache, but each body is looked up on its own
+
+Memcache is stood in for by a dict that sleeps for the given latency on
+each round trip.
+
+Usage: python markdown_cache.py [comments] [latency ms] [repeats]
+
+Run it from the r2 directory after building the extensions (python
+setup.py build_ext --inplace) so that r2.lib.filters can be imported.
+
+"""
+
+import random
+import sys
+import time
+from time import sleep
+
+import pylons
+import snudown
+from pylons.util import AttribSafeContextObj
+
+from r2.lib import filters
+from r2.lib.cache import LocalCache, LocalTierCache, LRUCache
+
+
+class SlowCache(LocalCache):
+    """A LocalCache that takes `latency` seconds per round trip."""
+
+    def __init__(self, latency):
+        LocalCache.__init__(self)
+        self.latency = latency
+
+    def get(self, key, default=None):
+        sleep(self.latency)
+        return LocalCache.get(self, key, default)
+
+    def simple_get_multi(self, keys):
+        sleep(self.latency)
+        return LocalCache.simple_get_multi(self, keys)
+
+    def set(self, key, val, time=0):
+        sleep(self.latency)
+        return LocalCache.set(self, key, val, time)
+
+    def set_multi(self, keys, prefix='', time=0):
+        sleep(self.latency)
+        for k, v in keys.iteritems():
+            LocalCache.set(self, prefix + str(k), v, time)
+
+
+class NullStats(object):
+    def cache_count(self, name, delta=1, sample_rate=None):
+        pass
+
+    def cache_count_multi(self, data, cache_name=None, sample_rate=None):
+        pass
+
+
+class Globals(object):
+    stats = NullStats()
+    markdown_prerender = False
+
+    def __init__(self, latency):
+        self.remote = SlowCache(latency)
+        self.local = LRUCache(max_entries=10000, max_ttl=3600)
+        self.markdowncache = LocalTierCache(self.local, self.remote, [''])
+
+
+def make_comments(rand, num_comments):
+    words = [''.join(rand.choice('abcdefghij') for j in xrange(6))
+             for i in xrange(200)]
+
+    def sentence():
+        parts = []
+        for i in xrange(rand.randint(5, 25)):
+            word = rand.choice(words)
+            r = rand.random()
+            if r < .05:
+                word = '*%s*' % word
+            elif r < .08:
+                word = '**%s**' % word
+            elif r < .1:
+                word = '[%s](http://example.com/%s)' % (word, word)
+            elif r < .11:
+                word = '/r/%s' % word
+            parts.append(word)
+        return ' '.join(parts) + '.'
+
+    comments = []
+    for i in xrange(num_comments):
+        paragraphs = []
+        for p in xrange(rand.randint(1, 4)):
+            if rand.random() < .1:
+                paragraphs.append('\n'.join('* ' + sentence()
+                                            for j in xrange(3)))
+            elif rand.random() < .1:
+                paragraphs.append('> ' + sentence())
+            else:
+                paragraphs.append(' '.join(sentence()
+                                           for j in xrange(rand.randint(1, 5))))
+        comments.append(('\n\n'.join(paragraphs), rand.random() < .5))
+    return comments
+
+
+def render_page(comments, prefetch):
+    # a fresh tmpl_context per request, like the app gets
+    pylons.c._push_object(AttribSafeContextObj())
+    try:
+        if prefetch:
+            filters.prefetch_markdown((body, nofollow, None)
+                                      for body, nofollow in comments)
+        return [filters.safemarkdown(body, nofollow=nofollow, target=None)
+                for body, nofollow in comments]
+    finally:
+        pylons.c._pop_object()
+
+
+def render_snudown(comments):
+    return [filters.SC_OFF + filters.MD_START +
+            snudown.markdown(body, nofollow, None) +
+            filters.MD_END + filters.SC_ON
+            for body, nofollow in comments]
+
+
+def main():
+    num_comments = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else .0005
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+    rand = random.Random(0)
+    comments = make_comments(rand, num_comments)
+    g = Globals(latency)
+    pylons.g._push_object(g)
+
+    expected = None
+    results = []
+    for kind in ('snudown', 'cold', 'memcache', 'local'):
+        best = None
+        for i in xrange(repeats):
+            if kind == 'cold':
+                g.remote.clear()
+                g.local.flush_all()
+            elif kind == 'memcache':
+                g.local.flush_all()
+
+            start = time.time()
+            if kind == 'snudown':
+                page = render_snudown(comments)
+            else:
+                page = render_page(comments, prefetch=True)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        if expected is None:
+            expected = page
+        elif page != expected:
+            print "MISMATCH in %s" % kind
+            sys.exit(1)
+        results.append((kind, best))
+
+    # without the prefetch, each body is its own round trip on a miss
+    g.local.flush_all()
+    start = time.time()
+    page = render_page(comments, prefetch=False)
+    results.append(('unbatched', time.time() - start))
+
+    print "%d comments, %.1fms memcache latency" % (num_comments,
+                                                   latency * 1000)
+    for kind, elapsed in results:
+        print "%-10s %8.2fms per page" % (kind, elapsed * 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# The contents of this file are subject to the Common Public Attribution
+# License Version 1.0. (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://code.reddit.com/LICENSE. The License is based on the Mozilla Public
+# License Version 1.1, but Sections 14 and 15 have been added to cover use of
+# software over a computer network and provide for limited attribution for the
+# Original Developer. In addition, Exhibit A has been modified to be consistent
+# with Exhibit B.
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License for
+# the specific language governing rights and limitations under the License.
+#
+# The Original Code is reddit.
+#
+# The Original Developer is the Initial Developer.  The Initial Developer of
+# the Original Code is reddit Inc.
+#
+# All portions of the code written by reddit are Copyright (c) 2006-2012 reddit
+# Inc. All Rights Reserved.
+###############################################################################
+"""Benchmark multi-server get_multi against servers with injected latency.
+
+Starts several fake memcached servers in threads, each of which waits a
+configurable time before answering a request, and compares reading each
+server's response in turn (the old get_multi behaviour) against polling all
+of them at once.
+
+Usage: python memcache_multi.py [servers] [latency ms] [keys] [value size]
+                                [rounds]
+
+"""
+
+import multiprocessing
+import socket
+import sys
+import threading
+import time
+import types
+
+from r2.lib.contrib import memcache
+
+
+class FakeMemcached(object):
+    """Speaks just enough of the memcached text protocol for get and set."""
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.data = {}
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(16)
+        self.address = '127.0.0.1:%d' % self.sock.getsockname()[1]
+
+        # serve from another process so the servers don't compete with the
+        # client for the GIL
+        p = multiprocessing.Process(target=self.serve)
+        p.daemon = True
+        p.start()
+
+    def serve(self):
+        while True:
+            conn, addr = self.sock.accept()
+            t = threading.Thread(target=self.handle, args=(conn,))
+            t.setDaemon(True)
+            t.start()
+
+    def handle(self, conn):
+        f = conn.makefile('rb')
+        while True:
+            line = f.readline()
+            if not line:
+                return
+            parts = line.split()
+            if parts[0] == 'get':
+                response = []
+                for key in parts[1:]:
+                    if key in self.data:
+                        flags, value = self.data[key]
+                        response.append('VALUE %s %d %d\r\n%s\r\n' %
+                                        (key, flags, len(value), value))
+                response.append('END\r\n')
+            elif parts[0] == 'set':
+                key, flags, exptime, length = parts[1:5]
+                value = f.read(int(length) + 2)[:-2]
+                self.data[key] = (int(flags), value)
+                response = ['STORED\r\n']
+            else:
+                response = ['ERROR\r\n']
+
+            if self.latency:
+                time.sleep(self.latency)
+            conn.sendall(''.join(response))
+
+
+def serial_get_multi(client, keys):
+    """get_multi as it was before responses were polled for."""
+    server_keys, prefixed_to_orig_key = client._map_and_prefix_keys(keys, '')
+    for server in server_keys:
+        server.send_cmd("get %s" % " ".join(server_keys[server]))
+
+    retvals = {}
+    for server in server_keys:
+        try:
+            line = server.readline()
+            while line and line != 'END':
+                rkey, flags, rlen = client._expectvalue(server, line)
+                if rkey is not None:
+                    val = client._recv_value(server, flags, rlen)
+                    retvals[prefixed_to_orig_key[rkey]] = val
+                line = server.readline()
+        except (memcache._Error, socket.error), msg:
+            if type(msg) is types.TupleType: msg = msg[1]
+            server.mark_dead(msg)
+    return retvals
+
+
+def bench(label, fn, rounds):
+    start = time.time()
+    for i in xrange(rounds):
+        result = fn()
+    elapsed = time.time() - start
+    print "%-8s %8.2fms per get_multi" % (label, elapsed / rounds * 1000)
+    return result
+
+
+def main():
+    num_servers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.002
+    num_keys = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    value_size = int(sys.argv[4]) if len(sys.argv) > 4 else 1000
+    rounds = int(sys.argv[5]) if len(sys.argv) > 5 else 50
+
+    servers = [FakeMemcached(latency) for i in xrange(num_servers)]
+    client = memcache.Client([s.address for s in servers])
+    keys = ['key_%d' % i for i in xrange(num_keys)]
+    client.set_multi(dict((key, 'x' * value_size) for key in keys))
+
+    print "%d servers, %.1fms latency, %d keys of %d bytes" % (
+        num_servers, latency * 1000, num_keys, value_size)
+    serial = bench('serial', lambda: serial_get_multi(client, keys), rounds)
+    polled = bench('polled', lambda: client.get_multi(keys), rounds)
+    assert serial == polled and len(polled) == num_keys
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# The contents of this file are subject to the Common Public Attribution
+# License Version 1.0. (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://code.reddit.com/LICENSE. The License is based on the Mozilla Public
+# License Version 1.1, but Sections 14 and 15 have been added to cover use of
+# software over a computer network and provide for limited attribution for the
+# Original Developer. In addition, Exhibit A has been modified to be consistent
+# with Exhibit B.
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License for
+# the specific language governing rights and limitations under the License.
+#
+# The Original Code is reddit.
+#
+# The Original Developer is the Initial Developer.  The Initial Developer of
+# the Original Code is reddit Inc.
+#
+# All portions of the code written by reddit are Copyright (c) 2006-2012 reddit
+# Inc. All Rights Reserved.
+###############################################################################
+"""Benchmark merging many sorted cursors, as done by MergeCursor.
+
+Compares the heap-based merge in r2.lib.db.heapmerge against the previous
+implementation, which rescanned every open cursor for each item produced.
+
+Usage: python merge_cursor.py [rows per cursor]
+
+"""
+
+import datetime
+import random
+import sys
+import time
+
+from r2.lib.db import heapmerge
+from r2.lib.db.operators import asc, desc
+
+
+SORTS = [desc("_hot"), desc("_date")]
+
+
+class FakeThing(object):
+    __slots__ = ("_hot", "_date")
+
+    def __init__(self, hot, date):
+        self._hot = hot
+        self._date = date
+
+
+class FakeCursor(object):
+    def __init__(self, items):
+        self.items = iter(items)
+
+    def fetchone(self):
+        return next(self.items)
+
+
+def make_streams(num_cursors, rows):
+    now = datetime.datetime.now()
+    streams = []
+    for i in xrange(num_cursors):
+        items = [FakeThing(round(random.uniform(0, 10000), 7),
+                           now - datetime.timedelta(seconds=random.randint(0, 86400)))
+                 for j in xrange(rows)]
+        items.sort(key=heapmerge.make_sort_key(SORTS))
+        streams.append(items)
+    return streams
+
+
+def linear_merge(cursors, sorts):
+    """The pre-heap merge: rescan all cursors for every item yielded."""
+    def safe_next(c):
+        try:
+            return [c, c.fetchone(), False]
+        except StopIteration:
+            return c, None, True
+
+    pairs = [p for p in (safe_next(c) for c in cursors) if not p[2]]
+    while pairs:
+        yield_pair = pairs[0]
+        for s in sorts:
+            max_fn = min if isinstance(s, asc) else max
+            vals = [(getattr(p[1], s.col), p) for p in pairs]
+            max_pair = vals[0]
+            all_equal = True
+            for pair in vals[1:]:
+                if all_equal and pair[0] != max_pair[0]:
+                    all_equal = False
+                max_pair = max_fn(max_pair, pair, key=lambda x: x[0])
+            if not all_equal:
+                yield_pair = max_pair[1]
+                break
+        c, item, done = yield_pair
+        yield item
+        yield_pair[:] = safe_next(c)
+        pairs = [p for p in pairs if not p[2]]
+
+
+def heap_merge(cursors, sorts):
+    def items(c):
+        while True:
+            try:
+                yield c.fetchone()
+            except StopIteration:
+                return
+    return heapmerge.merge([items(c) for c in cursors],
+                           heapmerge.make_sort_key(sorts))
+
+
+def run(merge_fn, streams):
+    cursors = [FakeCursor(s) for s in streams]
+    start = time.time()
+    count = sum(1 for item in merge_fn(cursors, SORTS))
+    return count, time.time() - start
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    print "%8s %10s %14s %14s" % ("cursors", "rows", "linear rows/s",
+                                  "heap rows/s")
+    for num_cursors in (10, 100, 1000):
+        streams = make_streams(num_cursors, rows)
+        count, linear_time = run(linear_merge, streams)
+        count, heap_time = run(heap_merge, streams)
+        print "%8d %10d %14d %14d" % (num_cursors, count,
+                                      count / linear_time,
+                                      count / heap_time)
+
+
+if __name__ == "__main__":
+    main()
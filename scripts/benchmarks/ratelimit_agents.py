@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# The contents of this file are subject to the Common Public Attribution
+# License Version 1.0. (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://code.reddit.com/LICENSE. The License is based on the Mozilla Public
+# License Version 1.1, but Sections 14 and 15 have been added to cover use of
+# software over a computer network and provide for limited attribution for the
+# Original Developer. In addition, Exhibit A has been modified to be consistent
+# with Exhibit B.
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License for
+# the specific language governing rights and limitations under the License.
+#
+# The Original Code is reddit.
+#
+# The Original Developer is the Initial Developer.  The Initial Developer of
+# the Original Code is reddit Inc.
+#
+# All portions of the code written by reddit are Copyright (c) 2006-2012 reddit
+# Inc. All Rights Reserved.
+###############################################################################
+"""Benchmark matching user agents against the rate limited agents.
+
+Generates a few thousand configured agent substrings (g.agents) and a set
+of user agents, a third of which contain one of them, and times finding
+the agents in each user agent the old way (a substring search per
+configured agent) and with r2.lib.ratelimit.AgentMatcher. The matches
+found by both are compared.
+
+Usage: python ratelimit_agents.py [agents] [user_agents]
+
+Run it from the r2 directory so that r2.lib.ratelimit can be imported.
+
+"""
+
+import random
+import sys
+import time
+
+from r2.lib import ratelimit
+
+
+CHARS = 'abcdefghijklmnopqrstuvwxyz0123456789-_/.'
+BROWSERS = ('mozilla/5.0 (windows nt 6.1; wow64) applewebkit/537.36 '
+            '(khtml, like gecko) chrome/%d.0.1500.%d safari/537.36',
+            'mozilla/5.0 (macintosh; intel mac os x 10_8_4) '
+            'applewebkit/536.30.1 (khtml, like gecko) version/6.0.5 '
+            'safari/536.30.%d',
+            'python-requests/1.%d.%d cpython/2.7.3 linux/3.2.0')
+
+
+def make_agents(rand, count):
+    agents = ['bot', 'crawler', 'spider', 'curl', 'wget', 'scrapy']
+    while len(agents) < count:
+        agents.append(''.join(rand.choice(CHARS)
+                              for i in xrange(rand.randint(4, 24))))
+    return tuple(agents)
+
+
+def make_user_agents(rand, agents, count):
+    user_agents = []
+    for i in xrange(count):
+        browser = rand.choice(BROWSERS)
+        user_agent = browser % tuple(rand.randint(0, 99)
+                                     for j in xrange(browser.count('%d')))
+        if rand.random() < 0.33:
+            user_agent += ' ' + rand.choice(agents)
+        user_agents.append(user_agent)
+    return user_agents
+
+
+def substring_search(agents, user_agent):
+    # what ratelimit_agents used to do
+    found = []
+    for s in agents:
+        if s and user_agent and s in user_agent and s not in found:
+            found.append(s)
+    return found
+
+
+def timed(fn, user_agents):
+    start = time.time()
+    results = [fn(user_agent) for user_agent in user_agents]
+    return results, time.time() - start
+
+
+def main():
+    num_agents = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    num_user_agents = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+
+    rand = random.Random(0)
+    agents = make_agents(rand, num_agents)
+    user_agents = make_user_agents(rand, agents, num_user_agents)
+
+    start = time.time()
+    matcher = ratelimit.AgentMatcher(agents)
+    print "built matcher for %d agents in %.3fs" % (len(agents),
+                                                    time.time() - start)
+
+    old, old_time = timed(lambda ua: substring_search(agents, ua),
+                          user_agents)
+    new, new_time = timed(matcher.match, user_agents)
+
+    for kind, elapsed in (('substring search', old_time),
+                          ('AgentMatcher', new_time)):
+        print "%-16s %8.1fus per user agent" % (
+            kind, elapsed / len(user_agents) * 1e6)
+
+    if old != new:
+        print "MISMATCH"
+        sys.exit(1)
+    print "matches are identical"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# The contents of this file are subject to the Common Public Attribution
+# License Version 1.0. (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://code.reddit.com/LICENSE. The License is based on the Mozilla Public
+# License Version 1.1, but Sections 14 and 15 have been added to cover use of
+# software over a computer network and provide for limited attribution for the
+# Original Developer. In addition, Exhibit A has been modified to be consistent
+# with Exhibit B.
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License for
+# the specific language governing rights and limitations under the License.
+#
+# The Original Code is reddit.
+#
+# The Original Developer is the Initial Developer.  The Initial Developer of
+# the Original Code is reddit Inc.
+#
+# All portions of the code written by reddit are Copyright (c) 2006-2012 reddit
+# Inc. All Rights Reserved.
+###############################################################################
+"""Benchmark splicing the templates of a large comment page together.
+
+Builds what a page of comments renders to: the page, and one cachable
+template per comment with a couple of kw args (like the ones
+replace_render passes), including the child listing which holds the stubs
+of its replies. Then it times splicing these into the final page the way
+Templated._render did with the regex-based StringTemplate (substitute the
+stubs, and repeat over the page until none are left), and with the
+segmented StringTemplate and _StubResolver.render. The pages produced are
+compared.
+
+Usage: python string_template.py [comments] [repeats]
+
+Run it from the r2 directory after building the extensions (python
+setup.py build_ext --inplace) so that r2.lib.wrapped can be imported.
+
+"""
+
+import random
+import sys
+import time
+
+from r2.lib.wrapped import StringTemplate, _StubResolver
+
+
+class RegexTemplate(object):
+    """StringTemplate as it was: a regex substitution per update."""
+    start_delim = StringTemplate.start_delim
+    end_delim = StringTemplate.end_delim
+    pattern2 = StringTemplate.pattern2
+
+    def __init__(self, template):
+        self.template = unicode(template)
+
+    def update(self, d):
+        if d:
+            def convert(m):
+                name = m.group("named")
+                return d.get(name, self.start_delim + name + self.end_delim)
+            return self.__class__(self.pattern2.sub(convert, self.template))
+        return self
+
+    def finalize(self, d = {}):
+        return self.update(d).template
+
+
+class RegexResolver(object):
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.finals = {}
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def get(self, name, default = None):
+        if name not in self.nodes:
+            return default
+        final = self.finals.get(name)
+        if final is None:
+            template, kw = self.nodes[name]
+            final = template.update(self).finalize(kw)
+            self.finals[name] = final
+        return final
+
+
+def render_regex(page, comments, kw):
+    nodes = {}
+    for name, (text, node_kw) in comments.iteritems():
+        nodes[name] = (RegexTemplate(text), node_kw)
+    resolver = RegexResolver(nodes)
+    res = RegexTemplate(page).update(kw).update(resolver).finalize()
+    while True:
+        names = [m.group("named")
+                 for m in RegexTemplate.pattern2.finditer(res)]
+        if not any(name in nodes for name in names):
+            return res
+        res = RegexTemplate(res).update(resolver).finalize()
+
+
+def render_segments(page, comments, kw):
+    nodes = {}
+    for name, (text, node_kw) in comments.iteritems():
+        nodes[name] = (StringTemplate(text), node_kw)
+    resolver = _StubResolver(nodes)
+    return resolver.render(StringTemplate(page), kw)
+
+
+COMMENT = (u'<div class="thing id-t1_%(id)s comment <$>likes</$>">'
+           u'<div class="midcol"><div class="arrow up"></div>'
+           u'<div class="arrow down"></div></div>'
+           u'<div class="entry"><p class="tagline">'
+           u'<a href="/user/someone" class="author">someone</a> '
+           u'<span class="score"><$>score</$> points</span> '
+           u'<time><$>timesince</$> ago</time></p>'
+           u'<div class="usertext-body"><div class="md"><p>%(body)s</p>'
+           u'</div></div><ul class="flat-list buttons">'
+           u'<li><a href="/r/pics/comments/abc/x/%(id)s">permalink</a></li>'
+           u'<li><a href="javascript:void(0)">reply</a></li></ul></div>'
+           u'<div class="child"><$>childlisting</$></div></div>')
+
+
+def stub(i):
+    return u'%sh%d%s' % (StringTemplate.start_delim, i,
+                         StringTemplate.end_delim)
+
+
+def make_page(rand, num_comments):
+    children = {}
+    for i in xrange(num_comments):
+        parent = rand.choice([None] + range(max(0, i - 50), i))
+        children.setdefault(parent, []).append(i)
+
+    words = [''.join(rand.choice('abcdefghij') for j in xrange(6))
+             for i in xrange(200)]
+    comments = {}
+    for i in xrange(num_comments):
+        body = ' '.join(rand.choice(words)
+                        for j in xrange(rand.randint(5, 80)))
+        text = COMMENT % dict(id = i, body = body)
+        replies = children.get(i)
+        kw = dict(likes = rand.choice(['likes', 'dislikes', 'unvoted']),
+                  score = unicode(rand.randint(-5, 500)),
+                  timesince = u'%d hours' % rand.randint(1, 23),
+                  childlisting = (u''.join(stub(c) for c in replies)
+                                  if replies else None))
+        comments['h%d' % i] = (text, kw)
+
+    page = (u'<html><body><div class="content"><div class="sitetable">'
+            u'%s</div></div><$>footer</$></body></html>' %
+            ''.join(stub(c) for c in children[None]))
+    kw = dict(footer = u'<div class="footer"></div>')
+    return page, comments, kw
+
+
+def timed(render, page, comments, kw, repeats):
+    best = None
+    for i in xrange(repeats):
+        start = time.time()
+        result = render(page, comments, kw)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    num_comments = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    rand = random.Random(0)
+    page, comments, kw = make_page(rand, num_comments)
+
+    old, old_time = timed(render_regex, page, comments, kw, repeats)
+    new, new_time = timed(render_segments, page, comments, kw, repeats)
+
+    print "%d comments, %d characters rendered" % (num_comments, len(new))
+    for kind, elapsed in (('regex', old_time), ('segments', new_time)):
+        print "%-10s %8.2fms per page" % (kind, elapsed * 1000)
+
+    if old != new:
+        print "MISMATCH"
+        sys.exit(1)
+    print "pages are identical"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# The contents of this file are subject to the Common Public Attribution
+# License Version 1.0. (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://code.reddit.com/LICENSE. The License is based on the Mozilla Public
+# License Version 1.1, but Sections 14 and 15 have been added to cover use of
+# software over a computer network and provide for limited attribution for the
+# Original Developer. In addition, Exhibit A has been modified to be consistent
+# with Exhibit B.
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License for
+# the specific language governing rights and limitations under the License.
+#
+# The Original Code is reddit.
+#
+# The Original Developer is the Initial Developer.  The Initial Developer of
+# the Original Code is reddit Inc.
+#
+# All portions of the code written by reddit are Copyright (c) 2006-2012 reddit
+# Inc. All Rights Reserved.
+###############################################################################
+"""Benchmark loading things with their data in bulk.
+
+Fills a database with things shaped like tdb_sql's thing and data tables,
+then loads all of them in chunks two ways: a query against the thing table
+and another against the data table per chunk (what _byID and _load_multi
+do on a cache miss), and a single streamed outer join per chunk (what
+tdb_sql.get_things_with_data does).
+
+Usage: python thing_loader.py [things] [chunk size] [database url]
+
+The database defaults to a temporary SQLite file; pass a postgres url to
+measure with real round trips.
+
+"""
+
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+import sqlalchemy as sa
+
+
+DATA_KEYS = ('title', 'url', 'author_id', 'sr_id', 'num_comments')
+
+
+def make_tables(engine):
+    metadata = sa.MetaData(engine)
+    thing = sa.Table('bench_thing_link', metadata,
+                     sa.Column('thing_id', sa.BigInteger, primary_key=True),
+                     sa.Column('ups', sa.Integer, nullable=False),
+                     sa.Column('downs', sa.Integer, nullable=False),
+                     sa.Column('deleted', sa.Boolean, nullable=False),
+                     sa.Column('spam', sa.Boolean, nullable=False),
+                     sa.Column('date', sa.DateTime, nullable=False))
+    data = sa.Table('bench_data_link', metadata,
+                    sa.Column('thing_id', sa.BigInteger, primary_key=True),
+                    sa.Column('key', sa.String, primary_key=True),
+                    sa.Column('value', sa.String),
+                    sa.Column('kind', sa.String))
+    metadata.drop_all()
+    metadata.create_all()
+    return thing, data
+
+
+def fill(engine, thing, data, count, batch=10000):
+    now = datetime.datetime.now()
+    for start in xrange(1, count + 1, batch):
+        ids = range(start, min(start + batch, count + 1))
+        conn = engine.connect()
+        trans = conn.begin()
+        conn.execute(thing.insert(), [
+            dict(thing_id=i, ups=random.randint(0, 1000),
+                 downs=random.randint(0, 100), deleted=False, spam=False,
+                 date=now) for i in ids])
+        conn.execute(data.insert(), [
+            dict(thing_id=i, key=key, value=str(random.random()), kind='str')
+            for i in ids for key in DATA_KEYS])
+        trans.commit()
+        conn.close()
+
+
+def load_separately(thing, data, ids):
+    things = {}
+    rows = sa.select([thing], thing.c.thing_id.in_(ids)).execute().fetchall()
+    for row in rows:
+        things[row.thing_id] = (dict(ups=row.ups, downs=row.downs,
+                                     date=row.date, deleted=row.deleted,
+                                     spam=row.spam), {})
+    rows = sa.select([data], data.c.thing_id.in_(ids)).execute().fetchall()
+    for row in rows:
+        things[row.thing_id][1][row.key] = row.value
+    return [things[i] for i in ids if i in things]
+
+
+def load_joined(thing, data, ids):
+    joined = thing.outerjoin(data, data.c.thing_id == thing.c.thing_id)
+    s = sa.select([thing.c.thing_id, thing.c.ups, thing.c.downs, thing.c.date,
+                   thing.c.deleted, thing.c.spam,
+                   data.c.key, data.c.value, data.c.kind],
+                  thing.c.thing_id.in_(ids), from_obj=[joined],
+                  order_by=thing.c.thing_id)
+    s = s.execution_options(stream_results=True)
+
+    things = {}
+    current = None
+    r = s.execute()
+    while True:
+        rows = r.fetchmany(1000)
+        if not rows:
+            break
+        for thing_id, ups, downs, date, deleted, spam, key, value, kind in rows:
+            if thing_id != current:
+                current = thing_id
+                props = dict(ups=ups, downs=downs, date=date,
+                             deleted=deleted, spam=spam)
+                values = {}
+                things[thing_id] = (props, values)
+            if key is not None:
+                values[key] = value
+    return [things[i] for i in ids if i in things]
+
+
+def bench(label, fn, thing, data, count, chunk_size):
+    start = time.time()
+    loaded = []
+    for chunk_start in xrange(1, count + 1, chunk_size):
+        ids = range(chunk_start, min(chunk_start + chunk_size, count + 1))
+        loaded.extend(fn(thing, data, ids))
+    elapsed = time.time() - start
+    print "%-10s %8.2fs (%d things/s)" % (label, elapsed, count / elapsed)
+    return loaded
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    if len(sys.argv) > 3:
+        url = sys.argv[3]
+        path = None
+    else:
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        url = 'sqlite:///' + path
+
+    try:
+        engine = sa.create_engine(url)
+        thing, data = make_tables(engine)
+        start = time.time()
+        fill(engine, thing, data, count)
+        print "filled %d things in %.2fs" % (count, time.time() - start)
+
+        separate = bench('separate', load_separately, thing, data, count,
+                         chunk_size)
+        joined = bench('joined', load_joined, thing, data, count, chunk_size)
+        assert separate == joined
+    finally:
+        if path:
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# The contents of this file are subject to the Common Public Attribution
+# License Version 1.0. (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://code.reddit.com/LICENSE. The License is based on the Mozilla Public
+# License Version 1.1, but Sections 14 and 15 have been added to cover use of
+# software over a computer network and provide for limited attribution for the
+# Original Developer. In addition, Exhibit A has been modified to be consistent
+# with Exhibit B.
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License for
+# the specific language governing rights and limitations under the License.
+#
+# The Original Code is reddit.
+#
+# The Original Developer is the Initial Developer.  The Initial Developer of
+# the Original Code is reddit Inc.
+#
+# All portions of the code written by reddit are Copyright (c) 2006-2012 reddit
+# Inc. All Rights Reserved.
+###############################################################################
+"""Benchmark looking up request addresses in the throttled networks.
+
+Makes up a set of throttled networks of various sizes and times checking
+addresses against them two ways: building an ipaddress object and testing
+it against each network (find_containing_network, which is_throttled used
+to call) and a binary search of a NetworkIndex built from them. Both must
+agree on every address.
+
+Usage: python throttle_index.py [networks] [addresses]
+
+Run it from the r2 directory after building the extensions (python
+setup.py build_ext --inplace) so that r2.lib.utils can be imported.
+
+"""
+
+import random
+import socket
+import struct
+import sys
+import time
+
+from r2.lib.contrib import ipaddress
+from r2.lib.utils import NetworkIndex, find_containing_network
+
+
+def random_ip(rand):
+    return socket.inet_ntoa(struct.pack('!I', rand.getrandbits(32)))
+
+
+def make_networks(rand, count):
+    networks = []
+    for i in xrange(count):
+        prefix = rand.choice((16, 20, 24, 24, 28, 32, 32, 32))
+        network = u'%s/%d' % (random_ip(rand), prefix)
+        networks.append(ipaddress.ip_network(network, strict=False))
+    return list(ipaddress.collapse_addresses(networks))
+
+
+def make_addresses(rand, networks, count):
+    addresses = []
+    for i in xrange(count):
+        if rand.random() < .1:
+            # an address inside one of the networks
+            network = rand.choice(networks)
+            offset = rand.randint(0, network.num_addresses - 1)
+            address = int(network.network_address) + offset
+            addresses.append(socket.inet_ntoa(struct.pack('!I', address)))
+        else:
+            addresses.append(random_ip(rand))
+    return addresses
+
+
+def timed(fn, addresses):
+    start = time.time()
+    results = [fn(address) for address in addresses]
+    return results, time.time() - start
+
+
+def main():
+    num_networks = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    num_addresses = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    rand = random.Random(0)
+    networks = make_networks(rand, num_networks)
+    addresses = make_addresses(rand, networks, num_addresses)
+
+    start = time.time()
+    index = NetworkIndex(networks)
+    build_time = time.time() - start
+
+    linear, linear_time = timed(
+        lambda a: bool(find_containing_network(networks, a)), addresses)
+    indexed, indexed_time = timed(lambda a: a in index, addresses)
+
+    print "%d networks, %d addresses, %d throttled" % (
+        len(networks), num_addresses, sum(indexed))
+    print "index built in %.2fms" % (build_time * 1000)
+    for kind, elapsed in (('linear', linear_time), ('index', indexed_time)):
+        print "%-8s %10.2fus per lookup" % (
+            kind, elapsed * 1000000 / num_addresses)
+
+    if linear != indexed:
+        print "MISMATCH"
+        sys.exit(1)
+    print "results are identical"
+
+
+if __name__ == '__main__':
+    main()
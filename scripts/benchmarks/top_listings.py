@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# The contents of this file are subject to the Common Public Attribution
+# License Version 1.0. (the "License"); you may not use this file except in
+# compliance with the License. You may obtain a copy of the License at
+# http://code.reddit.com/LICENSE. The License is based on the Mozilla Public
+# License Version 1.1, but Sections 14 and 15 have been added to cover use of
+# software over a computer network and provide for limited attribution for the
+# Original Developer. In addition, Exhibit A has been modified to be consistent
+# with Exhibit B.
+#
+# Software distributed under the License is distributed on an "AS IS" basis,
+# WITHOUT WARRANTY OF ANY KIND, either express or implied. See the License for
+# the specific language governing rights and limitations under the License.
+#
+# The Original Code is reddit.
+#
+# The Original Developer is the Initial Developer.  The Initial Developer of
+# the Original Code is reddit Inc.
+#
+# All portions of the code written by reddit are Copyright (c) 2006-2012 reddit
+# Inc. All Rights Reserved.
+###############################################################################
+"""Benchmark building the time-filtered top/controversial listings.
+
+Writes a synthetic dump of joined links in the format that mr_top reads,
+then builds the top 1000 of every listing two ways: the old pipeline of
+a mapper, an external `sort` and mr_reduce_max_per_key, and the
+sort-free mr_max_per_key_parallel that mr_top.top_listings uses. The
+listings produced by both, fullnames included, are compared. The new
+pipeline breaks ties on (value, timestamp) by fullname, so the old one is
+given the same sort key here.
+
+Usage: python top_listings.py [rows] [workers]
+
+Run it from the r2 directory after building the extensions (python
+setup.py build_ext --inplace) so that r2.lib.mr_tools can be imported.
+
+"""
+
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from r2.lib import mr_tools
+
+
+NUM = 1000
+TIMES = (('hour', 3600), ('day', 86400), ('week', 7 * 86400),
+         ('month', 30 * 86400), ('year', 365 * 86400))
+
+
+def write_dump(path, rows, now):
+    rand = random.Random(0)
+    with open(path, 'w') as f:
+        for thing_id in xrange(1, rows + 1):
+            # a few big subreddits and domains and a long tail of small
+            # ones, like the real thing
+            sr_id = int(rand.paretovariate(0.5)) % 100000
+            domain = 'site%d.com' % (int(rand.paretovariate(0.4)) % 500000)
+            if rand.random() < 0.2:
+                domain = 'www.' + domain
+            ups = int(rand.expovariate(0.01))
+            downs = int(rand.expovariate(0.05))
+            timestamp = now - rand.uniform(0, 365 * 86400)
+            f.write('%d\tlink\t%d\t%d\tf\tf\t%.3f\thttp://%s/%d\t%d\n'
+                    % (thing_id, ups, downs, timestamp, domain, thing_id,
+                       sr_id))
+
+
+def listing_items(lines, now):
+    # what mr_top._listing_items does, without needing the models
+    for line in lines:
+        (thing_id, thing_type, ups, downs, deleted, spam, timestamp,
+         url, sr_id) = line.rstrip('\n').split('\t')
+        ups, downs, timestamp = int(ups), int(downs), float(timestamp)
+        score = ups - downs
+        contr = float(ups + downs) / max(abs(score), 1)
+        fname = 't3_%s' % thing_id
+        domain = url.split('/')[2]
+        domains = [domain]
+        if domain.startswith('www.'):
+            domains.append(domain[4:])
+
+        for tkey, age in TIMES:
+            if timestamp > now - age:
+                yield ('sr-top-%s-%s' % (tkey, sr_id),
+                       (score, timestamp, fname))
+                yield ('sr-controversial-%s-%s' % (tkey, sr_id),
+                       (contr, timestamp, fname))
+                for domain in domains:
+                    yield ('domain/top/%s/%s' % (tkey, domain),
+                           (score, timestamp, fname))
+                    yield ('domain/controversial/%s/%s' % (tkey, domain),
+                           (contr, timestamp, fname))
+
+
+def old_pipeline(dump, tmpdir, now):
+    mapped = os.path.join(tmpdir, 'mapped')
+    start = time.time()
+    with open(dump) as f:
+        with open(mapped, 'w') as out:
+            for key, (value, timestamp, fname) in listing_items(f, now):
+                out.write('%s\t%r\t%r\t%s\n' % (key, value, timestamp, fname))
+    mapped_at = time.time()
+
+    sorted_path = os.path.join(tmpdir, 'sorted')
+    subprocess.check_call(['sort', '-T', tmpdir, '-S200m', '-o', sorted_path,
+                           mapped], env=dict(os.environ, LC_ALL='C'))
+    sorted_at = time.time()
+
+    listings = {}
+    def post(key, maxes):
+        listings[key] = [(float(v), float(t), fname) for v, t, fname in maxes]
+    with open(sorted_path) as f:
+        mr_tools.mr_reduce_max_per_key(
+            lambda x: (float(x[0]), float(x[1]), x[2]),
+            num=NUM, post=post, fd=f)
+    done = time.time()
+
+    print ("old: %.2fs (map %.2fs, sort %.2fs, reduce %.2fs)"
+           % (done - start, mapped_at - start, sorted_at - mapped_at,
+              done - sorted_at))
+    return listings
+
+
+def new_pipeline(dump, workers, now):
+    listings = {}
+    def post(results):
+        for key, items in results:
+            listings[key] = [(float(v), float(t), fname)
+                             for v, t, fname in items]
+
+    start = time.time()
+    with open(dump) as f:
+        mr_tools.mr_max_per_key_parallel(lambda lines: listing_items(lines,
+                                                                     now),
+                                         post, num=NUM, fd=f,
+                                         workers=workers, chunk_size=10000)
+    print "new: %.2fs (%d workers)" % (time.time() - start, workers)
+    return listings
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50000000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    if workers is None:
+        import multiprocessing
+        workers = multiprocessing.cpu_count()
+
+    now = time.time()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        dump = os.path.join(tmpdir, 'links.joined')
+        start = time.time()
+        write_dump(dump, rows, now)
+        print "wrote %d rows in %.2fs" % (rows, time.time() - start)
+
+        old = old_pipeline(dump, tmpdir, now)
+        new = new_pipeline(dump, workers, now)
+        assert old == new, "the listings differ"
+        print "%d listings match" % len(new)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -94,8 +94,6 @@ function f {
 cat $FNAME $DNAME | \
     mrsort | \
     f "join_links()" | \
-    f "time_listings($LISTINGS)" | \
-    mrsort | \
-    f "write_permacache()"
+    f "top_listings($LISTINGS)"
 
 rm $FNAME $DNAME